@@ -0,0 +1,231 @@
+"""Analytics of saved rate history: cross rates, daily returns and window statistics. History is loaded from the
+database once into typed arrays (one float64 column per currency, rates of one currency unit, NaN if rate is missing
+at the date), all computations work on these columns.
+
+Rolling statistics are computed in one pass over the column (running sums and monotonic queues), so their cost does
+not depend on window size.
+
+.. moduleauthor:: Max Dubrovin <mihadxdx@gmail.com>
+
+"""
+
+import math
+import sqlite3
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+
+from db_controller import db_date
+from export import currency_columns, matrix_rows
+
+
+RUB = '643'  # numeric code of russian ruble, all saved rates are rates in rubles
+NAN = float('nan')
+
+
+def returns(values, log=False):
+    """Daily returns of series: values[i] / values[i - 1] - 1 (or logarithm of ratio)
+
+    :param values: Sequence of floats (NaN - missing value)
+    :param log: If True logarithmic returns are computed
+    :return: array of len(values) - 1 returns, NaN if any of two values is missing
+    """
+    result = array('d')
+    for previous, current in zip(values, values[1:]):
+        if previous > 0 and current > 0:  # NaN comparisons are always False
+            result.append(math.log(current / previous) if log else current / previous - 1)
+        else:
+            result.append(NAN)
+    return result
+
+
+def rolling_mean(values, window):
+    """Mean of every window of series
+
+    :return: array of len(values) - window + 1 means, NaN if window contains missing value
+    """
+    result = array('d')
+    total, missing = 0.0, 0
+    for index, value in enumerate(values):
+        if value == value:
+            total += value
+        else:
+            missing += 1
+        if index >= window:
+            old = values[index - window]
+            if old == old:
+                total -= old
+            else:
+                missing -= 1
+        if index >= window - 1:
+            result.append(total / window if not missing else NAN)
+    return result
+
+
+def rolling_std(values, window):
+    """Sample standard deviation of every window of series
+
+    :return: array of len(values) - window + 1 deviations, NaN if window contains missing value
+    """
+    if window < 2:
+        raise ValueError('Window of standard deviation must contain at least 2 values')
+    result = array('d')
+    total, squares, missing = 0.0, 0.0, 0
+    for index, value in enumerate(values):
+        if value == value:
+            total += value
+            squares += value * value
+        else:
+            missing += 1
+        if index >= window:
+            old = values[index - window]
+            if old == old:
+                total -= old
+                squares -= old * old
+            else:
+                missing -= 1
+        if index >= window - 1:
+            if missing:
+                result.append(NAN)
+            else:
+                result.append(math.sqrt(max(0.0, (squares - total * total / window) / (window - 1))))
+    return result
+
+
+def rolling_extreme(values, window, maximum=False):
+    """Minimum (or maximum) of every window of series. Monotonic queue of candidate indexes is used.
+
+    :return: array of len(values) - window + 1 extremes, NaN if window contains missing value
+    """
+    result = array('d')
+    candidates = deque()
+    last_missing = -window
+    for index, value in enumerate(values):
+        if value != value:
+            last_missing = index
+        else:
+            while candidates and (values[candidates[-1]] <= value if maximum else values[candidates[-1]] >= value):
+                candidates.pop()
+            candidates.append(index)
+        if candidates and candidates[0] <= index - window:
+            candidates.popleft()
+        if index >= window - 1:
+            result.append(values[candidates[0]] if last_missing <= index - window else NAN)
+    return result
+
+
+def rolling_min(values, window):
+    return rolling_extreme(values, window)
+
+
+def rolling_max(values, window):
+    return rolling_extreme(values, window, maximum=True)
+
+
+class RateHistory:
+    """Rate history of several currencies loaded into memory
+
+    :param dates: YYYYMMDD dates of history rows (sorted from oldest)
+    :param columns: Dict of numeric code and array of rates of one currency unit (one item per date)
+    """
+    def __init__(self, dates, columns):
+        self.dates = dates
+        self.columns = columns
+        self.columns.setdefault(RUB, array('d', [1.0]) * len(dates))
+
+    @classmethod
+    def load(cls, db_file, date_from=None, date_to=None, codes=None):
+        """Load history from database
+
+        :param db_file: Path of SQLite database (it is opened in read-only mode)
+        :param date_from: First date in DD.MM.YYYY format (None - from the earliest saved date)
+        :param date_to: Last date in DD.MM.YYYY format (None - till the latest saved date)
+        :param codes: List of numeric codes (None - all currencies)
+        """
+        date_from = db_date(date_from) if date_from else '00000000'
+        date_to = db_date(date_to) if date_to else '99999999'
+        con = sqlite3.connect(f'file:{db_file}?mode=ro', uri=True)
+        try:
+            codes_order = [column['numeric_code'] for column in currency_columns(con, date_from, date_to, codes)]
+            dates, arrays = [], [array('d') for _ in codes_order]
+            for date, values in matrix_rows(con, codes_order, date_from, date_to, codes):
+                dates.append(date)
+                for column, value in zip(arrays, values):
+                    column.append(NAN if value is None else value)
+        finally:
+            con.close()
+        return cls(dates, dict(zip(codes_order, arrays)))
+
+    @property
+    def codes(self):
+        return list(self.columns)
+
+    def index(self, date):
+        """Row of currency set which is valid at the date (the last one on or before it)
+
+        :param date: Date in DD.MM.YYYY format
+        :raises KeyError: if history starts later than the date
+        """
+        index = bisect_right(self.dates, db_date(date)) - 1
+        if index < 0:
+            raise KeyError(date)
+        return index
+
+    def window(self, date_from=None, date_to=None):
+        """Slice of rows of date range (both dates are included, None - history bound)"""
+        start = bisect_left(self.dates, db_date(date_from)) if date_from else 0
+        stop = bisect_right(self.dates, db_date(date_to)) if date_to else len(self.dates)
+        return slice(start, stop)
+
+    def rate(self, code, date):
+        """Rate of one currency unit in rubles valid at the date"""
+        return self.columns[code][self.index(date)]
+
+    def cross_rate(self, base, quote):
+        """Series of cross rate: count of quote currency units for one unit of base currency (for example EUR/USD is
+        cross_rate('978', '840'))
+
+        :return: array of rates (one item per date), NaN if any rate is missing
+        """
+        return array('d', (b / q if q > 0 else NAN for b, q in zip(self.columns[base], self.columns[quote])))
+
+    def cross_matrix(self, date, codes=None):
+        """Cross rates of all currency pairs at the date
+
+        :param date: Date in DD.MM.YYYY format
+        :param codes: Numeric codes of matrix rows and columns (None - all currencies)
+        :return: list of rows, matrix[i][j] is count of codes[j] units for one unit of codes[i]
+        """
+        index = self.index(date)
+        rates = [self.columns[code][index] for code in (codes or self.codes)]
+        return [[base / quote if quote > 0 else NAN for quote in rates] for base in rates]
+
+    def returns(self, code, log=False):
+        """Daily returns of currency rate (one item less than dates)"""
+        return returns(self.columns[code], log)
+
+    def volatility(self, code, window, log=True):
+        """Rolling volatility: standard deviation of daily returns in every window of returns"""
+        return rolling_std(self.returns(code, log), window)
+
+    def rolling(self, code, window):
+        """Rolling statistics of currency rate
+
+        :return: dict of 'min', 'max' and 'mean' arrays, item i is statistic of rows i..i + window - 1
+        """
+        values = self.columns[code]
+        return {
+            'min': rolling_min(values, window),
+            'max': rolling_max(values, window),
+            'mean': rolling_mean(values, window),
+        }
+
+    def stats(self, code, date_from=None, date_to=None):
+        """Statistics of currency rate in date range (missing values are skipped)
+
+        :return: dict of count, min, max and mean (None if there are no values)
+        """
+        values = [value for value in self.columns[code][self.window(date_from, date_to)] if value == value]
+        if not values:
+            return {'count': 0, 'min': None, 'max': None, 'mean': None}
+        return {'count': len(values), 'min': min(values), 'max': max(values), 'mean': math.fsum(values) / len(values)}
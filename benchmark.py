@@ -0,0 +1,263 @@
+"""Performance benchmarks of service parts. Results are printed and saved as JSON (--output option), so runs can be
+compared. Usage:
+
+    python benchmark.py --mode=parser [--currencies=40] [--repeat=200]
+    python benchmark.py --mode=e2e [--currencies=40] [--days=60] [--latency=0.01] [--workers=8]
+    python benchmark.py --mode=sqlite [--currencies=40] [--days=1000] [--commit-interval=100] [--dir=.]
+    python benchmark.py --mode=memory [--currencies=40] [--days=1000]
+
+.. moduleauthor:: Max Dubrovin <mihadxdx@gmail.com>
+
+"""
+
+import datetime as dt
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from cbr_stub import StubServer, synthetic_response
+from db_controller import DbController
+from logger import Logger
+from metrics import percentile
+from pretty_table import print_pretty_table
+from soap_client import SoapClient, SoapTemplate
+from xml_parser import parse_curs_on_date, parse_curs_on_date_regex, xml_date
+
+
+def options():
+    """Extract --name=value options of benchmark launch
+
+    :return: dictionary (keys are option names, values - related values)
+    """
+    return dict(arg[2:].partition('=')[::2] for arg in sys.argv[1:] if arg.startswith('--'))
+
+
+def timed(function, repeat):
+    """Call function several times
+
+    :return: average duration of call in seconds
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def stage_stats(durations, wall_seconds):
+    """Summary of one pipeline stage
+
+    :param durations: Durations of every call in seconds
+    :param wall_seconds: Elapsed time of the whole stage
+    :return: dict of count, throughput (calls per second), p50 and p99 latency (milliseconds)
+    """
+    return {
+        'count': len(durations),
+        'seconds': round(wall_seconds, 6),
+        'throughput': round(len(durations) / wall_seconds, 1) if wall_seconds else None,
+        'p50_ms': round(percentile(durations, 50) * 1000, 3),
+        'p99_ms': round(percentile(durations, 99) * 1000, 3),
+    }
+
+
+def stats_table(stages: dict):
+    """Build printable table of stage summaries"""
+    table = [['Stage', 'Count', 'Seconds', 'Per second', 'p50, ms', 'p99, ms']]
+    for name, stats in stages.items():
+        table.append([name] + [str(stats[key]) for key in ('count', 'seconds', 'throughput', 'p50_ms', 'p99_ms')])
+    return table
+
+
+def parser_benchmark(currencies, repeat):
+    """Compare streaming and regex parsers of GetCursOnDateXML response
+
+    :param currencies: Count of currencies in response
+    :param repeat: Count of parses for every parser
+    :return: tuple of result dict and printable table
+    """
+    data = synthetic_response('20210511', currencies)
+    assert parse_curs_on_date(data) == parse_curs_on_date_regex(data.decode('utf-8'))
+
+    variants = [
+        ('regex (decode + tag_content)', lambda: parse_curs_on_date_regex(data.decode('utf-8'))),
+        ('expat (bytes)', lambda: parse_curs_on_date(data)),
+        ('expat (file-like, by chunks)', lambda: parse_curs_on_date(io.BytesIO(data))),
+    ]
+    result = {'response_bytes': len(data), 'parsers': {}}
+    table = [['Parser', 'Response size', 'ms per response', 'MB/s']]
+    for name, function in variants:
+        seconds = timed(function, repeat)
+        result['parsers'][name] = {'ms': round(seconds * 1000, 3), 'mb_per_s': round(len(data) / seconds / 1e6, 1)}
+        table.append([name, f'{len(data)} bytes', f'{seconds * 1000:.3f}', f'{len(data) / seconds / 1e6:.1f}'])
+    return result, table
+
+
+def e2e_benchmark(currencies, days, latency, workers):
+    """Measure fetch, parse and write stages separately against local stub web service
+
+    :param currencies: Count of currencies in every response
+    :param days: Count of requested dates
+    :param latency: Stub response delay in seconds
+    :param workers: Count of concurrent requests at fetch stage
+    :return: tuple of result dict and printable table
+    """
+    logger = Logger('benchmark.log', enable=False)
+    server = StubServer(currencies=currencies, latency=latency, weekends=False).serve_in_thread()
+    client = SoapClient(server.url, logger, pool_size=workers)
+    template = SoapTemplate('soap-template.xml')
+    first = dt.date(2000, 1, 1)
+    dates = [(first + dt.timedelta(days=n)).strftime('%d.%m.%Y') for n in range(days)]
+
+    def fetch(date):
+        start = time.perf_counter()
+        data = client.post(template.render(date=xml_date(date)))
+        return data, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        fetched = list(executor.map(fetch, dates))
+    fetch_stats = stage_stats([seconds for _, seconds in fetched], time.perf_counter() - start)
+    client.close()
+    server.stop()
+
+    payloads, durations = [], []
+    start = time.perf_counter()
+    for data, _ in fetched:
+        call_start = time.perf_counter()
+        ondate, rows = parse_curs_on_date(data)
+        payloads.append({'date': ondate, 'rows': rows})
+        durations.append(time.perf_counter() - call_start)
+    parse_stats = stage_stats(durations, time.perf_counter() - start)
+
+    db_file = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    db = DbController(db_file, logger)
+    durations = []
+    start = time.perf_counter()
+    for payload in payloads:
+        call_start = time.perf_counter()
+        db.write_data(payload)
+        durations.append(time.perf_counter() - call_start)
+    write_stats = stage_stats(durations, time.perf_counter() - start)
+    db.close_db()
+    os.remove(db_file)
+
+    stages = {'fetch': fetch_stats, 'parse (db_payload)': parse_stats, 'write (write_data)': write_stats}
+    result = {
+        'response_bytes': sum(len(data) for data, _ in fetched) // len(fetched),
+        'rows': currencies * days,
+        'stages': stages,
+    }
+    return result, stats_table(stages)
+
+
+def sqlite_benchmark(currencies, days, commit_interval, directory):
+    """Compare default database writes (one transaction per date) with bulk-load mode (WAL journal, NORMAL
+    synchronous level and one transaction per commit_interval dates)
+
+    :param currencies: Count of currencies of every date
+    :param days: Count of saved dates
+    :param commit_interval: Count of dates per transaction in bulk-load mode
+    :param directory: Directory of temporary database files (use a real disk to see fsync costs)
+    :return: tuple of result dict and printable table
+    """
+    logger = Logger('benchmark.log', enable=False)
+    first = dt.date(2000, 1, 1)
+    payloads = []
+    for n in range(days):
+        ondate = (first + dt.timedelta(days=n)).strftime('%Y%m%d')
+        payloads.append({'date': ondate, 'rows': parse_curs_on_date(synthetic_response(ondate, currencies))[1]})
+
+    result = {}
+    table = [['Mode', 'Dates', 'Rows', 'Seconds', 'Rows per second']]
+    for mode in ('per-date commit', 'bulk load'):
+        db_file = os.path.join(tempfile.mkdtemp(dir=directory), 'benchmark.db')
+        db = DbController(db_file, logger)
+        start = time.perf_counter()
+        if mode == 'bulk load':
+            db.begin_bulk_load(commit_interval)
+        for payload in payloads:
+            db.write_data(payload)
+        if mode == 'bulk load':
+            db.end_bulk_load()
+        seconds = time.perf_counter() - start
+        db.close_db()
+        shutil.rmtree(os.path.dirname(db_file))
+
+        rows = currencies * days
+        result[mode] = {'seconds': round(seconds, 6), 'rows_per_s': round(rows / seconds, 1)}
+        table.append([mode, str(days), str(rows), f'{seconds:.3f}', f'{rows / seconds:.0f}'])
+    result['speedup'] = round(result['per-date commit']['seconds'] / result['bulk load']['seconds'], 2)
+    return result, table
+
+
+def memory_benchmark(currencies, days):
+    """Compare memory of parsed currency data kept as CurrencyRow records (strings which are repeated in every currency
+    set are interned by parser) and as dicts (previous representation)
+
+    :param currencies: Count of currencies of every date
+    :param days: Count of parsed dates
+    :return: tuple of result dict and printable table
+    """
+    first = dt.date(2000, 1, 1)
+    responses = [synthetic_response((first + dt.timedelta(days=n)).strftime('%Y%m%d'), currencies) for n in range(days)]
+
+    variants = [
+        ('CurrencyRow records', lambda data: parse_curs_on_date(data)[1]),
+        # previous representation: a dict per currency with separate (not interned) strings
+        ('dicts', lambda data: [row._asdict() for row in parse_curs_on_date_regex(data.decode('utf-8'))[1]]),
+    ]
+    result = {}
+    table = [['Rows', 'Count', 'MB', 'Bytes per row']]
+    for name, parse in variants:
+        tracemalloc.start()
+        kept = [parse(data) for data in responses]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        rows = sum(len(item) for item in kept)
+        del kept
+        result[name] = {'rows': rows, 'bytes': size, 'bytes_per_row': round(size / rows, 1)}
+        table.append([name, str(rows), f'{size / 1e6:.1f}', f'{size / rows:.0f}'])
+    result['ratio'] = round(result['dicts']['bytes'] / result['CurrencyRow records']['bytes'], 2)
+    return result, table
+
+
+if __name__ == '__main__':
+    opts = options()
+    mode = opts.get('mode', 'parser')
+    currencies = int(opts.get('currencies', 40))
+    if mode == 'parser':
+        params = {'currencies': currencies, 'repeat': int(opts.get('repeat', 200))}
+        result, table = parser_benchmark(**params)
+    elif mode == 'e2e':
+        params = {
+            'currencies': currencies,
+            'days': int(opts.get('days', 60)),
+            'latency': float(opts.get('latency', 0.01)),
+            'workers': int(opts.get('workers', 8)),
+        }
+        result, table = e2e_benchmark(**params)
+    elif mode == 'sqlite':
+        params = {
+            'currencies': currencies,
+            'days': int(opts.get('days', 1000)),
+            'commit_interval': int(opts.get('commit-interval', 100)),
+            'directory': opts.get('dir', '.'),
+        }
+        result, table = sqlite_benchmark(**params)
+    elif mode == 'memory':
+        params = {'currencies': currencies, 'days': int(opts.get('days', 1000))}
+        result, table = memory_benchmark(**params)
+    else:
+        sys.exit(f'Unknown benchmark mode: {mode}')
+
+    print_pretty_table(table)
+    output = opts.get('output', f'benchmark-{mode}.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'mode': mode, 'params': params, 'time': dt.datetime.now().isoformat(timespec='seconds'),
+                   'result': result}, f, ensure_ascii=False, indent=2)
+    print(f'Results are saved to {output}')
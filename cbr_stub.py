@@ -0,0 +1,234 @@
+"""Local stub of Central Bank of Russia DailyInfo web service. It speaks GetCursOnDateXML, GetCursDynamicXML and
+EnumValutesXML SOAP contracts (see soap-*template.xml files) and answers with synthetic currency data of any size, so
+the service can be tested and measured without access to cbr.ru. Usage:
+
+    python cbr_stub.py [--port=8080] [--currencies=40] [--latency=0.05]
+
+.. moduleauthor:: Max Dubrovin <mihadxdx@gmail.com>
+
+"""
+
+import datetime as dt
+import gzip
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+SOAP_HEAD = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope"><soap:Body>'
+)
+SOAP_TAIL = '</soap:Body></soap:Envelope>'
+
+
+def synthetic_rate(code: int, ondate: str):
+    """Synthetic rate of currency at the date (YYYYMMDD)"""
+    return f'{code % 97 + 10}.{(code * 37 + int(ondate) % 9973) % 10000:04}'
+
+
+def synthetic_scale(code: int):
+    return str(10 ** (code % 3))
+
+
+def alphabetic_code(code: int):
+    return f'{chr(65 + code // 676 % 26)}{chr(65 + code // 26 % 26)}{chr(65 + code % 26)}'
+
+
+def internal_code(code: int):
+    """Internal code of currency in web service (like 'R01235' of US dollar)"""
+    return f'R{code:05}'
+
+
+def synthetic_response(ondate: str, currencies: int):
+    """Build GetCursOnDateXML response of web service with synthetic currency data. Rates depend on the date, so
+    responses of different dates differ.
+
+    :param ondate: Date of currency set in YYYYMMDD format
+    :param currencies: Count of currencies in response
+    :return: Response body
+    :rtype: bytes
+    """
+    items = ''.join(
+        f'<ValuteCursOnDate><Vname>Валюта {code}{" " * 40}</Vname><Vnom>{synthetic_scale(code)}</Vnom>'
+        f'<Vcurs>{synthetic_rate(code, ondate)}</Vcurs><Vcode>{code}</Vcode>'
+        f'<VchCode>{alphabetic_code(code)}</VchCode>'
+        f'</ValuteCursOnDate>'
+        for code in range(1, currencies + 1)
+    )
+    return (
+        SOAP_HEAD + '<GetCursOnDateXMLResponse xmlns="http://web.cbr.ru/"><GetCursOnDateXMLResult>'
+        f'<ValuteData OnDate="{ondate}" xmlns="">{items}</ValuteData>'
+        '</GetCursOnDateXMLResult></GetCursOnDateXMLResponse>' + SOAP_TAIL
+    ).encode('utf-8')
+
+
+def synthetic_enum_response(currencies: int):
+    """Build EnumValutesXML response (directory of currencies) of web service"""
+    items = ''.join(
+        f'<EnumValutes><Vcode>{internal_code(code)}    </Vcode><Vname>Валюта {code}{" " * 40}</Vname>'
+        f'<VEngname>Currency {code}</VEngname><Vnom>{synthetic_scale(code)}</Vnom>'
+        f'<VcommonCode>{internal_code(code)}    </VcommonCode><VnumCode>{code}</VnumCode>'
+        f'<VcharCode>{alphabetic_code(code)}</VcharCode></EnumValutes>'
+        for code in range(1, currencies + 1)
+    )
+    return (
+        SOAP_HEAD + '<EnumValutesXMLResponse xmlns="http://web.cbr.ru/"><EnumValutesXMLResult>'
+        f'<ValuteData xmlns="">{items}</ValuteData></EnumValutesXMLResult></EnumValutesXMLResponse>' + SOAP_TAIL
+    ).encode('utf-8')
+
+
+def synthetic_dynamic_response(first: dt.date, last: dt.date, code: int, weekends=True):
+    """Build GetCursDynamicXML response of web service: rates of one currency at every publication date of range
+
+    :param first: First date of range
+    :param last: Last date of range
+    :param code: Numeric code of currency
+    :param weekends: If True there are no rates of Sundays and Mondays (rates are set on Saturday)
+    """
+    items = []
+    date = first
+    while date <= last:
+        if not weekends or publication_date(date) == date:
+            ondate = date.strftime('%Y%m%d')
+            items.append(
+                f'<ValuteCursDynamic><CursDate>{date.isoformat()}T00:00:00+03:00</CursDate>'
+                f'<Vcode>{internal_code(code)}    </Vcode><Vnom>{synthetic_scale(code)}</Vnom>'
+                f'<Vcurs>{synthetic_rate(code, ondate)}</Vcurs></ValuteCursDynamic>'
+            )
+        date += dt.timedelta(days=1)
+    return (
+        SOAP_HEAD + '<GetCursDynamicXMLResponse xmlns="http://web.cbr.ru/"><GetCursDynamicXMLResult>'
+        f'<ValuteData xmlns="">{"".join(items)}</ValuteData></GetCursDynamicXMLResult></GetCursDynamicXMLResponse>'
+        + SOAP_TAIL
+    ).encode('utf-8')
+
+
+def publication_date(date: dt.date):
+    """Date of currency set which is valid at the date. Like real service, currency sets are not published on
+    Sundays and Mondays, rates published on Saturday are valid till Monday."""
+    while date.weekday() in (6, 0):
+        date -= dt.timedelta(days=1)
+    return date
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Handler of SOAP requests. Keep-alive connections are supported."""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # headers and body are written separately
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        index = self.server.arrive()
+        if index in self.server.stalls:
+            time.sleep(self.server.stall)
+        if index in self.server.failures:
+            self.server.count()
+            self.reply(503, b'Service Unavailable')
+            return
+        match = re.search(rb'<GetCursOnDateXML .*<On_date>(\d{4})-(\d{2})-(\d{2})</On_date>', body, re.DOTALL)
+        if match:
+            date = dt.date(*(int(part) for part in match.groups()))
+            ondate = publication_date(date) if self.server.weekends else date
+            data = synthetic_response(ondate.strftime('%Y%m%d'), self.server.currencies)
+        elif b'<EnumValutesXML ' in body:
+            data = synthetic_enum_response(self.server.currencies)
+        else:
+            match = re.search(rb'<GetCursDynamicXML .*<FromDate>([\d-]{10})</FromDate>\s*<ToDate>([\d-]{10})</ToDate>'
+                              rb'\s*<ValutaCode>R(\d+)</ValutaCode>', body, re.DOTALL)
+            if not match:
+                self.reply(500, b'Unknown SOAP operation or missing parameters')
+                return
+            first, last = (dt.date.fromisoformat(part.decode()) for part in match.groups()[:2])
+            data = synthetic_dynamic_response(first, last, int(match.group(3)), self.server.weekends)
+
+        time.sleep(self.server.latency)
+        self.server.count()
+        self.reply(200, data)
+
+    def reply(self, status, data):
+        headers = {'Content-Type': 'application/soap+xml; charset=utf-8'}
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and self.server.gzip:
+            data = gzip.compress(data, compresslevel=1)
+            headers['Content-Encoding'] = 'gzip'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # stub is quiet
+
+
+class StubServer(ThreadingHTTPServer):
+    """Stub web service server. Use serve_in_thread() to start it in background.
+
+    :param port: TCP port (0 - any free port)
+    :param currencies: Count of currencies in every response
+    :param latency: Delay before every response in seconds
+    :param weekends: If True Sunday and Monday requests are answered by currency set of previous Saturday
+    :param gzip: If True responses are compressed for clients which accept gzip
+    :param failures: Indexes of requests (in order of arrival, from 0) which are answered by 503 status
+    :param stalls: Indexes of requests which are answered after additional delay of stall seconds
+    :param stall: Additional delay of stalled requests in seconds
+    """
+    daemon_threads = True
+
+    def __init__(self, port=0, currencies=40, latency=0.0, weekends=True, gzip=True, failures=(), stalls=(),
+                 stall=1.0):
+        super().__init__(('127.0.0.1', port), StubHandler)
+        self.currencies = currencies
+        self.latency = latency
+        self.weekends = weekends
+        self.gzip = gzip
+        self.failures = set(failures)
+        self.stalls = set(stalls)
+        self.stall = stall
+        self.requests = 0  # count of answered requests
+        self.arrived = 0  # count of received requests
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/DailyInfoWebServ/DailyInfo.asmx'
+
+    def count(self):
+        with self.lock:
+            self.requests += 1
+
+    def arrive(self):
+        """Register received request
+
+        :return: index of request in order of arrival
+        """
+        with self.lock:
+            self.arrived += 1
+            return self.arrived - 1
+
+    def serve_in_thread(self):
+        """Start serving in daemon thread
+
+        :return: self
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stop serving and close listening socket"""
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    opts = dict(arg[2:].partition('=')[::2] for arg in sys.argv[1:] if arg.startswith('--'))
+    server = StubServer(
+        port=int(opts.get('port', 8080)),
+        currencies=int(opts.get('currencies', 40)),
+        latency=float(opts.get('latency', 0)),
+    )
+    print(f'Stub web service is listening on {server.url}')
+    server.serve_forever()
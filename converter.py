@@ -0,0 +1,157 @@
+"""Conversion of amounts between currencies by saved rates. Central bank does not publish rates on weekends and
+holidays, so an amount is converted by the last rate published on or before the date. Rates of every currency are
+loaded from the database once into a sorted date index which is searched by bisect, there are no queries per
+conversion. Amounts are converted in exact decimal arithmetic with only one division per conversion.
+
+.. moduleauthor:: Max Dubrovin <mihadxdx@gmail.com>
+
+"""
+
+import sqlite3
+from bisect import bisect_right
+from decimal import Decimal, ROUND_HALF_UP
+
+from db_controller import RATE_PRECISION, db_date
+
+
+RUB = '643'  # numeric code of russian ruble, all saved rates are rates in rubles
+
+
+def to_decimal(amount):
+    """Convert amount to Decimal. Floats are converted by their shortest representation (0.1 is Decimal('0.1'))."""
+    if isinstance(amount, Decimal):
+        return amount
+    if isinstance(amount, float):
+        return Decimal(repr(amount))
+    return Decimal(amount)
+
+
+class Converter:
+    """Currency conversion engine
+
+    :param histories: Dict of numeric code and tuple of two lists: YYYYMMDD dates (sorted from oldest) and related
+        tuples of rate value (rate multiplied by 10 ** RATE_PRECISION) and scale
+    :param alphabetic_codes: Dict of alphabetic code ('USD') and numeric code ('840'), optional
+    """
+    def __init__(self, histories, alphabetic_codes=None):
+        self.histories = histories
+        self.alphabetic_codes = {RUB: RUB, 'RUB': RUB}
+        self.alphabetic_codes.update((alpha.upper(), code) for alpha, code in (alphabetic_codes or {}).items())
+
+    @classmethod
+    def load(cls, db_file, codes=None, date_from=None, date_to=None):
+        """Load rates from database
+
+        :param db_file: Path of SQLite database (it is opened in read-only mode)
+        :param codes: Numeric or alphabetic codes of currencies (None - all currencies)
+        :param date_from: First date of conversions in DD.MM.YYYY format. The last rate of every currency on or
+            before the date is loaded too (None - from the earliest saved date)
+        :param date_to: Last date in DD.MM.YYYY format (None - till the latest saved date)
+        """
+        params = [db_date(date_from) if date_from else '00000000', db_date(date_to) if date_to else '99999999']
+        # rate of every currency valid at date_from is its last one on or before the date (orders can be partial)
+        stmt = (
+            'WITH seed AS ('
+            'SELECT r.numeric_code, MAX(o.ondate) AS ondate '
+            'FROM CURRENCY_RATES r JOIN CURRENCY_ORDER o ON o.id = r.order_id '
+            'WHERE o.ondate <= ?1 AND r.rate_value IS NOT NULL AND r.scale > 0 GROUP BY r.numeric_code) '
+            'SELECT r.numeric_code, r.alphabetic_code, o.ondate, r.rate_value, r.scale '
+            'FROM CURRENCY_RATES r JOIN CURRENCY_ORDER o ON o.id = r.order_id '
+            'LEFT JOIN seed s ON s.numeric_code = r.numeric_code '
+            'WHERE (o.ondate > ?1 OR o.ondate = s.ondate) '
+            'AND o.ondate <= ?2 AND r.rate_value IS NOT NULL AND r.scale > 0'
+        )
+        if codes:
+            placeholders = ', '.join('?' * len(codes))
+            stmt += f' AND (r.numeric_code IN ({placeholders}) OR upper(r.alphabetic_code) IN ({placeholders}))'
+            params.extend(codes)
+            params.extend(code.upper() for code in codes)
+        histories = {}
+        alphabetic_codes = {}
+        con = sqlite3.connect(f'file:{db_file}?mode=ro', uri=True)
+        try:
+            for code, alpha, date, value, scale in con.execute(stmt + ' ORDER BY r.numeric_code, o.ondate;', params):
+                dates, rates = histories.setdefault(code, ([], []))
+                dates.append(date)
+                rates.append((value, scale))
+                alphabetic_codes[alpha] = code
+        finally:
+            con.close()
+        return cls(histories, alphabetic_codes)
+
+    def code(self, code):
+        """Numeric code of currency
+
+        :param code: Numeric ('840') or alphabetic ('USD', case-insensitive) code
+        :raises KeyError: if currency is unknown
+        """
+        if code in self.histories or code == RUB:
+            return code
+        return self.alphabetic_codes[code.upper()]
+
+    def lookup(self, code, date):
+        """Rate of currency valid at the date (the last one published on or before it)
+
+        :param code: Numeric or alphabetic code
+        :param date: Date in YYYYMMDD format
+        :return: tuple of rate value (rate multiplied by 10 ** RATE_PRECISION), scale and YYYYMMDD date of the rate
+        :raises KeyError: if currency is unknown or its rates start later than the date
+        """
+        code = self.code(code)
+        if code == RUB:
+            return 10 ** RATE_PRECISION, 1, date
+        dates, rates = self.histories[code]
+        index = bisect_right(dates, date) - 1
+        if index < 0:
+            raise KeyError(f'There is no rate of {code} on or before {date}')
+        return rates[index] + (dates[index],)
+
+    def rate(self, code, date):
+        """Rate of one currency unit in rubles valid at the date
+
+        :param code: Numeric or alphabetic code
+        :param date: Date in DD.MM.YYYY format
+        :rtype: Decimal
+        :raises KeyError: if currency is unknown or its rates start later than the date
+        """
+        value, scale, _ = self.lookup(code, db_date(date))
+        return Decimal(value).scaleb(-RATE_PRECISION) / scale
+
+    def convert(self, amount, from_code, to_code, date, places=None):
+        """Convert amount of one currency to another one by rates valid at the date
+
+        :param amount: Amount of from_code currency (int, str, float or Decimal)
+        :param from_code: Numeric or alphabetic code of source currency
+        :param to_code: Numeric or alphabetic code of target currency
+        :param date: Date in DD.MM.YYYY format
+        :param places: Count of decimal places to round result to (ROUND_HALF_UP), None - no rounding
+        :rtype: Decimal
+        :raises KeyError: if currency is unknown or its rates start later than the date
+        """
+        return self.convert_many([(amount, date)], from_code, to_code, places)[0]
+
+    def convert_many(self, items, from_code, to_code, places=None):
+        """Convert list of amounts of one currency to another one. Codes are resolved once, rates of every date are
+        looked up once.
+
+        :param items: Iterable of tuples of amount and date in DD.MM.YYYY format
+        :param from_code: Numeric or alphabetic code of source currency
+        :param to_code: Numeric or alphabetic code of target currency
+        :param places: Count of decimal places to round results to (ROUND_HALF_UP), None - no rounding
+        :return: list of converted amounts (Decimal) in order of items
+        :raises KeyError: if currency is unknown or its rates start later than any date
+        """
+        from_code, to_code = self.code(from_code), self.code(to_code)
+        exponent = Decimal(1).scaleb(-places) if places is not None else None
+        factors = {}  # date -> tuple of numerator and denominator of conversion factor
+        result = []
+        for amount, date in items:
+            factor = factors.get(date)
+            if factor is None:
+                ondate = db_date(date)
+                from_value, from_scale, _ = self.lookup(from_code, ondate)
+                to_value, to_scale, _ = self.lookup(to_code, ondate)
+                factor = factors[date] = (from_value * to_scale, to_value * from_scale)
+            converted = to_decimal(amount) * factor[0] / factor[1]
+            result.append(converted.quantize(exponent, ROUND_HALF_UP) if exponent is not None else converted)
+        return result
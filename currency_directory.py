@@ -0,0 +1,76 @@
+"""Directory of currencies: resolution of numeric (ISO 4217 numeric, '840') and alphabetic ('USD') currency codes
+by hash indexes. It is built from EnumValutesXML response of web service or from currency rows saved in database.
+
+.. moduleauthor:: Max Dubrovin <mihadxdx@gmail.com>
+
+"""
+
+import datetime as dt
+
+
+DIRECTORY_MAX_AGE = 7  # days after which saved directory is requested again
+
+
+def numeric_key(code: str):
+    """Normalize numeric code ('036' and '36' are the same currency)"""
+    return str(int(code))
+
+
+class CurrencyDirectory:
+    """Currencies indexed by numeric and alphabetic codes
+
+    :param currencies: Iterable of currency dicts with 'numeric_code' and 'alphabetic_code' keys (and optionally
+        'internal_code', 'name' and 'scale')
+    :param updated: Date of directory data (datetime.date), None if it is unknown
+    """
+    def __init__(self, currencies=(), updated=None):
+        self.updated = updated
+        self.by_numeric = {}
+        self.by_alphabetic = {}
+        for currency in currencies:
+            self.add(currency)
+
+    def add(self, currency: dict):
+        if not currency.get('numeric_code', '').strip().isdigit():  # old currencies have no numeric code
+            return
+        self.by_numeric[numeric_key(currency['numeric_code'])] = currency
+        if currency.get('alphabetic_code'):
+            self.by_alphabetic[currency['alphabetic_code'].strip().upper()] = currency
+
+    def __len__(self):
+        return len(self.by_numeric)
+
+    def __contains__(self, code):
+        return self.get(code) is not None
+
+    def get(self, code: str):
+        """Find currency by numeric or alphabetic code (case-insensitive)
+
+        :return: currency dict or None if code is unknown
+        """
+        code = code.strip()
+        if code.isdigit():
+            return self.by_numeric.get(numeric_key(code))
+        return self.by_alphabetic.get(code.upper())
+
+    def resolve(self, codes):
+        """Convert currency codes to numeric codes which are used in web service responses and database
+
+        :param codes: Numeric and alphabetic codes
+        :return: tuple of list of numeric codes (in given order, without repeats) and list of unknown codes
+        """
+        numeric_codes = []
+        seen = set()
+        unknown = []
+        for code in codes:
+            currency = self.get(code)
+            if currency is None:
+                unknown.append(code)
+            elif currency['numeric_code'] not in seen:
+                seen.add(currency['numeric_code'])
+                numeric_codes.append(currency['numeric_code'])
+        return numeric_codes, unknown
+
+    def is_stale(self, max_age=DIRECTORY_MAX_AGE):
+        """Check if directory is older than max_age days (directory of unknown date is stale)"""
+        return self.updated is None or (dt.date.today() - self.updated).days > max_age
@@ -5,168 +5,717 @@
 
 """
 
-from urllib.error import HTTPError, URLError
-from urllib.request import urlopen, Request
+import cProfile
+import datetime as dt
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import db_controller
+from currency_directory import CurrencyDirectory
 from db_controller import DbController
+from fetch_policy import DEFAULT_DEADLINE, DEFAULT_RETRIES, CircuitBreaker, FetchPolicy
 from launch_args_parser import SysArgsParser
-from logger import Logger
-from pretty_table import print_pretty_table
-from xml_parser import tag_content, tag_attribute, xml_date
-
-
-class OnDateCurs:
-    """Currency service main logic Class"""
-    def __init__(self, db_file, options=None, log_enable=True):
-        self.logger = Logger('ondatecurs.log', enable=log_enable, show_time=True)
-        self.logger.log('Service have been started')
-        self.url = 'https://cbr.ru/DailyInfoWebServ/DailyInfo.asmx'
-        self.request_template = 'soap-template.xml'
-        self.args = SysArgsParser(
-            require_args=['date', 'codes'],
-            init_args=options,
-            logger=self.logger)
-
+from logger import DEBUG, INFO, Logger
+from metrics import Metrics
+from pretty_table import render_table
+from response_cache import ResponseCache
+from soap_client import SoapClient, SoapError, SoapTemplate
+from tables import CurrencyRow
+from xml_parser import (ExpatError, parse_curs_dynamic, parse_curs_on_date, parse_curs_on_date_regex, parse_enum_valutes,
+                        xml_date)
+
+
+DEFAULT_WORKERS = 8  # default count of requests in flight at range mode
+DEFAULT_COMMIT_INTERVAL = 100  # default count of dates per transaction at range mode
+DEFAULT_CACHE_DIR = 'responses'  # directory of raw responses cache at offline mode if --cache is omitted
+DEFAULT_INTERVAL = 600  # default seconds between polls of web service at daemon mode
+DEFAULT_URL = 'https://cbr.ru/DailyInfoWebServ/DailyInfo.asmx'
+STRATEGIES = ('auto', 'daily', 'dynamic')  # fetch strategies of range mode (see plan_strategy)
+DEFAULT_PROFILE_FILE = 'ondatecurs.prof'  # cProfile stats of run with --profile option
+REPORT_HEADER = ['№ расп.', 'Дата', 'Валюта', 'Номинал', 'Курс']  # columns of database update report table
+REPORT_COLUMNS = ['order_id', 'date', 'currency', 'scale', 'rate']  # keys of report rows in CSV and JSON Lines
+
+
+def date_range(date_from: str, date_to: str):
+    """Build list of all dates between two dates (both are included)
+
+    :param date_from: First date of range in DD.MM.YYYY format
+    :param date_to: Last date of range in DD.MM.YYYY format
+    :return: list of DD.MM.YYYY strings
+    :rtype: list
+    """
+    first = dt.datetime.strptime(date_from, '%d.%m.%Y').date()
+    last = dt.datetime.strptime(date_to, '%d.%m.%Y').date()
+    days = (last - first).days + 1
+    return [(first + dt.timedelta(days=n)).strftime('%d.%m.%Y') for n in range(days)]
+
+
+def is_past(date: str):
+    """Check if DD.MM.YYYY date is earlier than today"""
+    return dt.datetime.strptime(date, '%d.%m.%Y').date() < dt.date.today()
+
+
+def plan_strategy(days: int, codes=None, offline=False):
+    """Choose fetch strategy of date range. 'daily' strategy makes one GetCursOnDateXML request per date (every
+    response carries all currencies), 'dynamic' one makes one GetCursDynamicXML request per currency for the whole
+    range (plus one EnumValutesXML request for internal currency codes). The strategy with less requests is chosen.
+
+    :param days: Count of dates in range
+    :param codes: Numeric codes of requested currencies (all currencies if it is omitted)
+    :param offline: If True only cached responses of dates can be used
+    :return: 'daily' or 'dynamic'
+    """
+    if offline or not codes:
+        return 'daily'
+    return 'dynamic' if len(codes) + 1 < days else 'daily'
+
+
+def gaps(dates: list):
+    """Group sorted YYYYMMDD dates into ranges of consecutive days
+
+    :return: list of tuples of first and last date of every range
+    """
+    ranges = []
+    for date in dates:
+        day = dt.datetime.strptime(date, '%Y%m%d').date()
+        if ranges and ranges[-1][1] == day - dt.timedelta(days=1):
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [(first.strftime('%Y%m%d'), last.strftime('%Y%m%d')) for first, last in ranges]
+
+
+class CurrencyService:
+    """Reusable currency service. Constructor has no side effects: database is opened at first use, web service
+    connections are opened at first request. Both are kept for the whole lifetime of the object, so one object can
+    make many runs. Call close() at the end.
+
+    :param db_file: Path of SQLite database
+    :param logger: Logger object
+    :param url: Web service URL
+    :param cache_dir: Directory of raw responses cache, optional
+    :param offline: If True responses are read from cache only
+    :param workers: Count of requests in flight at range runs
+    :param rewrite: If True saved currency data of requested dates is replaced by got one: only rows which differ
+        are written, dates with unchanged content hash are skipped, ranges are replaced in one transaction
+    :param commit_interval: Count of dates per transaction at range runs (database is switched to bulk-load mode).
+        1 - every date is committed separately in default mode
+    :param strategy: Fetch strategy of range runs: 'daily', 'dynamic' or 'auto' (see plan_strategy)
+    :param deadline: Seconds for one web service request including all retries
+    :param retries: Count of repeated attempts of failed request
+    :param hedge: Percentile of recent latencies (for example 95) after which a hedged second request is sent,
+        None - no hedged requests
+    :param memory: In-memory database which db_file is loaded into and saved back from by snapshots (see
+        DbController), None - database file is used directly
+    :param snapshot_interval: Minimum seconds between snapshots of in-memory database
+    """
+    def __init__(self, db_file, logger, url=DEFAULT_URL, cache_dir=None, offline=False, workers=DEFAULT_WORKERS,
+                 rewrite=False, commit_interval=DEFAULT_COMMIT_INTERVAL, strategy='auto', deadline=DEFAULT_DEADLINE,
+                 retries=DEFAULT_RETRIES, hedge=None, memory=None, snapshot_interval=None):
         self.db_file = db_file
+        self.logger = logger
+        self.url = url
+        self.offline = offline
+        self.workers = workers
+        self.rewrite = rewrite
+        self.commit_interval = commit_interval
+        self.strategy = strategy
+        self.memory = memory
+        self.snapshot_interval = snapshot_interval
+        self.cache_dir = cache_dir or (DEFAULT_CACHE_DIR if offline else None)
+        self.request_template = 'soap-template.xml'
+        self.template = None
+        self.dynamic_template = None
+        self.enum_template = None
+        self.directory = None  # CurrencyDirectory, it is read from database at first use
+        self.directory_requested = False  # directory is requested from web service no more than once
+        self.metrics = Metrics()  # fetch and parse timers, database timers and counters
+        self.cache = None
+        self.db = None
+        self.client = SoapClient(url, logger, pool_size=workers, metrics=self.metrics)
+        self.policy = FetchPolicy(self.client, logger, deadline=deadline, retries=retries, hedge_percentile=hedge,
+                                  breaker=CircuitBreaker(), metrics=self.metrics)
+
+    def database(self):
+        """Database controller (it is opened at first call)"""
+        if self.db is None:
+            self.db = DbController(self.db_file, self.logger, metrics=self.metrics,
+                                   memory=self.memory, snapshot_interval=self.snapshot_interval)
+        return self.db
+
+    def request(self, date):
+        """Retrieve xml data from cache or Web
+
+        :param date: Requested date in DD.MM.YYYY format
+        :return: response body (bytes) or False if there is no cached response at offline mode or request exception
+            is raised
+        """
+        if self.template is None:
+            self.template = SoapTemplate(self.request_template)
+        if self.cache is None and self.cache_dir:
+            self.cache = ResponseCache(self.cache_dir)
+
+        # responses of past dates are never changed, so cached ones are used
+        past = is_past(date)
+        if self.cache and (self.offline or past):
+            xml_data = self.cache.get(date)
+            if xml_data:
+                self.logger.log(f'Response for {date} is read from cache')
+                self.metrics.count('cache_hits')
+                return xml_data
+        if self.offline:
+            self.logger.log(f'ERROR: There is no cached response for {date} (offline mode)')
+            return False
 
-        self.main_routine()
-
-    def stop(self):
-        """Emergency stop the service"""
-        self.logger.log('Service stopped')
-        exit()
+        xml_data = self.post(self.template.render(date=xml_date(date)))
+        if xml_data and self.cache and past:  # currency set of today or later date can be published later
+            self.cache.put(date, xml_data)
+        return xml_data
 
-    def main_routine(self):
-        """Main logic of service"""
+    def post(self, body):
+        """Post SOAP request to web service according to fetch policy (deadline, retries, hedging and circuit
+        breaker)
 
-        if self.args.error:  # check input arguments
-            self.stop()
-        else:
-            self.logger.log(f'STEP 1 IS STARTED - RETRIEVING CURRENCY DATA')
-            xml = self.data_request()
-
-            if xml:
-                data = self.db_payload(xml_data=xml)
-                if data:
-                    self.logger.log(f'STEP 2 IS STARTED - DATABASE UPDATING')
-                    self.db_update(data)
+        :return: response body (bytes) or False if request is failed
+        """
+        try:
+            with self.metrics.timer('fetch'):
+                return self.policy.post(body)
+        except SoapError as error:
+            self.metrics.count('requests_failed')
+            if error.status:
+                self.logger.log(f'ERROR: {error.status}, {error.reason}')
             else:
-                self.stop()
+                self.logger.log(f'ERROR: {error.reason}')
+            return False
 
-    def data_request(self):
-        """Retrieve xml data from Web
+    def currency_directory(self, refresh=False):
+        """Directory of currencies. Directory saved in database is used while it is fresh, otherwise it is requested by
+        EnumValutesXML request and saved (no more than once per service object). If there is neither saved nor
+        requested directory, it is built from saved currency rows.
 
-        :return: response plain text or False if request exception is raised
+        :param refresh: If True directory is requested even if saved one is fresh
+        :return: CurrencyDirectory object (it is empty if there is no directory)
         """
-        date = self.args.args['date']
-
-        headers = {
-            'Content-Type': 'application/soap+xml; charset=utf-8',
-            # 'Content-Length': '0',
-        }
-        with open('soap-template.xml', 'r') as f:
-            data = f.read()
-        data = data.replace('{ date }', xml_date(date))
-
-        request = Request(self.url, headers=headers, data=data.encode("utf-8"))
+        if self.directory is None:
+            currencies, updated = self.database().directory()
+            updated = dt.datetime.strptime(updated, '%Y%m%d').date() if updated else None
+            self.directory = CurrencyDirectory(currencies, updated)
+        if (refresh or self.directory.is_stale()) and not self.offline and not self.directory_requested:
+            self.directory_requested = True
+            directory = self.request_directory()
+            if directory:
+                self.directory = directory
+        if not self.directory:
+            self.directory = CurrencyDirectory(self.database().saved_currencies())
+        return self.directory
+
+    def request_directory(self):
+        """Request directory of currencies by EnumValutesXML request and save it into database
+
+        :return: CurrencyDirectory object or False if directory is not got
+        """
+        if self.enum_template is None:
+            self.enum_template = SoapTemplate('soap-enum-template.xml')
+        xml_data = self.post(self.enum_template.render())
+        if not xml_data:
+            return False
         try:
-            with urlopen(request, timeout=10) as response:
-                self.logger.log(f'Response is got, code - {response.status}')
-                xml_data = response.read().decode('utf-8')
-                return xml_data
-        except HTTPError as error:
-            self.logger.log(f'ERROR: {error.status}, {error.reason}')
-        except URLError as error:
-            self.logger.log(f'ERROR: {error.reason}')
-        except TimeoutError:
-            self.logger.log(f'ERROR: Request timed out')
-
-        # VARIANT 2: using third-party REQUESTS library:
-
-        # try:
-        #     self.logger.log('Trying make data request...')
-        #     response = requests.post(url=self.url, data=data, headers=headers)
-        #     response.raise_for_status()
-        # except requests.exceptions.RequestException as E:
-        #     self.logger.log(f'ERROR: request error')
-        #     return False
-        # else:
-        #     self.logger.log(f'Response is got, code - {response.status_code}')
-        #     xml_data = response.text
-        #     return xml_data
-
-    def db_payload(self, xml_data):
+            currencies = parse_enum_valutes(xml_data)
+        except ExpatError as error:
+            self.logger.log(f'ERROR: Currency directory is not well-formed xml ({error})')
+            return False
+        directory = CurrencyDirectory(currencies, dt.date.today())
+        self.database().save_directory(list(directory.by_numeric.values()), directory.updated.strftime('%Y%m%d'))
+        self.logger.log(f'Currency directory of {len(directory)} currencies is got')
+        return directory
+
+    def resolve_codes(self, codes):
+        """Convert numeric and alphabetic ('USD') currency codes to numeric ones by currency directory. If some codes
+        are unknown, directory is requested again (once per service object), a currency could be added recently.
+        Numeric codes which are still unknown are kept as is with a warning: directory lists current currencies only,
+        historical ones can be published in currency sets of earlier dates.
+
+        :param codes: List of currency codes
+        :return: tuple of list of numeric codes and list of unknown codes
+        """
+        directory = self.currency_directory()
+        numeric_codes, unknown = directory.resolve(codes)
+        if unknown and not self.directory_requested and not self.offline:
+            directory = self.currency_directory(refresh=True)
+            numeric_codes, unknown = directory.resolve(codes)
+        passed = [code for code in unknown if code.isdigit()]
+        if passed:
+            self.logger.log(f'WARNING: Currency codes {", ".join(passed)} are not founded in currency directory, '
+                            f'they are requested as is')
+            numeric_codes.extend(code for code in passed if code not in numeric_codes)
+        return numeric_codes, [code for code in unknown if not code.isdigit()]
+
+    def fetch_dynamic(self, currency, date_from, date_to):
+        """Retrieve rates of one currency at every date of range by one GetCursDynamicXML request
+
+        :param currency: Currency dict of directory (see currency_directory)
+        :param date_from: First date of range in DD.MM.YYYY format
+        :param date_to: Last date of range in DD.MM.YYYY format
+        :return: list of tuples of YYYYMMDD date and CurrencyRow record (one per date when rate was set) or False if
+            there is no data
+        """
+        if self.dynamic_template is None:
+            self.dynamic_template = SoapTemplate('soap-dynamic-template.xml')
+        body = self.dynamic_template.render(
+            date_from=xml_date(date_from), date_to=xml_date(date_to), code=currency['internal_code'])
+        xml_data = self.post(body)
+        if not xml_data:
+            return False
+        try:
+            with self.metrics.timer('parse'):
+                items = parse_curs_dynamic(xml_data)
+        except ExpatError as error:
+            self.logger.log(f'ERROR: Response is not well-formed xml ({error})')
+            return False
+        self.logger.log(f'Rates of {len(items)} dates are got for currency {currency["numeric_code"]}')
+        return [
+            (item['date'], CurrencyRow(currency['name'], currency['numeric_code'], currency['alphabetic_code'],
+                                       item['scale'], item['rate']))
+            for item in items
+        ]
+
+    def parse(self, xml_data, request_date, codes=None):
         """Parse response content, extract currency data and build data structure to save it into database using
         db_controller
 
-        :param xml_data: Plain text of web service response. It would have XML format.
-        :type xml_data: str
+        :param xml_data: Body of web service response. It would have XML format.
+        :type xml_data: bytes or str
+        :param request_date: Requested date in DD.MM.YYYY format
+        :param codes: Numeric codes of requested currencies. All currencies are used if it is omitted
+        :type codes: list, optional
         :return: prepared Data block for saving it in database or False if there is no currency data in given xml.
-            Data block format: {'date': 'YYYYMMDD', 'rows' : list of Currency data}.
-            Each item of 'rows' list must be a dict with following keys: 'name', 'numeric_code', 'alphabetic_code',
-            'scale' and 'rate'
+            Data block format: {'date': 'YYYYMMDD', 'rows' : list of CurrencyRow records}.
         """
-        date = tag_attribute(xml_data, 'ValuteData', 'OnDate')  # extract date of currency set in
+        with self.metrics.timer('parse'):
+            try:
+                # extract date of currency set and list of currencies in one pass
+                date, currencies = parse_curs_on_date(xml_data)
+            except ExpatError as error:
+                self.logger.log(f'WARNING: Response is not well-formed xml ({error}). Regex parser is used.')
+                if isinstance(xml_data, bytes):
+                    xml_data = xml_data.decode('utf-8', errors='replace')
+                date, currencies = parse_curs_on_date_regex(xml_data)
+
         if not date:
             self.logger.log('No -ondate- attribute in response xml. Response data seems to be incorrect.')
             return False
         else:
             response_date = db_controller.human_date(date)
-            request_date = self.args.args['date']
             self.logger.log(f'Ondate attribute in response: {date}')
             if response_date != request_date:
                 # requested data is not equal response data
                 self.logger.log(f'WARNING: response currency info date for {request_date} is {response_date}')
 
-            # list of all 'ValuteCursOnDate' tags contents (each item is a one currency)
-            currencies = tag_content(xml_data, 'ValuteCursOnDate', find_all=True)
             currencies_count = len(currencies)
 
             self.logger.log(f'Total currencies in response: {currencies_count}')
 
-            requested_codes = self.args.args['codes'].replace(' ', '').split(',')  # specified codes at service launch
-
             if not currencies:
                 return False
             else:
-                cur_data = {'date': date, 'rows': []}  # main data structure for further saving into database
+                cur_data = {'date': date, 'rows': currencies}  # main data structure for further saving into database
 
-                left_codes = requested_codes.copy()  # codes that have not been founded in response codes yet
-                for item in currencies:
-                    numeric_code = tag_content(item, 'Vcode')
-                    if requested_codes == ['*'] or (numeric_code in requested_codes):
+                if codes:
+                    requested_codes = set(codes)
+                    cur_data['rows'] = [item for item in currencies if item.numeric_code in requested_codes]
+                    found_codes = {item.numeric_code for item in cur_data['rows']}
+                    for code in codes:
+                        if code not in found_codes:
+                            self.logger.log(f'WARNING: Requested currency code {code} is not founded in response currency list')
 
-                        if requested_codes != ['*']:
-                            left_codes.remove(numeric_code)  # eject code from non-founded codes
+                return cur_data
 
-                        data = {
-                            'name': tag_content(item, 'Vname'),
-                            'numeric_code': numeric_code,
-                            'alphabetic_code': tag_content(item, 'VchCode'),
-                            'scale': tag_content(item, 'Vnom'),
-                            'rate': tag_content(item, 'Vcurs'),
-                        }
-                        cur_data['rows'].append(data)
+    def fetch_payload(self, date, codes=None):
+        """Retrieve and parse currency data of one date. It is called by worker threads at range runs.
 
-                if requested_codes != ['*']:
-                    for code in left_codes:
-                        self.logger.log(f'WARNING: Requested currency code {code} is not founded in response currency list')
+        :param date: Requested date in DD.MM.YYYY format
+        :param codes: Numeric codes of requested currencies (all currencies if it is omitted)
+        :return: prepared Data block (see parse) or False if there is no data
+        """
+        xml = self.request(date)
+        if not xml:
+            return False
+        return self.parse(xml, date, codes)
 
-                return cur_data
+    def run(self, date, codes=None):
+        """Retrieve currency data of one date and save it into database
 
-    def db_update(self, payload):
-        """Save prepared data structure into database and print result report
+        :param date: Requested date in DD.MM.YYYY format
+        :param codes: Numeric codes of requested currencies (all currencies if it is omitted)
+        :return: Report of really inserted rows (see DbController.write_data) or False if currency data is not got
+        """
+        self.logger.log(f'STEP 1 IS STARTED - RETRIEVING CURRENCY DATA')
+        xml = self.request(date)
+        if not xml:
+            return False
+        payload = self.parse(xml, date, codes)
+        if not payload:
+            return []
+        self.logger.log(f'STEP 2 IS STARTED - DATABASE UPDATING')
+        return self.save(date, payload)
+
+    def save(self, date, payload):
+        """Save parsed currency data of requested date. If web service answered by currency set of another date (the
+        date is a weekend or a holiday), alias of requested date is saved too, so it is never requested again by sync.
+
+        :param date: Requested date in DD.MM.YYYY format
+        :param payload: prepared Data block (see parse)
+        :return: Report of really inserted rows (see DbController.write_data)
+        """
+        alias = None
+        # currency set of later dates can be published later, so only past dates are aliased
+        if payload['date'] != db_controller.db_date(date) and is_past(date):
+            alias = db_controller.db_date(date)
+        return self.database().write_data(payload, alias=alias, replace=self.rewrite)
+
+    def run_range(self, date_from, date_to, codes=None):
+        """Retrieve and save currency data of every date of range (see iter_range)
+
+        :param date_from: First date of range in DD.MM.YYYY format
+        :param date_to: Last date of range in DD.MM.YYYY format
+        :param codes: Numeric codes of requested currencies (all currencies if it is omitted)
+        :return: tuple of report of really inserted rows and list of dates which currency data is not got for
+        """
+        failed_dates = []
+        report = list(self.iter_range(date_from, date_to, codes, failed_dates))
+        return report, failed_dates
+
+    def iter_range(self, date_from, date_to, codes=None, failed_dates=None):
+        """Retrieve and save currency data of every date of range. Fetch strategy is chosen by plan_strategy unless
+        it is set explicitly. If currency data is not got by 'dynamic' strategy, 'daily' one is used.
+        Report rows are yielded as soon as they are written, so a report of any size can be rendered without keeping
+        it in memory. Nothing is saved until the generator is iterated.
+
+        :param date_from: First date of range in DD.MM.YYYY format
+        :param date_to: Last date of range in DD.MM.YYYY format
+        :param codes: Numeric codes of requested currencies (all currencies if it is omitted)
+        :param failed_dates: List which dates are appended to if their currency data is not got, optional
+        :return: generator of really inserted rows (see DbController.write_data)
+        """
+        dates = date_range(date_from, date_to)
+        strategy = self.strategy
+        if strategy == 'auto':
+            strategy = plan_strategy(len(dates), codes, self.offline)
+        if strategy == 'dynamic' and codes:
+            payloads = self.fetch_dynamic_range(date_from, date_to, codes)
+            if payloads is not False:
+                yield from self.write_dynamic_range(date_from, date_to, payloads)
+                return
+            self.logger.log('WARNING: Currency data is not got by dynamic requests, daily requests are used')
+        yield from self.iter_dates(dates, codes, failed_dates)
+
+    def fetch_dynamic_range(self, date_from, date_to, codes):
+        """Retrieve currency data of range by one GetCursDynamicXML request per currency
+
+        :param date_from: First date of range in DD.MM.YYYY format
+        :param date_to: Last date of range in DD.MM.YYYY format
+        :param codes: Numeric codes of requested currencies
+        :return: dict of YYYYMMDD dates when rates were set and rows of currencies in requested order or False if
+            currency data is not got or internal code of any requested currency is unknown
+        """
+        self.logger.log(f'DYNAMIC MODE IS STARTED - {len(codes)} currencies, one request per currency')
+        directory = self.currency_directory()
+        if not directory:
+            return False
+        currencies = []
+        for code in codes:
+            currency = directory.get(code)
+            if currency and currency.get('internal_code'):
+                currencies.append(currency)
+            else:
+                # currency is not listed in directory (historical one) or directory of saved rows has no internal
+                # codes of web service, the currency can be requested by daily requests only
+                self.logger.log(f'WARNING: Internal code of currency {code} is unknown')
+                return False
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(lambda currency: self.fetch_dynamic(currency, date_from, date_to), currencies))
+        if any(rows is False for rows in results):
+            return False
+
+        payloads = {}
+        for rows in results:
+            for date, row in rows:
+                payloads.setdefault(date, []).append(row)
+        return payloads
+
+    def write_dynamic_range(self, date_from, date_to, payloads):
+        """Save currency data got by fetch_dynamic_range into database in order of dates (one data block per date
+        when rates were set). Aliases of other past dates of range are saved too.
 
-        :param payload: Data block to save into database. Format: {'date': 'YYYYMMDD', 'rows' : list of Currency data}.
-            Each item of 'rows' list must be a dict with following keys: 'name', 'numeric_code', 'alphabetic_code',
-            'scale' and 'rate'
+        :param date_from: First date of range in DD.MM.YYYY format
+        :param date_to: Last date of range in DD.MM.YYYY format
+        :param payloads: dict of YYYYMMDD dates and rows (see fetch_dynamic_range)
+        :return: generator of really inserted rows (see DbController.write_data)
         """
-        db = DbController(self.db_file, self.logger, rewrite_mode=self.args.args['rewrite'])
-        report = db.write_data(payload)
-        db.close_db()
+        db = self.database()
+        commit_interval = self.range_commit_interval(len(payloads))
+        if commit_interval > 1:
+            db.begin_bulk_load(commit_interval)
+        try:
+            ondate = None  # date of the last saved currency set
+            dates = {db_controller.db_date(date) for date in date_range(date_from, date_to)}
+            for date in sorted(dates.union(payloads)):
+                if date in payloads:
+                    ondate = date
+                    yield from db.write_data({'date': date, 'rows': payloads[date]}, replace=self.rewrite)
+                elif ondate and is_past(db_controller.human_date(date)):
+                    # rates were not set at the date (weekend or holiday), so sync never requests it
+                    db.insert_alias(date, ondate)
+            db.commit()
+        except BaseException:
+            if commit_interval > 1:
+                db.abort_bulk_load()
+            raise
+        if commit_interval > 1:
+            db.end_bulk_load()
+
+    def range_commit_interval(self, dates):
+        """Count of dates per transaction at range run of dates count. Replaced range is saved in one transaction."""
+        return max(dates, self.commit_interval) if self.rewrite else self.commit_interval
+
+    def sync(self, date_from, date_to, codes=None):
+        """Retrieve and save currency data of range dates which are missing in database only (see iter_sync)
+
+        :param date_from: First date of range in DD.MM.YYYY format
+        :param date_to: Last date of range in DD.MM.YYYY format
+        :param codes: Numeric codes of requested currencies (all currencies if it is omitted)
+        :return: tuple of report of really inserted rows and list of dates which currency data is not got for
+        """
+        failed_dates = []
+        report = list(self.iter_sync(date_from, date_to, codes, failed_dates))
+        return report, failed_dates
+
+    def iter_sync(self, date_from, date_to, codes=None, failed_dates=None):
+        """Retrieve and save currency data of range dates which are missing in database only. Dates which are known as
+        weekends or holidays (there is an alias of currency set of previous date) are not requested.
+
+        :param date_from: First date of range in DD.MM.YYYY format
+        :param date_to: Last date of range in DD.MM.YYYY format
+        :param codes: Numeric codes of requested currencies (all currencies if it is omitted)
+        :param failed_dates: List which dates are appended to if their currency data is not got, optional
+        :return: generator of really inserted rows (see DbController.write_data)
+        """
+        dates = date_range(date_from, date_to)
+        missing = self.database().missing_dates([db_controller.db_date(date) for date in dates])
+        self.logger.log(f'SYNC MODE IS STARTED - {len(missing)} of {len(dates)} dates are missing')
+        for first, last in gaps(missing):
+            self.logger.log(f'Gap: {db_controller.human_date(first)} - {db_controller.human_date(last)}')
+        yield from self.iter_dates([db_controller.human_date(date) for date in missing], codes, failed_dates)
+
+    def iter_dates(self, dates, codes=None, failed_dates=None):
+        """Retrieve and save currency data of every date of list. Currency data is requested and parsed by pool of
+        worker threads, count of requests in flight is limited by workers. Parsed data blocks are saved into database
+        by single writer (the thread which iterates the generator) in order of dates.
+
+        :param dates: List of dates in DD.MM.YYYY format
+        :param codes: Numeric codes of requested currencies (all currencies if it is omitted)
+        :param failed_dates: List which dates are appended to if their currency data is not got, optional
+        :return: generator of really inserted rows (see DbController.write_data)
+        """
+        workers = self.workers
+        self.logger.log(f'RANGE MODE IS STARTED - {len(dates)} dates, up to {workers} requests in flight')
+
+        db = self.database()
+        failed = []
+
+        def save(date, future):
+            payload = future.result()
+            if payload:
+                return self.save(date, payload)
+            failed.append(date)
+            return []
+
+        commit_interval = self.range_commit_interval(len(dates))
+        if commit_interval > 1:
+            db.begin_bulk_load(commit_interval)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pending = deque()  # futures in order of dates, there are no more than 2 * workers of them
+                for date in dates:
+                    pending.append((date, executor.submit(self.fetch_payload, date, codes)))
+                    if len(pending) >= 2 * workers:
+                        yield from save(*pending.popleft())
+                while pending:
+                    yield from save(*pending.popleft())
+        except BaseException:
+            if commit_interval > 1:
+                db.abort_bulk_load()
+            raise
+        if commit_interval > 1:
+            db.end_bulk_load()
+
+        for date in failed:
+            self.logger.log(f'WARNING: No currency data is saved for {date}')
+        if failed_dates is not None:
+            failed_dates.extend(failed)
+
+    def poll(self, codes=None):
+        """Save currency sets of today and tomorrow if they are published and not saved yet. Central bank publishes
+        currency set of the next day in the afternoon.
+
+        :param codes: Numeric codes of requested currencies (all currencies if it is omitted)
+        :return: Report of really inserted rows
+        """
+        report = []
+        today = dt.date.today()
+        for date in (today, today + dt.timedelta(days=1)):
+            date = date.strftime('%d.%m.%Y')
+            if self.database().date_exist_order_id(db_controller.db_date(date)):
+                continue
+            payload = self.fetch_payload(date, codes)
+            if payload and payload['date'] == db_controller.db_date(date):
+                report.extend(self.database().write_data(payload))
+            elif payload:
+                self.logger.log(f'Currency set for {date} is not published yet')
+        return report
+
+    def daemon(self, codes=None, interval=DEFAULT_INTERVAL, stop_event=None):
+        """Long-running mode: poll web service for the daily publication every interval seconds until stop_event is
+        set. Database connection and web service connections are shared by all polls.
+
+        :param codes: Numeric codes of requested currencies (all currencies if it is omitted)
+        :param interval: Seconds between polls
+        :param stop_event: threading.Event to stop the loop, optional
+        """
+        stop_event = stop_event or threading.Event()
+        self.logger.log(f'DAEMON MODE IS STARTED - web service is polled every {interval} s')
+        while not stop_event.is_set():
+            report = self.poll(codes)
+            if report:
+                self.logger.log(f'Daemon poll saved {len(report)} rows')
+            self.logger.flush()
+            stop_event.wait(interval)
+
+    def close(self):
+        """Close database and web service connections"""
+        self.policy.close()
+        self.client.close()
+        if self.db is not None:
+            self.db.close_db()
+            self.db = None
+
 
-        if self.logger.enable:
-            report.insert(0, ['№ расп.', 'Дата', 'Валюта', 'Номинал', 'Курс'])
+class OnDateCurs:
+    """Currency service command-line launcher. Service job is done by constructor, the process is stopped at
+    errors. Use CurrencyService to retrieve currency data from python code without these side effects."""
+    def __init__(self, db_file, options=None, log_enable=True, url=DEFAULT_URL):
+        # console log goes to stderr, so report written to stdout can be piped into other tools
+        self.logger = Logger('ondatecurs.log', enable=log_enable, show_time=True, console=sys.stderr)
+        self.logger.log('Service have been started')
+        self.args = SysArgsParser(
+            require_args=['codes'],
+            init_args=options,
+            logger=self.logger)
+
+        self.db_file = db_file
+        args = self.args.args
+        self.service = CurrencyService(
+            db_file,
+            self.logger,
+            url=url,
+            cache_dir=args.get('cache'),
+            offline=args['offline'],
+            workers=int(args.get('workers', DEFAULT_WORKERS)),
+            rewrite=args['rewrite'],
+            commit_interval=int(args.get('commit-interval', DEFAULT_COMMIT_INTERVAL)),
+            strategy=args.get('strategy', 'auto'),
+            deadline=float(args.get('deadline', DEFAULT_DEADLINE)),
+            retries=int(args.get('retries', DEFAULT_RETRIES)),
+            hedge=float(args['hedge']) if 'hedge' in args else None,
+            memory=':memory:' if args['in-memory'] else None,
+            snapshot_interval=float(args['snapshot-interval']) if 'snapshot-interval' in args else None,
+        )
+
+        profile = cProfile.Profile() if args['profile'] else None
+        try:
+            if profile:
+                profile.runcall(self.main_routine)
+            else:
+                self.main_routine()
+        finally:
+            self.service.close()
+            self.save_metrics(profile)
+            self.logger.flush()
+
+    def save_metrics(self, profile=None):
+        """Log stage metrics and save them to file of --metrics option. Save profile stats of --profile option.
+        Metrics summary is logged at DEBUG level, at INFO level with --profile option."""
+        metrics = self.service.metrics
+        level = INFO if profile else DEBUG
+        for line in metrics.summary():
+            self.logger.log(f'Metrics: {line}', level=level)
+        path = self.args.args.get('metrics')
+        if path and not self.args.error:
+            metrics.save(path)
+            self.logger.log(f'Metrics are saved to {path}')
+        if profile:
+            profile.dump_stats(DEFAULT_PROFILE_FILE)
+            self.logger.log(f'Profile stats are saved to {DEFAULT_PROFILE_FILE} (python -m pstats {DEFAULT_PROFILE_FILE})')
+
+    def stop(self):
+        """Emergency stop the service"""
+        self.logger.log('Service stopped')
+        exit()
+
+    def codes(self):
+        """Numeric and alphabetic codes specified at service launch (None for all currencies)"""
+        codes = self.args.args['codes'].replace(' ', '')
+        return None if codes == '*' else codes.split(',')
+
+    def main_routine(self):
+        """Main logic of service"""
+        args = self.args.args
+        if self.args.error:  # check input arguments
+            self.stop()
+        codes = self.codes()
+        if codes:  # unknown codes are rejected before any currency data request
+            codes, unknown = self.service.resolve_codes(codes)
+            if unknown:
+                self.logger.log(f'ERROR: Unknown currency codes: {", ".join(unknown)}')
+                self.stop()
+
+        if args['daemon']:
+            self.service.daemon(codes, interval=float(args.get('interval', DEFAULT_INTERVAL)))
+        elif args['sync']:
+            # report rows are rendered as soon as they are saved
+            self.print_report(self.service.iter_sync(args['from'], args['to'], codes))
+        elif 'from' in args:
+            self.print_report(self.service.iter_range(args['from'], args['to'], codes))
+        else:
+            report = self.service.run(args['date'], codes)
+            if report is False:
+                # failed date is a result of the run like at range runs, the process is not stopped
+                self.logger.log(f'WARNING: No currency data is saved for {args["date"]}')
+                report = []
+            self.print_report(report)
+
+    def print_report(self, report):
+        """Print database update report in format of --report option (box table by default). Report is written to
+        file of --report-file option if it is specified. Machine-readable report (csv or jsonl) is written to stdout
+        even if logging is disabled, box table is printed with enabled logging only.
+
+        :param report: Iterable of inserted rows returned by DbController.write_data (a generator is read once)
+        """
+        fmt = self.args.args.get('report', 'table')
+        path = self.args.args.get('report-file')
+        header = REPORT_HEADER if fmt == 'table' else REPORT_COLUMNS
+        if path:
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                render_table(report, stream=f, header=header, fmt=fmt)
+            self.logger.log(f'Database update report is saved to {path}')
+        elif fmt != 'table':
+            render_table(report, header=header, fmt=fmt)
+        elif self.logger.enable:
             print('\nDatabase update report:')
-            print_pretty_table(report)
+            render_table(report, header=header, fmt=fmt)
+        else:
+            deque(report, maxlen=0)  # report is not printed, but rows of a generator are saved while it is iterated
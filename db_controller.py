@@ -1,9 +1,35 @@
+import hashlib
 import sqlite3
+import time
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from metrics import Metrics
+from tables import currency_alias_structure
+from tables import currency_directory_structure
 from tables import currency_order_structure
+from tables import currency_stats_structure
 from tables import currency_rates_structure
+from tables import CurrencyRow
 from os.path import exists
 
 
+# columns of CURRENCY_RATES table in order of its structure
+RATES_COLUMNS = [column['name'] for column in currency_rates_structure['columns']]
+
+RATE_PRECISION = 4  # rate_value column keeps rate multiplied by 10 ** RATE_PRECISION
+
+SCHEMA_VERSION = 5  # it is kept in 'user_version' pragma of database
+
+BUSY_TIMEOUT = 5000  # milliseconds to wait for locks of other connections
+
+# connection settings of bulk-load mode: write-ahead log, less fsync calls and larger page cache
+BULK_LOAD_PRAGMAS = [
+    'PRAGMA journal_mode = WAL;',
+    'PRAGMA synchronous = NORMAL;',
+    'PRAGMA cache_size = -65536;',  # 64 MiB
+    'PRAGMA temp_store = MEMORY;',
+]
+
+
 def create_table_stmt(table_structure: dict):
     """Build SQL statement for creating a new table in SQLite database
 
@@ -43,6 +69,162 @@ def create_table_stmt(table_structure: dict):
     return statement
 
 
+def create_index_stmts(table_structure: dict):
+    """Build SQL statements for creating indexes of a table. Unique indexes are used as composite unique keys.
+
+    :param table_structure: dictionary describing table structure and other options
+    :type table_structure: dict
+    :return: List of ready to use SQL statements for creating indexes
+    :rtype: list
+    """
+    statements = []
+    for index in table_structure.get('indexes', []):
+        unique = ' UNIQUE' if index.get('unique') else ''
+        columns = ', '.join(index['columns'])
+        statements.append(
+            f'CREATE{unique} INDEX IF NOT EXISTS {index["name"]} ON {table_structure["name"]} ({columns});'
+        )
+    return statements
+
+
+def rate_to_int(rate: str):
+    """Convert rate text to exact integer number of 1 / 10 ** RATE_PRECISION parts
+
+    :param rate: Rate text with decimal point or Russian decimal comma ('74,0448' for example)
+    :return: Integer value (740448 for example) or None if rate text is not a number
+    """
+    try:
+        value = Decimal(rate.replace(',', '.')).scaleb(RATE_PRECISION)
+    except (InvalidOperation, AttributeError):
+        return None
+    return int(value.to_integral_value(ROUND_HALF_UP))
+
+
+def migration_1(cur):
+    """Schema version 1: rate_value column, unique key of currency in order and index of currency history"""
+    columns = [row[1] for row in cur.execute('PRAGMA table_info(CURRENCY_RATES);')]
+    if 'rate_value' not in columns:
+        cur.execute('ALTER TABLE CURRENCY_RATES ADD COLUMN rate_value INTEGER;')
+    cur.execute('UPDATE CURRENCY_RATES SET rate_value = rate_to_int(rate);')
+    # keep only first saved row of every currency in order, otherwise unique index can not be created
+    cur.execute(
+        'DELETE FROM CURRENCY_RATES WHERE rowid NOT IN '
+        '(SELECT MIN(rowid) FROM CURRENCY_RATES GROUP BY order_id, numeric_code);'
+    )
+    for stmt in create_index_stmts(currency_rates_structure):
+        cur.execute(stmt)
+
+
+def migration_2(cur):
+    """Schema version 2: aliases of dates without published currency set (weekends and holidays)"""
+    cur.execute(create_table_stmt(currency_alias_structure))
+
+
+def migration_3(cur):
+    """Schema version 3: directory of currencies (numeric, alphabetic and internal codes of web service)"""
+    cur.execute(create_table_stmt(currency_directory_structure))
+
+
+def migration_4(cur):
+    """Schema version 4: content hash of currency set of order (it is calculated at the next replace of the date)"""
+    columns = [row[1] for row in cur.execute('PRAGMA table_info(CURRENCY_ORDER);')]
+    if 'content_hash' not in columns:
+        cur.execute('ALTER TABLE CURRENCY_ORDER ADD COLUMN content_hash TEXT;')
+
+
+def migration_5(cur):
+    """Schema version 5: monthly and yearly statistics of rates (they are calculated from saved rows)"""
+    cur.execute(create_table_stmt(currency_stats_structure))
+    for stmt in create_index_stmts(currency_stats_structure):
+        cur.execute(stmt)
+    rebuild_stats(cur)
+
+
+# MIGRATIONS[n] upgrades schema from version n to version n + 1
+MIGRATIONS = [migration_1, migration_2, migration_3, migration_4, migration_5]
+
+# columns of CURRENCY_DIRECTORY table which are keys of currency dicts
+DIRECTORY_KEYS = ('numeric_code', 'alphabetic_code', 'internal_code', 'name', 'scale')
+
+
+def content_hash(rows):
+    """Hash of currency set content. It does not depend on order of rows.
+
+    :param rows: Iterable of CurrencyRow records
+    :return: Hex digest
+    :rtype: str
+    """
+    lines = sorted(
+        '\x1f'.join((row.numeric_code, row.alphabetic_code, row.name, str(row.scale), row.rate)) for row in rows
+    )
+    return hashlib.sha1('\n'.join(lines).encode('utf-8')).hexdigest()
+
+
+def replace_rows_stmt():
+    """Build SQL statement which inserts CURRENCY_RATES row or updates saved row of the same currency in order"""
+    updates = ', '.join(f'{column} = excluded.{column}' for column in RATES_COLUMNS[1:] if column != 'numeric_code')
+    stmt = insert_rows_stmt('CURRENCY_RATES', RATES_COLUMNS, named=False)
+    return f'{stmt[:-1]} ON CONFLICT (order_id, numeric_code) DO UPDATE SET {updates};'
+
+
+# lengths of YYYYMMDD date prefixes which are periods of CURRENCY_STATS: month (YYYYMM) and year (YYYY)
+STATS_PERIODS = (6, 4)
+
+# adds one rate to statistics of period, the latest date of period defines its last rate
+STATS_UPSERT_STMT = (
+    'INSERT INTO CURRENCY_STATS (period, numeric_code, count, total, minimum, maximum, last_date, last_value) '
+    'VALUES (?, ?, 1, ?, ?, ?, ?, ?) ON CONFLICT (period, numeric_code) DO UPDATE SET '
+    'count = count + 1, total = total + excluded.total, minimum = min(minimum, excluded.minimum), '
+    'maximum = max(maximum, excluded.maximum), '
+    'last_value = CASE WHEN excluded.last_date >= last_date THEN excluded.last_value ELSE last_value END, '
+    'last_date = max(last_date, excluded.last_date);'
+)
+
+
+def rebuild_stats(cur, codes=None, periods=None):
+    """Calculate statistics of CURRENCY_STATS table from saved rows of CURRENCY_RATES table. Rows are scanned once,
+    last rate of every period is found by window function.
+
+    :param cur: Database cursor
+    :param codes: Numeric codes of currencies to recalculate (all currencies if it is omitted)
+    :param periods: Periods (YYYYMM months and YYYY years) to recalculate (all periods if it is omitted)
+    """
+    stats_conditions, stats_params = [], []  # conditions of CURRENCY_STATS rows
+    rows_conditions, rows_params = [], []  # conditions of saved rows, they are checked before join of periods
+    if codes:
+        placeholders = ', '.join('?' * len(codes))
+        stats_conditions.append(f'numeric_code IN ({placeholders})')
+        stats_params.extend(codes)
+        rows_conditions.append(f'r.numeric_code IN ({placeholders})')
+        rows_params.extend(codes)
+    if periods:
+        placeholders = ', '.join('?' * len(periods))
+        stats_conditions.append(f'period IN ({placeholders})')
+        stats_params.extend(periods)
+        rows_conditions.append('o.ondate BETWEEN ? AND ?')
+        # YYYYMMDD bounds of all periods, saved rows are filtered by index of dates
+        rows_params.append(min(period.ljust(8, '0') for period in periods))
+        rows_params.append(max(period.ljust(8, '9') for period in periods))
+        rows_conditions.append(f'substr(o.ondate, 1, p.length) IN ({placeholders})')
+        rows_params.extend(periods)
+    stats_where = f' WHERE {" AND ".join(stats_conditions)}' if stats_conditions else ''
+    rows_where = ''.join(f' AND {condition}' for condition in rows_conditions)
+    lengths = ' UNION ALL '.join(f'SELECT {length} AS length' for length in STATS_PERIODS)
+
+    cur.execute(f'DELETE FROM CURRENCY_STATS{stats_where};', stats_params)
+    cur.execute(
+        f'WITH rates AS (SELECT substr(o.ondate, 1, p.length) AS period, r.numeric_code, o.ondate, '
+        f'r.rate_value * 1.0 / ({10 ** RATE_PRECISION} * r.scale) AS value, '
+        f'ROW_NUMBER() OVER (PARTITION BY substr(o.ondate, 1, p.length), r.numeric_code '
+        f'ORDER BY o.ondate DESC) AS recency '
+        f'FROM CURRENCY_RATES r JOIN CURRENCY_ORDER o ON o.id = r.order_id JOIN ({lengths}) p '
+        f'WHERE r.rate_value IS NOT NULL AND r.scale > 0{rows_where}) '
+        f'INSERT INTO CURRENCY_STATS (period, numeric_code, count, total, minimum, maximum, last_date, last_value) '
+        f'SELECT period, numeric_code, COUNT(*), SUM(value), MIN(value), MAX(value), MAX(ondate), '
+        f'MAX(CASE WHEN recency = 1 THEN value END) '
+        f'FROM rates GROUP BY period, numeric_code;', rows_params)
+
+
 def human_date(db_date: str):
     """Convert YYYYMMDD date format to DD.MM.YYYY format
 
@@ -58,6 +240,16 @@ def human_date(db_date: str):
     return hum_date
 
 
+def db_date(hum_date: str):
+    """Convert DD.MM.YYYY date format to YYYYMMDD format
+
+    :param hum_date: DD.MM.YYYY string (for example '20.10.1981')
+    :return: YYYYMMDD string ('19811020' for example)
+    :rtype: str
+    """
+    return f'{hum_date[6:]}{hum_date[3:5]}{hum_date[:2]}'
+
+
 def insert_order_stmt(date, order_id):
     """Build SQL statement for inserting a new record into CURRENCY_ORDER table.
     You can specify order-id exactly by order_id parameter.
@@ -67,29 +259,32 @@ def insert_order_stmt(date, order_id):
     :type date: str
     :param order_id: Value of 'id' column
     :type order_id: str or int, optional
-    :return: Ready to use SQL statement for inserting a record into CURRENCY_ORDER table
+    :return: Tuple of ready to use parameterized SQL statement for inserting a record into CURRENCY_ORDER table and
+        its parameters
     """
     if order_id:
-        stmt = f"INSERT INTO CURRENCY_ORDER VALUES ({str(order_id)}, '{date}');"
-    else:
-        stmt = f"INSERT INTO CURRENCY_ORDER (ondate) VALUES ('{date}');"
-    # print(stmt)
-    return stmt
+        return 'INSERT INTO CURRENCY_ORDER (id, ondate) VALUES (?, ?);', (int(order_id), date)
+    return 'INSERT INTO CURRENCY_ORDER (ondate) VALUES (?) RETURNING id;', (date,)
 
 
-def insert_rows_stmt(table_name, rows: list):
-    """ Build SQL statement for inserting a list of records into SQLite table.
+def insert_rows_stmt(table_name, columns: list, conflict=None, named=True):
+    """ Build parameterized SQL statement for inserting records into SQLite table. It is used with executemany(),
+    so values are never interpolated into statement text.
 
     :param table_name: A target table into which records will be inserted
     :param table_name: str
-    :param rows: A list of records to insert. Each item of this list must be a dict with structure:
-                 {first_column: value, second_column: value, ...} and specify all of the table columns
-    :type rows: List
-    :return: Ready to use SQL statement for inserting a multiple records into target table
+    :param columns: A list of column names. Each inserted record must be a dict with these keys (or a tuple of values
+        in the same order if named is False).
+    :type columns: list
+    :param conflict: Conflict resolution algorithm ('IGNORE', 'REPLACE' and etc.), optional
+    :param named: If True named placeholders are used, otherwise positional ones
+    :return: Ready to use SQL statement
     :rtype: str
     """
-    values_stmt = ', '.join([f"""({', '.join([f"'{value}'" for value in row.values()])})""" for row in rows])
-    stmt = f"INSERT INTO {table_name} VALUES {values_stmt};"
+    or_stmt = f' OR {conflict}' if conflict else ''
+    columns_stmt = ', '.join(columns)
+    values_stmt = ', '.join(f':{column}' if named else '?' for column in columns)
+    stmt = f"INSERT{or_stmt} INTO {table_name} ({columns_stmt}) VALUES ({values_stmt});"
     return stmt
 
 
@@ -98,28 +293,88 @@ class DbController:
     object relational mappers, 'SQLAlchemy' for example. But I have choose plain SQL to decrease count of third-party
     libraries  (due to task recommendations).
     """
-    def __init__(self, db_file, logger, rewrite_mode=False):
+    def __init__(self, db_file, logger, rewrite_mode=False, shared=False, metrics=None, memory=None,
+                 snapshot_interval=None):
+        """
+        :param shared: If True connection can be used by several threads (caller must serialize access to it)
+        :param metrics: Metrics object for dedupe, insert, write and commit timers and row counters, optional
+        :param memory: In-memory database to work on instead of db_file: ':memory:' or shared-cache URI (for example
+            'file:rates?mode=memory&cache=shared'). Existing db_file is loaded into it at start and it is saved back to
+            db_file by snapshots. Data committed after the last snapshot is lost if the process is killed.
+        :param snapshot_interval: Minimum seconds between snapshots of in-memory database at commits. If it is
+            omitted, snapshot is saved at close_db() only
+        """
         self.logger = logger
+        self.metrics = metrics or Metrics()
         self.db_file = db_file
+        self.memory = memory
+        self.snapshot_interval = snapshot_interval
         db_is_exist = self.check_db()
-        self.con = sqlite3.connect(db_file)
+        if memory:
+            self.con = sqlite3.connect(memory, check_same_thread=not shared, uri=memory.startswith('file:'))
+            if db_is_exist and not rewrite_mode:
+                self.load()
+        else:
+            self.con = sqlite3.connect(db_file, check_same_thread=not shared)
+        self.last_snapshot = time.monotonic()
         self.cur = self.con.cursor()
+        self.cur.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT};')
+        self.commit_interval = 1  # count of write_data calls (dates) per transaction
+        self.uncommitted = 0  # count of write_data calls in current transaction
+        self.con.create_function('rate_to_int', 1, rate_to_int, deterministic=True)
         if not db_is_exist:
             self.create_tables()
         elif rewrite_mode:
             self.drop_tables()
             self.create_tables()
-            self.logger.log('Rewrite mode is set by --rewrite option. Current DB is cleared.')
+            self.logger.log('Rewrite mode is set. Current DB is cleared.')
+        else:
+            self.migrate()
 
     def drop_tables(self):
-        """ Remove CURRENCY_ORDER and CURRENCY_RATES tables """
+        """ Remove CURRENCY_ORDER, CURRENCY_RATES, CURRENCY_ALIAS, CURRENCY_DIRECTORY and CURRENCY_STATS tables """
         self.cur.execute('DROP TABLE IF EXISTS CURRENCY_ORDER')
         self.cur.execute('DROP TABLE IF EXISTS CURRENCY_RATES')
+        self.cur.execute('DROP TABLE IF EXISTS CURRENCY_ALIAS')
+        self.cur.execute('DROP TABLE IF EXISTS CURRENCY_DIRECTORY')
+        self.cur.execute('DROP TABLE IF EXISTS CURRENCY_STATS')
 
     def create_tables(self):
-        """ Create CURRENCY_ORDER and CURRENCY_RATES tables """
-        self.cur.execute(create_table_stmt(currency_rates_structure))
-        self.cur.execute(create_table_stmt(currency_order_structure))
+        """ Create CURRENCY_ORDER, CURRENCY_RATES, CURRENCY_ALIAS, CURRENCY_DIRECTORY and CURRENCY_STATS tables """
+        for structure in (currency_rates_structure, currency_order_structure, currency_alias_structure,
+                          currency_directory_structure, currency_stats_structure):
+            self.cur.execute(create_table_stmt(structure))
+            for stmt in create_index_stmts(structure):
+                self.cur.execute(stmt)
+        self.cur.execute(f'PRAGMA user_version = {SCHEMA_VERSION};')
+
+    def migrate(self):
+        """ Upgrade schema of existing database to SCHEMA_VERSION in place (in one transaction). Saved data is
+        converted, so there is no need to request it again.
+
+        :return: Schema version of database before upgrade
+        :rtype: int
+        """
+        version = self.cur.execute('PRAGMA user_version;').fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return version
+
+        self.cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='CURRENCY_RATES';")
+        if not self.cur.fetchone():
+            self.create_tables()
+            return version
+
+        self.logger.log(f'Database schema is upgraded from version {version} to {SCHEMA_VERSION}')
+        self.cur.execute('BEGIN;')
+        try:
+            for migration in MIGRATIONS[version:]:
+                migration(self.cur)
+            self.cur.execute(f'PRAGMA user_version = {SCHEMA_VERSION};')
+        except sqlite3.Error:
+            self.con.rollback()
+            raise
+        self.con.commit()
+        return version
 
     def check_db(self):
         """ Check database existence on local drive
@@ -153,12 +408,12 @@ class DbController:
         """
 
         expr_list = []
-        for column, value in values.items():
-            expr = f"{column}='{value}'"
+        for column in values.keys():
+            expr = f"{column}=:{column}"
             expr_list.append(expr)
         where_stmt = f' {mode} '.join(expr_list)
         stmt = f"SELECT EXISTS (SELECT * FROM {table} WHERE {where_stmt});"
-        self.cur.execute(stmt)
+        self.cur.execute(stmt, values)
         result = self.cur.fetchone()[0]
         return result == 1
 
@@ -168,9 +423,8 @@ class DbController:
         :param date: Date of order in format 'YYYYMMDD'
         :return: 'Id' value of order date if one exists. 'False' if there is not this date in table.
         """
-        stmt = f"SELECT id FROM CURRENCY_ORDER WHERE ondate='{date}';"
-        # print(stmt)
-        self.cur.execute(stmt)
+        stmt = "SELECT id FROM CURRENCY_ORDER WHERE ondate=?;"
+        self.cur.execute(stmt, (date,))
         f = self.cur.fetchone()
         if f:
             order_id = f[0]
@@ -187,14 +441,11 @@ class DbController:
         :return: Value of 'id' column for inserted record
         :rtype: str
         """
+        stmt, params = insert_order_stmt(date, order)
+        self.cur.execute(stmt, params)
         if order:
-            db_rows = [{'id': order, 'date': date}]
-            stmt = insert_rows_stmt('CURRENCY_ORDER', db_rows)
-            self.cur.execute(stmt)
             order_id = order
         else:
-            stmt = f"INSERT INTO CURRENCY_ORDER (ondate) VALUES ('{date}') RETURNING id;"
-            self.cur.execute(stmt)
             order_id = str(self.cur.fetchone()[0])
         return order_id
 
@@ -203,61 +454,158 @@ class DbController:
         Insert new data in CURRENCY_RATES table. Existing rows are ignored.
 
         :param order_id: order ID from CURRENCY_ORDERS table
-        :param order_cur_data: List or dicts. Each dict is a map of inserted row (without <order_id> column).
-            Dict pattern is {'name': value, 'numeric_code': value, 'alphabetic_code': value, 'scale': value,
-            'rate': value}
+        :param order_cur_data: List of CurrencyRow records (dicts with the same keys are accepted too)
         :type order_cur_data: list
 
-        :returns: A list of inserted (non-ignored) rows (dicts). Order_id values are included.
+        :returns: A list of inserted (non-ignored) CurrencyRow records. They are the same objects as given ones.
         """
 
-        db_rows = []
-        for data in order_cur_data:
-            row = {'order_id': str(order_id)}
-            row.update(data)
-
-            values_for_exist_check = {
-                'order_id': row['order_id'],
-                'numeric_code': row['numeric_code']
-            }
-
-            if self.values_exist('CURRENCY_RATES', values_for_exist_check):
-                self.logger.log(f'WARNING: Currency with code {row["numeric_code"]} is already existed in db. Insert ignored.')
-            else:
-                db_rows.append(row)
+        with self.metrics.timer('dedupe'):
+            # codes which are already saved for the order are found by one statement
+            self.cur.execute('SELECT numeric_code FROM CURRENCY_RATES WHERE order_id=?;', (int(order_id),))
+            existing_codes = {row[0] for row in self.cur.fetchall()}
+
+            db_rows = []
+            for row in order_cur_data:
+                if not isinstance(row, CurrencyRow):
+                    row = CurrencyRow.from_dict(row)
+                if row.numeric_code in existing_codes:
+                    self.logger.log(f'WARNING: Currency with code {row.numeric_code} is already existed in db. Insert ignored.')
+                else:
+                    existing_codes.add(row.numeric_code)  # duplicates inside of data are ignored too
+                    db_rows.append(row)
 
         if len(db_rows) > 0:
-            stmt = insert_rows_stmt('CURRENCY_RATES', db_rows)
-            self.cur.execute(stmt)
-            self.con.commit()
+            stmt = insert_rows_stmt('CURRENCY_RATES', RATES_COLUMNS, conflict='IGNORE', named=False)
+            order = int(order_id)
+            with self.metrics.timer('insert'):
+                # statement parameters are built one by one while rows are inserted
+                self.cur.executemany(stmt, ((order, *row, rate_to_int(row.rate)) for row in db_rows))
+        self.metrics.count('rows_inserted', len(db_rows))
+        self.metrics.count('rows_ignored', len(order_cur_data) - len(db_rows))
 
         return db_rows
 
-    def write_data(self, data, order=None):
+    def insert_alias(self, date, ondate):
+        """Save alias of date without published currency set: currency set of ondate is valid at the date.
+        Existing alias is kept.
+
+        :param date: Requested date in YYYYMMDD format (weekend or holiday)
+        :param ondate: Date of valid currency set in YYYYMMDD format
+        """
+        self.cur.execute('INSERT OR IGNORE INTO CURRENCY_ALIAS (date, ondate) VALUES (?, ?);', (date, ondate))
+
+    def alias_ondate(self, date):
+        """Date of currency set which is valid at aliased date
+
+        :param date: Requested date in YYYYMMDD format
+        :return: Date of valid currency set in YYYYMMDD format or None if there is no alias of the date
+        """
+        row = self.cur.execute('SELECT ondate FROM CURRENCY_ALIAS WHERE date = ?;', (date,)).fetchone()
+        return row[0] if row else None
+
+    def missing_dates(self, dates: list):
+        """Find dates which are neither saved in CURRENCY_ORDER nor known as aliases
+
+        :param dates: Sorted list of dates in YYYYMMDD format
+        :return: List of missing dates in YYYYMMDD format (in the same order)
+        :rtype: list
+        """
+        if not dates:
+            return []
+        bounds = (dates[0], dates[-1])
+        known = {row[0] for row in self.cur.execute(
+            'SELECT ondate FROM CURRENCY_ORDER WHERE ondate BETWEEN ? AND ? '
+            'UNION ALL SELECT date FROM CURRENCY_ALIAS WHERE date BETWEEN ? AND ?;', bounds + bounds)}
+        return [date for date in dates if date not in known]
+
+    def save_directory(self, currencies: list, updated: str):
+        """Replace saved directory of currencies (in one transaction)
+
+        :param currencies: List of currency dicts with keys of DIRECTORY_KEYS
+        :param updated: Date of directory in YYYYMMDD format
+        """
+        self.commit()
+        try:
+            self.cur.execute('DELETE FROM CURRENCY_DIRECTORY;')
+            self.cur.executemany(
+                insert_rows_stmt('CURRENCY_DIRECTORY', DIRECTORY_KEYS + ('updated',), conflict='REPLACE',
+                                 named=False),
+                (tuple(currency.get(key, '') for key in DIRECTORY_KEYS) + (updated,) for currency in currencies))
+        except sqlite3.Error:
+            self.con.rollback()
+            raise
+        self.commit()
+
+    def directory(self):
+        """Read saved directory of currencies
+
+        :return: tuple of list of currency dicts (with keys of DIRECTORY_KEYS) and date of directory in YYYYMMDD format
+            (None if directory is not saved)
+        """
+        self.cur.execute(f'SELECT {", ".join(DIRECTORY_KEYS)}, updated FROM CURRENCY_DIRECTORY;')
+        rows = self.cur.fetchall()
+        updated = min((row[-1] for row in rows), default=None)
+        return [dict(zip(DIRECTORY_KEYS, row)) for row in rows], updated
+
+    def saved_currencies(self):
+        """Currencies of saved currency sets (name and scale of the latest saved row of every currency)
+
+        :return: list of dicts with 'numeric_code', 'alphabetic_code', 'name' and 'scale' keys
+        """
+        self.cur.execute(
+            'SELECT numeric_code, alphabetic_code, name, scale FROM CURRENCY_RATES WHERE rowid IN '
+            '(SELECT MAX(rowid) FROM CURRENCY_RATES GROUP BY numeric_code);'
+        )
+        keys = ('numeric_code', 'alphabetic_code', 'name', 'scale')
+        return [dict(zip(keys, row)) for row in self.cur.fetchall()]
+
+    def write_data(self, data, order=None, alias=None, replace=False):
         """Save prepared Currency data block to database and prepare data for update report. Already existing records
         are ignored. Currency data block must be represented by dictionary of specific format (data parameter).
 
         :param data: Currency data block in below format: {'date': 'YYYYMMDD', 'rows' : list of Currency data}.
-            Each item of included list must be a dict with following keys: 'name', 'numeric_code', 'alphabetic_code',
-            'scale' and 'rate'
+            Each item of included list must be a CurrencyRow record (or a dict with following keys: 'name',
+            'numeric_code', 'alphabetic_code', 'scale' and 'rate')
         :param order: If of order. If order_id is omitted then record will inserted with autoincrement order id.
         :type order: str or int, optional
+        :param alias: Requested date in YYYYMMDD format if it differs from date of currency set (weekend or holiday).
+            Alias is saved in the same transaction.
+        :type alias: str, optional
+        :param replace: If True saved rows of the same currencies are replaced by rows of data block which differ
+            from them (see replace_data) instead of being ignored
         :return: info about rows which ones have been really inserted. Each item of list is a tuple of values
             in following order: id of order, date of currency rate set, name of currency, scale, rate.
         :rtype: list
         """
+        start = time.perf_counter()
         date = data['date']
         cur_data = data['rows']
         exist_date_order = self.date_exist_order_id(date)
 
-        if exist_date_order:
-            self.logger.log(f'WARNING: Order for date {human_date(date)} is already existed with id {exist_date_order}. Insert ignored.')
+        if exist_date_order and replace:
             order_id = exist_date_order
+            inserted_rows = self.replace_data(order_id, date, cur_data)
         else:
-            order_id = self.insert_order(date, order)
-            self.logger.log(f'Order of date {date} with id {order_id} is inserted into db.')
-
-        inserted_rows = self.insert_order_cur_data(order_id, cur_data)
+            if exist_date_order:
+                self.logger.log(f'WARNING: Order for date {human_date(date)} is already existed with id {exist_date_order}. Insert ignored.')
+                order_id = exist_date_order
+            else:
+                order_id = self.insert_order(date, order)
+                self.metrics.count('orders_inserted')
+                self.logger.log(f'Order of date {date} with id {order_id} is inserted into db.')
+
+            inserted_rows = self.insert_order_cur_data(order_id, cur_data)
+            self.update_stats(date, inserted_rows)
+            if not exist_date_order:
+                self.set_content_hash(order_id, content_hash(inserted_rows))
+            elif inserted_rows:
+                self.set_content_hash(order_id, None)  # hash of extended currency set is calculated at replace
+        if alias and alias != date:
+            self.insert_alias(alias, date)
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_interval:
+            self.commit()
 
         inserted_rows_count = len(inserted_rows)
         if inserted_rows_count:
@@ -265,23 +613,195 @@ class DbController:
         else:
             self.logger.log(f'There is no data to insert into database')
 
+        order_id = str(order_id)
+        report_date = human_date(date)
         report = [
-            (
-                row['order_id'],
-                human_date(date),
-                row['name'] + f' ({row["numeric_code"].rjust(3)})',
-                row['scale'],
-                row['rate'],
-            )
+            (order_id, report_date, f'{row.name} ({row.numeric_code.rjust(3)})', row.scale, row.rate)
             for row in inserted_rows
         ]
+        self.metrics.observe('write', time.perf_counter() - start)
 
         return report
 
-        # self.date_exist_order_id(date)
+    def replace_data(self, order_id, date, order_cur_data: list):
+        """Replace saved rows of order by rows which differ from them. If content hash of given rows is equal to saved
+        hash of order, saved rows are not even read. Saved rows of currencies which are absent in given rows are kept.
+
+        :param order_id: order ID from CURRENCY_ORDERS table
+        :param date: Date of order in YYYYMMDD format
+        :param order_cur_data: List of CurrencyRow records (dicts with the same keys are accepted too)
+        :return: List of inserted and updated CurrencyRow records
+        """
+        rows = [row if isinstance(row, CurrencyRow) else CurrencyRow.from_dict(row) for row in order_cur_data]
+        digest = content_hash(rows)
+        self.cur.execute('SELECT content_hash FROM CURRENCY_ORDER WHERE id=?;', (int(order_id),))
+        if self.cur.fetchone()[0] == digest:
+            self.metrics.count('dates_unchanged')
+            self.logger.log(f'Currency data of {human_date(date)} is not changed')
+            return []
+
+        with self.metrics.timer('dedupe'):
+            self.cur.execute(
+                'SELECT name, numeric_code, alphabetic_code, scale, rate FROM CURRENCY_RATES WHERE order_id=?;',
+                (int(order_id),))
+            saved = {row[1]: CurrencyRow(row[0], row[1], row[2], str(row[3]), row[4]) for row in self.cur.fetchall()}
+            changed = [row for row in rows if saved.get(row.numeric_code) != row._replace(scale=str(row.scale))]
+            merged = dict(saved)
+            merged.update((row.numeric_code, row) for row in changed)
+
+        if changed:
+            order = int(order_id)
+            with self.metrics.timer('insert'):
+                self.cur.executemany(replace_rows_stmt(), ((order, *row, rate_to_int(row.rate)) for row in changed))
+            with self.metrics.timer('stats'):
+                # replaced rates can not be subtracted from minimum and maximum, so periods are recalculated
+                rebuild_stats(self.cur, [row.numeric_code for row in changed],
+                              [date[:length] for length in STATS_PERIODS])
+            self.logger.log(f'{len(changed)} rows of {human_date(date)} are replaced')
+        self.metrics.count('rows_replaced', len(changed))
+        self.set_content_hash(order_id, content_hash(merged.values()))
+        return changed
+
+    def update_stats(self, date, rows):
+        """Add rates of inserted rows to monthly and yearly statistics of CURRENCY_STATS table
+
+        :param date: Date of currency set in YYYYMMDD format
+        :param rows: List of inserted CurrencyRow records
+        """
+        params = []
+        for row in rows:
+            value = rate_to_int(row.rate)
+            scale = int(row.scale) if str(row.scale).isdigit() else 0
+            if value is None or not scale:
+                continue
+            value = value / (10 ** RATE_PRECISION * scale)  # one division, like in rebuild_stats
+            params.extend((date[:length], row.numeric_code, value, value, value, date, value) for length in STATS_PERIODS)
+        if params:
+            with self.metrics.timer('stats'):
+                self.cur.executemany(STATS_UPSERT_STMT, params)
+
+    def rebuild_stats(self):
+        """Recalculate all monthly and yearly statistics from saved rows (in one transaction)"""
+        self.commit()
+        try:
+            rebuild_stats(self.cur)
+        except sqlite3.Error:
+            self.con.rollback()
+            raise
+        self.commit()
+        count = self.cur.execute('SELECT COUNT(*) FROM CURRENCY_STATS;').fetchone()[0]
+        self.logger.log(f'Rate statistics are rebuilt, {count} rows')
+
+    def stats(self, period, codes=None):
+        """Read statistics of rates of period
+
+        :param period: Month in YYYYMM format or year in YYYY format
+        :param codes: Numeric codes of currencies to read. All currencies are read if it is omitted
+        :type codes: list, optional
+        :return: List of dicts with following keys: 'numeric_code', 'count', 'average', 'minimum', 'maximum',
+            'last_date' and 'last' (rates are values per unit of currency)
+        :rtype: list
+        """
+        stmt = ('SELECT numeric_code, count, total / count, minimum, maximum, last_date, last_value '
+                'FROM CURRENCY_STATS WHERE period = ?')
+        params = [period]
+        if codes:
+            stmt += f' AND numeric_code IN ({", ".join("?" * len(codes))})'
+            params.extend(codes)
+        self.cur.execute(stmt + ' ORDER BY CAST(numeric_code AS INTEGER);', params)
+        keys = ('numeric_code', 'count', 'average', 'minimum', 'maximum', 'last_date', 'last')
+        return [dict(zip(keys, row)) for row in self.cur.fetchall()]
+
+    def set_content_hash(self, order_id, digest):
+        """Save content hash of currency set of order (None if it is unknown)"""
+        self.cur.execute('UPDATE CURRENCY_ORDER SET content_hash=? WHERE id=?;', (digest, int(order_id)))
+
+    def rates_on_date(self, date, codes=None):
+        """Read saved currency data of one date
+
+        :param date: Date of order in format 'YYYYMMDD'
+        :param codes: Numeric codes of currencies to read. All saved currencies are read if it is omitted
+        :type codes: list, optional
+        :return: List of dicts with following keys: 'name', 'numeric_code', 'alphabetic_code', 'scale', 'rate' and
+            'rate_value'. List is empty if there is no order of the date.
+        :rtype: list
+        """
+        stmt = (
+            'SELECT r.name, r.numeric_code, r.alphabetic_code, r.scale, r.rate, r.rate_value '
+            'FROM CURRENCY_ORDER o JOIN CURRENCY_RATES r ON r.order_id = o.id WHERE o.ondate = ?'
+        )
+        params = [date]
+        if codes:
+            stmt += f' AND r.numeric_code IN ({", ".join("?" * len(codes))})'
+            params.extend(codes)
+        self.cur.execute(stmt + ';', params)
+        keys = ('name', 'numeric_code', 'alphabetic_code', 'scale', 'rate', 'rate_value')
+        return [dict(zip(keys, row)) for row in self.cur.fetchall()]
+
+    def commit(self):
+        """Commit current transaction. In-memory database is saved to file if snapshot interval is passed."""
+        with self.metrics.timer('commit'):
+            self.con.commit()
+        self.uncommitted = 0
+        if self.memory and self.snapshot_interval and \
+                time.monotonic() - self.last_snapshot >= self.snapshot_interval:
+            self.snapshot()
+
+    def load(self):
+        """Copy database file into in-memory database by SQLite backup API"""
+        disk = sqlite3.connect(self.db_file)
+        try:
+            disk.backup(self.con)
+        finally:
+            disk.close()
+        self.logger.log(f'Database {self.db_file} is loaded into memory')
+
+    def snapshot(self):
+        """Save committed data of in-memory database to database file by SQLite backup API. File is replaced in one
+        transaction of backup, so readers of the file never see a partial snapshot."""
+        if not self.memory:
+            return
+        with self.metrics.timer('snapshot'):
+            self.con.commit()
+            disk = sqlite3.connect(self.db_file)
+            try:
+                self.con.backup(disk)
+            finally:
+                disk.close()
+        self.last_snapshot = time.monotonic()
+        self.logger.log(f'Snapshot of in-memory database is saved to {self.db_file}')
+
+    def begin_bulk_load(self, commit_interval=100):
+        """Switch connection to bulk-load mode: write-ahead log journal, NORMAL synchronous level, larger page cache
+        and one transaction per commit_interval saved dates. WAL journal mode is kept in database file.
+
+        :param commit_interval: Count of write_data calls (dates) per transaction
+        """
+        self.commit()
+        for stmt in BULK_LOAD_PRAGMAS:
+            self.cur.execute(stmt)
+        self.commit_interval = commit_interval
+        self.logger.log(f'Bulk-load mode is started, commit every {commit_interval} dates')
+
+    def end_bulk_load(self):
+        """Commit saved data and return connection to default mode (one transaction per date)"""
+        self.commit()
+        self.cur.execute('PRAGMA synchronous = FULL;')
+        self.commit_interval = 1
+
+    def abort_bulk_load(self):
+        """Roll back data saved since the last commit and return connection to default mode. It is called instead of
+        end_bulk_load if bulk load is failed."""
+        self.con.rollback()
+        self.uncommitted = 0
+        self.cur.execute('PRAGMA synchronous = FULL;')
+        self.commit_interval = 1
+        self.logger.log('Bulk-load mode is aborted, uncommitted data is rolled back')
 
     def close_db(self):
-        """Close connection to database"""
+        """Close connection to database. In-memory database is saved to file before."""
+        self.commit()
+        self.snapshot()
         self.con.close()
         self.logger.log('Database closed')
 
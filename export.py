@@ -0,0 +1,202 @@
+"""Export of saved rate history as date x currency matrix. Rows are streamed from the database cursor straight to the
+output file, so memory usage does not depend on history length. Usage:
+
+    python export.py --format=csv|jsonl|npy [--db=currency.db] [--from=dd.mm.yyyy] [--to=dd.mm.yyyy]
+                     [--codes=code1,code2,...] [--output=rates.csv]
+
+Matrix values are rates of one currency unit (rate divided by scale), missing values are empty (CSV), null (JSON
+Lines) or NaN (npy). `npy` format writes three files: <output> - float64 matrix, <output without .npy>-dates.npy -
+int32 array of YYYYMMDD dates of matrix rows and <output without .npy>.json - header with matrix columns. Both arrays
+can be loaded by numpy.load() or numpy.memmap().
+
+.. moduleauthor:: Max Dubrovin <mihadxdx@gmail.com>
+
+"""
+
+import json
+import sqlite3
+import struct
+import sys
+from array import array
+
+from db_controller import RATE_PRECISION, db_date
+
+
+FORMATS = ('csv', 'jsonl', 'npy')
+NPY_HEADER_SIZE = 128  # header is reserved before rows are streamed and rewritten when count of rows is known
+
+COLUMNS_STMT = (
+    'SELECT r.numeric_code, r.alphabetic_code, r.name, MAX(o.ondate) '
+    'FROM CURRENCY_ORDER o JOIN CURRENCY_RATES r ON r.order_id = o.id '
+    'WHERE o.ondate BETWEEN ? AND ?{codes} GROUP BY r.numeric_code ORDER BY CAST(r.numeric_code AS INTEGER);'
+)
+MATRIX_STMT = (
+    'SELECT o.ondate, r.numeric_code, r.rate_value, r.scale '
+    'FROM CURRENCY_ORDER o JOIN CURRENCY_RATES r ON r.order_id = o.id '
+    'WHERE o.ondate BETWEEN ? AND ?{codes} ORDER BY o.ondate;'
+)
+
+
+def codes_filter(codes):
+    """SQL condition of currency codes (empty if all currencies are exported)"""
+    return f' AND r.numeric_code IN ({", ".join("?" * len(codes))})' if codes else ''
+
+
+def currency_columns(con, date_from, date_to, codes=None):
+    """Currencies of exported range sorted by numeric code (names are taken from the latest currency set)
+
+    :return: list of dicts with numeric_code, alphabetic_code and name keys
+    """
+    rows = con.execute(COLUMNS_STMT.format(codes=codes_filter(codes)), [date_from, date_to] + list(codes or []))
+    return [dict(numeric_code=code, alphabetic_code=alpha, name=name) for code, alpha, name, _ in rows]
+
+
+def matrix_rows(con, columns, date_from, date_to, codes=None):
+    """Generator of matrix rows. Rows of the cursor are read one by one and grouped by date.
+
+    :param columns: Numeric codes of matrix columns
+    :return: tuples of YYYYMMDD date and list of rates of one unit (None if currency is missing at the date)
+    """
+    position = {code: index for index, code in enumerate(columns)}
+    divider = 10 ** RATE_PRECISION
+    cursor = con.execute(MATRIX_STMT.format(codes=codes_filter(codes)), [date_from, date_to] + list(codes or []))
+    current, values = None, None
+    for ondate, code, rate_value, scale in cursor:
+        if ondate != current:
+            if current is not None:
+                yield current, values
+            current, values = ondate, [None] * len(columns)
+        if rate_value is not None:  # rate text which is not a number is saved as NULL
+            values[position[code]] = rate_value / (divider * (scale or 1))
+    if current is not None:
+        yield current, values
+
+
+def iso_date(date):
+    """Convert YYYYMMDD date to YYYY-MM-DD format"""
+    return f'{date[:4]}-{date[4:6]}-{date[6:]}'
+
+
+def write_csv(path, columns, rows):
+    """Write matrix rows to CSV file (header row contains alphabetic codes)
+
+    :return: Count of written rows
+    """
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(','.join(['date'] + [column['alphabetic_code'] or column['numeric_code'] for column in columns]))
+        f.write('\n')
+        for date, values in rows:
+            f.write(iso_date(date) + ',' + ','.join('' if value is None else repr(value) for value in values) + '\n')
+            count += 1
+    return count
+
+
+def write_jsonl(path, columns, rows):
+    """Write matrix rows to JSON Lines file: one object per date, rates are keyed by numeric codes
+
+    :return: Count of written rows
+    """
+    count = 0
+    codes = [column['numeric_code'] for column in columns]
+    with open(path, 'w', encoding='utf-8') as f:
+        for date, values in rows:
+            f.write(json.dumps({'date': iso_date(date), 'rates': dict(zip(codes, values))}) + '\n')
+            count += 1
+    return count
+
+
+class NpyWriter:
+    """Writer of NumPy .npy file (format version 1.0) with unknown count of rows. Header is reserved at start and
+    rewritten with real array shape when file is closed.
+
+    :param path: Path of file
+    :param typecode: array module typecode of items ('d' - float64, 'i' - int32)
+    :param columns: Count of columns (None - one-dimensional array)
+    """
+    DESCR = {'d': 'f8', 'i': 'i4'}
+
+    def __init__(self, path, typecode, columns=None):
+        self.file = open(path, 'wb')
+        self.typecode = typecode
+        self.columns = columns
+        self.rows = 0
+        self.file.write(self.header())
+
+    def header(self):
+        shape = (self.rows,) if self.columns is None else (self.rows, self.columns)
+        order = '<' if sys.byteorder == 'little' else '>'
+        text = f"{{'descr': '{order}{self.DESCR[self.typecode]}', 'fortran_order': False, 'shape': {shape}, }}"
+        text = text.ljust(NPY_HEADER_SIZE - 10 - 1) + '\n'
+        return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(text)) + text.encode('latin-1')
+
+    def write(self, values):
+        """Append one row (or one item of one-dimensional array)"""
+        if self.columns is None:
+            values = [values]
+        self.file.write(array(self.typecode, values).tobytes())
+        self.rows += 1
+
+    def close(self):
+        self.file.seek(0)
+        self.file.write(self.header())
+        self.file.close()
+
+
+def write_npy(path, columns, rows):
+    """Write matrix rows to .npy files of matrix and dates and write JSON header
+
+    :return: Count of written rows
+    """
+    base = path[:-4] if path.endswith('.npy') else path
+    matrix = NpyWriter(path, 'd', len(columns))
+    dates = NpyWriter(f'{base}-dates.npy', 'i')
+    nan = float('nan')
+    try:
+        for date, values in rows:
+            matrix.write([nan if value is None else value for value in values])
+            dates.write(int(date))
+    finally:
+        matrix.close()
+        dates.close()
+    with open(f'{base}.json', 'w', encoding='utf-8') as f:
+        json.dump({'rows': matrix.rows, 'columns': columns, 'matrix': path, 'dates': f'{base}-dates.npy',
+                   'values': 'rate of one currency unit'}, f, ensure_ascii=False, indent=2)
+    return matrix.rows
+
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl, 'npy': write_npy}
+
+
+def export(db_file, output, fmt='csv', date_from=None, date_to=None, codes=None):
+    """Export rate history of date range to file
+
+    :param db_file: Path of SQLite database (it is opened in read-only mode)
+    :param output: Path of output file
+    :param fmt: Output format: csv, jsonl or npy
+    :param date_from: First date in DD.MM.YYYY format (None - from the earliest saved date)
+    :param date_to: Last date in DD.MM.YYYY format (None - till the latest saved date)
+    :param codes: List of numeric codes (None - all currencies)
+    :return: Count of exported dates
+    """
+    date_from = db_date(date_from) if date_from else '00000000'
+    date_to = db_date(date_to) if date_to else '99999999'
+    con = sqlite3.connect(f'file:{db_file}?mode=ro', uri=True)
+    try:
+        columns = currency_columns(con, date_from, date_to, codes)
+        rows = matrix_rows(con, [column['numeric_code'] for column in columns], date_from, date_to, codes)
+        return WRITERS[fmt](output, columns, rows)
+    finally:
+        con.close()
+
+
+if __name__ == '__main__':
+    opts = dict(arg[2:].partition('=')[::2] for arg in sys.argv[1:] if arg.startswith('--'))
+    fmt = opts.get('format', 'csv')
+    if fmt not in FORMATS:
+        sys.exit(f'Unknown export format: {fmt}. Use one of: {", ".join(FORMATS)}')
+    codes = opts.get('codes', '*').replace(' ', '')
+    output = opts.get('output', f'rates.{fmt}')
+    count = export(opts.get('db', 'currency.db'), output, fmt, opts.get('from'), opts.get('to'),
+                   None if codes in ('', '*') else codes.split(','))
+    print(f'{count} dates are exported to {output}')
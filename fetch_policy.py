@@ -0,0 +1,210 @@
+"""Fetch policy of web service requests: overall deadline of a request, retries with jittered exponential backoff,
+optional hedged second request when the first one is slower than usual, and circuit breaker which rejects requests
+at once while web service keeps failing.
+
+.. moduleauthor:: Max Dubrovin <mihadxdx@gmail.com>
+
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import Metrics, percentile
+from soap_client import SoapError
+
+
+DEFAULT_DEADLINE = 60  # seconds for a request including all retries
+DEFAULT_RETRIES = 2
+LATENCY_WINDOW = 200  # count of recent latencies which hedge delay is computed from
+
+
+class CircuitOpen(SoapError):
+    """Request is rejected without sending, web service keeps failing"""
+
+
+class CircuitBreaker:
+    """Circuit breaker of web service requests. It is opened after failure_threshold failures in a row: requests are
+    rejected until reset_timeout seconds pass. Then one trial request is allowed (half-open state): its success closes
+    the circuit, its failure opens it again.
+
+    :param failure_threshold: Count of failures in a row which opens the circuit
+    :param reset_timeout: Seconds to keep the circuit open
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False  # trial request of half-open state is in flight
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'open' if time.monotonic() - self.opened_at < self.reset_timeout else 'half-open'
+
+    def allow(self):
+        """Check if a request can be sent now"""
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+
+def is_retryable(error: SoapError):
+    """Connection errors, timeouts, throttling and server errors are retried, other HTTP errors are not"""
+    return error.status is None or error.status == 429 or error.status >= 500
+
+
+def is_service_failure(error: SoapError):
+    """Connection errors, timeouts and server errors are failures of web service which open the circuit. Other HTTP
+    errors are answers to bad requests, web service itself works."""
+    return error.status is None or error.status >= 500
+
+
+class FetchPolicy:
+    """Wrapper of SoapClient.post with deadline, retries, hedging and circuit breaker. It is safe to use one policy
+    from several threads.
+
+    :param client: SoapClient object
+    :param logger: Logger object
+    :param deadline: Seconds for one post call including all retries and waits
+    :param retries: Count of repeated attempts after failed one
+    :param backoff: Base of exponential backoff in seconds (wait before retry n is random in 0..backoff * 2 ** n)
+    :param max_backoff: Maximum wait before retry in seconds
+    :param hedge_percentile: If set, second request is sent when the first one is slower than this percentile of
+        recent latencies, the first got response is used. None - no hedged requests
+    :param hedge_min_samples: Count of latencies required before hedged requests are sent
+    :param hedge_min_delay: Minimum delay of hedged request in seconds
+    :param breaker: CircuitBreaker object, optional
+    :param metrics: Metrics object for retries, hedges and rejections counters, optional
+    """
+    def __init__(self, client, logger, deadline=DEFAULT_DEADLINE, retries=DEFAULT_RETRIES, backoff=0.5,
+                 max_backoff=8.0, hedge_percentile=None, hedge_min_samples=20, hedge_min_delay=0.05, breaker=None,
+                 metrics=None):
+        self.client = client
+        self.logger = logger
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = breaker
+        self.metrics = metrics or Metrics()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+        self.executor = None  # threads of hedged requests, they are started at first hedge
+
+    def post(self, body: bytes):
+        """Post request body to web service according to the policy
+
+        :return: Response body
+        :rtype: bytes
+        :raises SoapError: if all attempts are failed, deadline is exceeded or circuit is open
+        """
+        expires = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            if self.breaker and not self.breaker.allow():
+                self.metrics.count('circuit_rejections')
+                raise CircuitOpen('Circuit is open, web service keeps failing')
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                raise SoapError(f'Deadline of {self.deadline} s is exceeded')
+            try:
+                data = self.attempt(body, remaining)
+            except SoapError as error:
+                if self.breaker and is_service_failure(error):
+                    self.breaker.record_failure()
+                elif self.breaker:
+                    self.breaker.record_success()
+                wait_seconds = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                if attempt >= self.retries or not is_retryable(error) or \
+                        time.monotonic() + wait_seconds >= expires:
+                    raise
+                attempt += 1
+                self.metrics.count('retries')
+                self.logger.log(f'WARNING: Request is failed ({error.reason}), retry {attempt} in {wait_seconds:.2f} s')
+                time.sleep(wait_seconds)
+                continue
+            if self.breaker:
+                self.breaker.record_success()
+            return data
+
+    def attempt(self, body, timeout):
+        """One attempt: a request and optionally a hedged one"""
+        delay = self.hedge_delay()
+        if delay is None or delay >= timeout:
+            return self.timed_post(body, timeout)
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.client.pool.maxsize)
+        start = time.monotonic()
+        first = self.executor.submit(self.timed_post, body, timeout)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+
+        self.metrics.count('hedges')
+        self.logger.log(f'Request is slower than {delay:.3f} s, hedged request is sent')
+        second = self.executor.submit(self.timed_post, body, timeout - (time.monotonic() - start))
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    data = future.result()
+                except SoapError as future_error:
+                    error = future_error
+                    continue
+                if future is second:
+                    self.metrics.count('hedge_wins')
+                return data  # the other request is finished in background, its connection is reused later
+        raise error
+
+    def timed_post(self, body, timeout):
+        start = time.perf_counter()
+        data = self.client.post(body, timeout=timeout)
+        with self.lock:
+            self.latencies.append(time.perf_counter() - start)
+        return data
+
+    def hedge_delay(self):
+        """Delay of hedged request: percentile of recent latencies (None if hedging is off or there are few samples)"""
+        if self.hedge_percentile is None:
+            return None
+        with self.lock:
+            if len(self.latencies) < max(1, self.hedge_min_samples):
+                return None
+            latencies = list(self.latencies)
+        return max(self.hedge_min_delay, percentile(latencies, self.hedge_percentile))
+
+    def close(self):
+        """Stop threads of hedged requests (requests in flight are not waited)"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
@@ -1,4 +1,8 @@
 import sys
+import datetime as dt
+
+
+FLAGS = ('rewrite', 'offline', 'daemon', 'sync', 'profile', 'in-memory')  # arguments without values
 
 
 class SysArgsParser:
@@ -17,6 +21,10 @@ class SysArgsParser:
             self.init_args = init_args
         self.args = self.args()
         self.check_require_args(require_args)
+        if not self.error:
+            self.check_options()
+        if not self.error:
+            self.check_dates()
         if not self.error:
             self.check_codes()
 
@@ -25,12 +33,13 @@ class SysArgsParser:
 
         :return: dictionary (keys are argument names, values - related values)
         """
-        args = {'rewrite': False}
+        args = {flag: False for flag in FLAGS}
         for arg in self.init_args:
             if '--' in str(arg) and '=' in str(arg):
                 args[arg.partition('--')[2].partition('=')[0]] = arg.partition('--')[2].partition('=')[2]
-            if '--rewrite' in str(arg):
-                args['rewrite'] = True
+            for flag in FLAGS:
+                if f'--{flag}' in str(arg):
+                    args[flag] = True
         return args
 
     def check_require_args(self, require_args: list):
@@ -44,24 +53,97 @@ class SysArgsParser:
                 self.logger.log(f'ERROR: Missing require argument: --{arg}')
                 self.error = True
 
+    def check_options(self):
+        """Some checks for optional arguments. They are checked in every mode (daemon one too)."""
+        for name in ('interval', 'snapshot-interval'):
+            try:
+                valid = float(self.args.get(name, '1')) > 0
+            except ValueError:
+                valid = False
+            if not valid:
+                self.logger.log(f'ERROR: Argument --{name} must be a positive number of seconds')
+                self.error = True
+
+        if self.args.get('report', 'table') not in ('table', 'csv', 'jsonl'):
+            self.logger.log(f'ERROR: Argument --report must be table, csv or jsonl')
+            self.error = True
+
+        if self.args.get('strategy', 'auto') not in ('auto', 'daily', 'dynamic'):
+            self.logger.log(f'ERROR: Argument --strategy must be auto, daily or dynamic')
+            self.error = True
+
+        for name in ('workers', 'commit-interval'):
+            value = self.args.get(name)
+            if value is not None and (not value.isdigit() or int(value) < 1):
+                self.logger.log(f'ERROR: Argument --{name} must be a positive integer')
+                self.error = True
+
+        retries = self.args.get('retries')
+        if retries is not None and not retries.isdigit():
+            self.logger.log(f'ERROR: Argument --retries must be a non-negative integer')
+            self.error = True
+
+        for name, high, message in (('deadline', float('inf'), 'a positive number of seconds'),
+                                    ('hedge', 100, 'a percentile greater than 0 and not greater than 100')):
+            value = self.args.get(name)
+            if value is None:
+                continue
+            try:
+                valid = 0 < float(value) <= high
+            except ValueError:
+                valid = False
+            if not valid:
+                self.logger.log(f'ERROR: Argument --{name} must be {message}')
+                self.error = True
+
+    def check_dates(self):
+        """Some checks for --date argument or --from and --to arguments of range mode.
+        One of them (single date or range) must be specified except of daemon mode."""
+        if self.args['daemon']:
+            return
+
+        names = [name for name in ('date', 'from', 'to') if name in self.args]
+        if not names:
+            self.logger.log(f'ERROR: Missing require argument: --date (or --from and --to)')
+            self.error = True
+            return
+        if ('from' in self.args) != ('to' in self.args):
+            self.logger.log(f'ERROR: Both --from and --to arguments must be specified for range mode')
+            self.error = True
+            return
+        if self.args['sync'] and 'from' not in self.args:
+            self.logger.log(f'ERROR: Arguments --from and --to must be specified for sync mode')
+            self.error = True
+            return
+
+        dates = {}
+        for name in names:
+            try:
+                dates[name] = dt.datetime.strptime(self.args[name], '%d.%m.%Y')
+            except ValueError:
+                self.logger.log(f'ERROR: Date --{name} is invalid, dd.mm.yyyy format is expected')
+                self.error = True
+        if not self.error and 'from' in dates and dates['from'] > dates['to']:
+            self.logger.log(f'ERROR: Date --from is later than --to')
+            self.error = True
+
     def check_codes(self):
         """Some checks for currency codes"""
         arg_value = self.args['codes']
 
         if arg_value != '*':
-            codes = arg_value.split(',')
+            codes = [code.strip() for code in arg_value.split(',')]
 
             error = False
             if len(codes) > 0:
                 for code in codes:
-                    try:
-                        int(code)
-                    except ValueError:
+                    # numeric (840) or alphabetic (USD) code
+                    if not (code.isdigit() or (len(code) == 3 and code.isascii() and code.isalpha())):
                         error = True
             else:
                 error = True
 
             if error:
-                print(f'Ошибка: неверно указаны коды валют')
+                print(f'Ошибка: неверно указаны коды валют', file=sys.stderr)
                 self.logger.log(f'ERROR: Currency codes are invalid')
-                self.error = True
\ No newline at end of file
+                self.error = True
@@ -1,39 +1,181 @@
 """A primitive logger. It was also possible to use ready to use modules (logging for example), but I have built this
 one from scratch to decrease count of third-party modules.
 
+Messages are written to log file by buffered writer (optionally in background thread), so logging does not open and
+close the file for every message. Log file can be rotated by size.
+
 .. moduleauthor:: Max Dubrovin <mihadxdx@gmail.com>
 
 """
 
+import atexit
 import datetime as dt
+import os
+import queue
+import sys
+import threading
+import weakref
+
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+open_loggers = weakref.WeakSet()  # loggers which have to be flushed at interpreter exit
+
+
+@atexit.register
+def close_all():
+    """Write buffered messages of all loggers to their files"""
+    for logger in list(open_loggers):
+        logger.close()
 
 
 class Logger:
-    def __init__(self, log_file, enable=True, show_time=True):
+    """
+    :param log_file: Path of log file
+    :param enable: If False nothing is logged
+    :param show_time: If True current time is put before every message
+    :param level: Messages of lower level are skipped
+    :param buffer_size: Buffered messages are written to file when their size exceeds it (in characters).
+        0 - every message is written immediately
+    :param background: If True messages are written to file by background thread
+    :param max_bytes: Log file is rotated when its size exceeds it. 0 - file is never rotated
+    :param backup_count: Count of rotated files to keep (log_file.1, log_file.2, ...)
+    :param console: Text stream which messages are printed to, defaults to sys.stdout
+    """
+    def __init__(self, log_file, enable=True, show_time=True, level=INFO, buffer_size=1 << 16, background=False,
+                 max_bytes=0, backup_count=3, console=None):
         self.file = log_file
         self.show_time = show_time
         self.enable = enable
+        self.level = level
+        self.buffer_size = buffer_size
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.console = console
+        self.buffer = []
+        self.buffered_chars = 0
+        self.stream = None  # log file is opened at first write
+        self.lock = threading.Lock()
+        self.queue = None
+        self.writer = None
+        if enable and background:
+            self.queue = queue.SimpleQueue()
+            self.writer = threading.Thread(target=self.background_writer, daemon=True)
+            self.writer.start()
+        if enable:
+            open_loggers.add(self)
+
+    def is_enabled(self, level):
+        """Check if messages of the level are logged. Use it to skip building of expensive messages."""
+        return self.enable and level >= self.level
 
-    def log(self, text):
-        """Put log message to log file and print it in console"""
+    def log(self, text, level=None):
+        """Put log message to log file and print it in console
+
+        :param text: Message text
+        :param level: Level of message. If omitted, it is defined by message prefix ('ERROR:', 'WARNING:')
+        """
         if self.enable:
+            if level is None:
+                level = ERROR if text.startswith('ERROR') else WARNING if text.startswith('WARNING') else INFO
+            if level < self.level:
+                return
             message = self.message(text)
             self.to_console(message)
-            self.to_file(message)
+            self.to_file(message, flush=level >= ERROR)
 
     def message(self, text):
         """Build log message from plain text and current time/date"""
         log_message = text
-        now = dt.datetime.now().strftime('%Y-%m-%d %X')
         if self.show_time:
+            now = dt.datetime.now().strftime('%Y-%m-%d %X')
             log_message = f'{now}  {log_message}'
         return log_message
 
-    def to_file(self, message):
-        """Append log message to log file"""
-        with open(self.file, 'a') as f:
-            f.write(message + '\n')
+    def to_file(self, message, flush=False):
+        """Append log message to log file (through buffer)
+
+        :param flush: If True buffered messages are written immediately
+        """
+        if self.queue is not None:
+            self.queue.put(message + '\n')
+            return
+        with self.lock:
+            self.buffer.append(message + '\n')
+            self.buffered_chars += len(message) + 1
+            if flush or self.buffered_chars >= self.buffer_size:
+                self.write_buffer()
 
     def to_console(self, message):
-        """Print log message to console"""
-        print(message)
+        """Print log message to console. Message and its line break are written by one call under the lock, so
+        messages of several threads are never mixed in one line."""
+        stream = self.console or sys.stdout
+        with self.lock:
+            stream.write(message + '\n')
+
+    def write_buffer(self):
+        """Write buffered messages to log file (caller must hold the lock)"""
+        if not self.buffer:
+            return
+        text = ''.join(self.buffer)
+        self.buffer.clear()
+        self.buffered_chars = 0
+        if self.stream is None:
+            self.stream = open(self.file, 'a', encoding='utf-8')
+        if self.max_bytes and self.stream.tell() and self.stream.tell() + len(text.encode('utf-8')) > self.max_bytes:
+            self.rotate()
+        self.stream.write(text)
+        self.stream.flush()
+
+    def rotate(self):
+        """Rename log file to log_file.1 (previous rotated files are shifted) and start a new one"""
+        self.stream.close()
+        for number in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f'{self.file}.{number}'):
+                os.replace(f'{self.file}.{number}', f'{self.file}.{number + 1}')
+        if self.backup_count:
+            os.replace(self.file, f'{self.file}.1')
+        else:
+            os.remove(self.file)
+        self.stream = open(self.file, 'a', encoding='utf-8')
+
+    def background_writer(self):
+        """Loop of background thread: all queued messages are written by one file write"""
+        while True:
+            messages = [self.queue.get()]
+            while True:
+                try:
+                    messages.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in messages
+            with self.lock:
+                self.buffer.extend(message for message in messages if message is not None)
+                self.write_buffer()
+            if stop:
+                return
+
+    def flush(self):
+        """Write all buffered messages to log file"""
+        if self.writer is not None:
+            return  # background thread writes messages as soon as it gets them
+        with self.lock:
+            self.write_buffer()
+
+    def close(self):
+        """Write all buffered messages and close log file"""
+        if self.writer is not None:
+            if self.writer.is_alive():
+                self.queue.put(None)
+                self.writer.join()
+            self.queue = self.writer = None  # next messages are written without background thread
+        else:
+            self.flush()
+        with self.lock:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+        open_loggers.discard(self)
@@ -0,0 +1,97 @@
+"""In-process metrics of service stages: counters (bytes, rows) and timers (count, total and maximum duration of
+calls). Metrics can be saved as JSON or Prometheus text format file.
+
+.. moduleauthor:: Max Dubrovin <mihadxdx@gmail.com>
+
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+PROMETHEUS_PREFIX = 'currency_service'
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of values"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class Metrics:
+    """Thread-safe set of named counters and timers"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}  # name -> [count, total seconds, maximum seconds]
+
+    def count(self, name, value=1):
+        """Increase counter by value"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        """Record duration of one call of timer"""
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """Context manager which records duration of its block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        """Current values of all metrics
+
+        :return: dict with 'counters' (name -> value) and 'timers' (name -> dict of count, seconds and max_seconds)
+        """
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'timers': {
+                    name: {'count': count, 'seconds': round(total, 6), 'max_seconds': round(maximum, 6)}
+                    for name, (count, total, maximum) in self.timers.items()
+                },
+            }
+
+    def summary(self):
+        """Printable lines of metrics"""
+        snapshot = self.snapshot()
+        lines = [f'{name}: {stats["count"]} calls, {stats["seconds"]:.3f} s (max {stats["max_seconds"]:.3f} s)'
+                 for name, stats in snapshot['timers'].items()]
+        lines.extend(f'{name}: {value}' for name, value in snapshot['counters'].items())
+        return lines
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """Metrics in Prometheus text exposition format: counters are <prefix>_<name>_total, timers are one summary
+        <prefix>_stage_seconds labelled by stage name"""
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{name}_total counter')
+            lines.append(f'{PROMETHEUS_PREFIX}_{name}_total {value}')
+        if snapshot['timers']:
+            lines.append(f'# TYPE {PROMETHEUS_PREFIX}_stage_seconds summary')
+            for name, stats in sorted(snapshot['timers'].items()):
+                lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_sum{{stage="{name}"}} {stats["seconds"]}')
+                lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_count{{stage="{name}"}} {stats["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path):
+        """Save metrics to file. Prometheus text format is used for .prom and .txt files, JSON - for others."""
+        text = self.to_prometheus() if path.endswith(('.prom', '.txt')) else self.to_json()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
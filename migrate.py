@@ -0,0 +1,17 @@
+"""Upgrade schema of existing database in place (without requesting saved data again). Usage:
+
+    python migrate.py [--db=currency.db] [--rebuild-stats]
+
+--rebuild-stats recalculates monthly and yearly rate statistics (CURRENCY_STATS table) from saved rows.
+
+"""
+import sys
+
+from db_controller import DbController
+from logger import Logger
+
+db_file = next((arg.partition('=')[2] for arg in sys.argv[1:] if arg.startswith('--db=')), 'currency.db')
+db = DbController(db_file, Logger('ondatecurs.log', enable=True, show_time=True))
+if '--rebuild-stats' in sys.argv[1:]:
+    db.rebuild_stats()
+db.close_db()
@@ -1,27 +1,109 @@
 """A primitive table (list of list, list of tuples and etc.) pretty console printer. It was also possible to use
 ready to use modules (xml for example), but I have built this one from scratch to decrease count of third-party
 modules (due to task recommendations).
+Large tables are rendered by streaming renderer: rows are read from any iterable once and written to a stream by
+chunks. Tables can be rendered as CSV or JSON Lines for piping into other tools.
 
 .. moduleauthor:: Max Dubrovin <mihadxdx@gmail.com>
 
 """
 
+import csv
+import json
+import sys
+from itertools import chain, islice
+
+
+FORMATS = ('table', 'csv', 'jsonl')
+WIDTH_SAMPLE = 1000  # count of first rows which column widths are computed by
+CHUNK_ROWS = 1000  # count of rows per write to stream
+
 
 def auto_widths(table):
-    """Calculate and return optional columns width due to size of its contents
+    """Calculate and return optional columns width due to size of its contents (in one pass over rows, cells of any
+    type are measured by their str() representation)
 
-    :param table: A table which is a list/tuples of list/tuples
+    :param table: A table which is an iterable of list/tuples
     :return: list of column widths
     """
-    column_count = len(table[0])
-    row_count = len(table)
+    widths = []
+    for row in table:
+        if len(widths) < len(row):
+            widths.extend([0] * (len(row) - len(widths)))
+        for index, value in enumerate(row):
+            length = len(str(value))
+            if length > widths[index]:
+                widths[index] = length
+    return widths
+
+
+def render_table(rows, stream=None, header=None, fmt='table', sample_size=WIDTH_SAMPLE):
+    """Write table to stream
+
+    :param rows: Iterable of list/tuples (a generator is read once)
+    :param stream: Text stream, defaults to sys.stdout
+    :param header: Names of columns, optional. In 'jsonl' format rows are written as objects with these keys (as
+        arrays if header is omitted)
+    :param fmt: 'table' (box table), 'csv' or 'jsonl'
+    :param sample_size: Count of first rows which column widths of box table are computed by. Cells of later rows
+        which are wider than their column are written as is.
+    :return: Count of written rows (header is not counted)
+    :raises ValueError: if format is unknown
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown table format {fmt}, {", ".join(FORMATS)} are supported')
+    stream = stream or sys.stdout
+    rows = iter(rows)
+
+    if fmt == 'csv':
+        writer = csv.writer(stream, lineterminator='\n')
+        if header:
+            writer.writerow(header)
+        count = 0
+        while True:
+            chunk = list(islice(rows, CHUNK_ROWS))
+            if not chunk:
+                return count
+            writer.writerows(chunk)
+            count += len(chunk)
+
+    if fmt == 'jsonl':
+        keys = list(header) if header else None
+        lines = (
+            json.dumps(dict(zip(keys, row)) if keys else list(row), ensure_ascii=False, default=str)
+            for row in rows
+        )
+        return write_lines(stream, lines)
 
-    col_widths = []
+    sample = list(islice(rows, sample_size))
+    widths = auto_widths(chain([header], sample) if header else sample)
+    if not widths:
+        return 0
+    divider = '--' + ''.join('-' * (width + 1) + '--' for width in widths)
 
-    for col_index in range(column_count):
-        width = max([len(table[row_index][col_index]) for row_index in range(row_count)])
-        col_widths.append(width)
-    return col_widths
+    def line(row):
+        return '| ' + ''.join(f'{str(value).rjust(width + 1)} |' for value, width in zip(row, widths))
+
+    stream.write(divider + '\n')
+    if header:
+        stream.write(line(header) + '\n' + divider + '\n')
+    count = write_lines(stream, (line(row) for row in chain(sample, rows)))
+    stream.write(divider + '\n')
+    return count
+
+
+def write_lines(stream, lines):
+    """Write lines to stream by chunks of CHUNK_ROWS lines
+
+    :return: Count of written lines
+    """
+    count = 0
+    while True:
+        chunk = list(islice(lines, CHUNK_ROWS))
+        if not chunk:
+            return count
+        stream.write('\n'.join(chunk) + '\n')
+        count += len(chunk)
 
 
 def print_pretty_table(table, header=True):
@@ -30,24 +112,7 @@ def print_pretty_table(table, header=True):
     :param table: A table which is a list/tuples of list/tuples
     :param header: If True dividing line is printed after upper row
     """
-    widths = auto_widths(table)
-
-    def divider():
-        header_div = '--'
-        for index, value in enumerate(table[0]):
-            human_value = '-' * (widths[index] + 1)
-            header_div += f'{human_value}--'
-        print(header_div)
-
-    divider()
-
-    for row_index, row in enumerate(table):
-        row_string = '| '
-        for index, value in enumerate(row):
-            human_value = value.rjust(widths[index] + 1)
-            row_string += f'{human_value} |'
-        print(row_string)
-        if header and row_index == 0:
-            divider()
-
-    divider()
+    if header:
+        render_table(table[1:], header=table[0])
+    else:
+        render_table(table)
@@ -0,0 +1,192 @@
+"""Read-through lookup of currency rates. Rates are searched in in-process LRU cache first, then in database and only
+then they are requested from Central Bank of Russia web service. Concurrent misses of the same date share one request.
+Rates of past dates are cached for the lifetime of the store, rates of today and later dates are cached for a short
+time only, their currency set can be published or changed later.
+
+.. moduleauthor:: Max Dubrovin <mihadxdx@gmail.com>
+
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from currency_service import DEFAULT_URL, CurrencyService, is_past
+from db_controller import DbController, db_date, rate_to_int
+from soap_client import SoapError
+
+
+DEFAULT_TTL = 60  # seconds to keep rates of today and later dates in cache
+
+
+class RateStore:
+    """Thread-safe currency rates lookup API.
+
+    Every found rate is a dict with following keys: 'name', 'numeric_code', 'alphabetic_code', 'scale' (int),
+    'rate' (text as it is published) and 'rate_value' (rate multiplied by 10000, int). Rate is None if currency is
+    not published at the date.
+    """
+    def __init__(self, db_file, logger, url=DEFAULT_URL, cache_size=4096, response_cache=None, ttl=DEFAULT_TTL):
+        """
+        :param response_cache: On-disk cache of raw responses (ResponseCache), optional
+        :param ttl: Seconds to keep rates of today and later dates in cache
+        """
+        self.logger = logger
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.cache = OrderedDict()  # (date, code) -> tuple of rate and expiry time (None - it never expires)
+        self.inflight = {}  # date -> Future of request which is being made now
+        self.lock = threading.Lock()  # guards cache and inflight
+        self.db_lock = threading.Lock()  # guards database connection
+        # requests are made by currency service according to its fetch policy (deadline, retries, circuit breaker)
+        self.service = CurrencyService(db_file, logger, url=url)
+        self.service.cache = response_cache
+        self.service.db = self.db = DbController(db_file, logger, shared=True, metrics=self.service.metrics)
+
+    def get(self, date, code):
+        """Get rate of one currency
+
+        :param date: Date in DD.MM.YYYY format
+        :param code: Numeric code of currency ('840' for example)
+        :return: Rate dict or None if currency is not published at the date
+        :raises SoapError: if currency data of the date can not be requested
+        """
+        return self.get_many(date, [code])[code]
+
+    def get_many(self, date, codes):
+        """Get rates of several currencies of one date
+
+        :param date: Date in DD.MM.YYYY format
+        :param codes: Numeric codes of currencies
+        :type codes: list
+        :return: dict (keys are codes, values are rate dicts or None)
+        :raises SoapError: if currency data of the date can not be requested
+        """
+        rates = self.cached(date, codes)
+        missing = [code for code in codes if code not in rates]
+        if missing:
+            rates.update(self.load(date, missing))
+            missing = [code for code in missing if code not in rates]
+
+        while missing:
+            # there are unknown currencies for database, all currencies of the date are requested
+            published, fetched = self.fetch_once(date, missing)
+            rates.update((code, published[code]) for code in missing if code in published)
+            if fetched:
+                # currencies which are not published at the date are remembered too, so they are not requested again
+                unpublished = {code: None for code in missing if code not in published}
+                self.remember(date, unpublished)
+                rates.update(unpublished)
+            missing = [code for code in missing if code not in rates]
+        return rates
+
+    def cached(self, date, codes):
+        """Find rates of the date in cache, expired ones are dropped
+
+        :return: dict of found rates (keys are codes)
+        """
+        rates = {}
+        now = time.monotonic()
+        with self.lock:
+            for code in codes:
+                key = (date, code)
+                if key not in self.cache:
+                    continue
+                rate, expires = self.cache[key]
+                if expires is not None and expires <= now:
+                    del self.cache[key]
+                    continue
+                self.cache.move_to_end(key)
+                rates[code] = rate
+        return rates
+
+    def load(self, date, codes=None):
+        """Read saved rates of the date from database and put them into cache. Weekends and holidays are resolved
+        to the date of valid currency set by saved aliases.
+
+        :param date: Date in DD.MM.YYYY format
+        :param codes: Numeric codes of currencies (all saved currencies if it is omitted)
+        :return: dict of found rates (keys are codes)
+        """
+        with self.db_lock:
+            ondate = self.db.alias_ondate(db_date(date)) or db_date(date)
+            saved = self.db.rates_on_date(ondate, codes)
+        found = {row['numeric_code']: row for row in saved}
+        self.remember(date, found)
+        return found
+
+    def remember(self, date, rates: dict):
+        """Put rates of the date into cache and drop least recently used ones if cache is full. Rates of today and
+        later dates expire in ttl seconds."""
+        expires = None if is_past(date) else time.monotonic() + self.ttl
+        with self.lock:
+            for code, rate in rates.items():
+                self.cache[(date, code)] = (rate, expires)
+                self.cache.move_to_end((date, code))
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def fetch_once(self, date, codes):
+        """Request currency data of the date. If the same date is already requested by another thread, its result is
+        waited instead of making one more request.
+
+        :param date: Date in DD.MM.YYYY format
+        :param codes: Numeric codes of currencies which are missing in database
+        :return: tuple of dict of rates (keys are numeric codes) and flag which is True if rates are requested from
+            web service (all published currencies) and False if they are read from database (saved ones)
+        """
+        with self.lock:
+            future = self.inflight.get(date)
+            leader = future is None
+            if leader:
+                future = self.inflight[date] = Future()
+
+        if leader:
+            try:
+                # the date could be saved by previous leader after this thread has read database
+                result = self.load(date), False
+                if any(code not in result[0] for code in codes):
+                    result = self.fetch(date), True
+            except Exception as error:
+                future.set_exception(error)
+                raise
+            finally:
+                with self.lock:
+                    del self.inflight[date]
+            future.set_result(result)
+        return future.result()
+
+    def fetch(self, date):
+        """Request currency data of the date from web service, save it into database and put it into cache
+
+        :param date: Date in DD.MM.YYYY format
+        :return: dict of all published rates of the date (keys are numeric codes)
+        :raises SoapError: if currency data of the date can not be requested
+        """
+        xml_data = self.request(date)
+        if not xml_data:
+            raise SoapError(f'Currency data of {date} is not got')
+        payload = self.service.parse(xml_data, date)
+        published = {}
+        if payload:
+            with self.db_lock:
+                self.service.save(date, payload)  # alias of weekend or holiday is saved too
+            for item in payload['rows']:
+                published[item.numeric_code] = dict(item._asdict(), scale=int(item.scale),
+                                                    rate_value=rate_to_int(item.rate))
+        self.remember(date, published)
+        return published
+
+    def request(self, date):
+        """Retrieve response of the date from response cache or web service (see CurrencyService.request)
+
+        :param date: Date in DD.MM.YYYY format
+        :return: Response body or False if request is failed
+        """
+        return self.service.request(date)
+
+    def close(self):
+        """Close connections to database and web service"""
+        with self.db_lock:
+            self.service.close()
@@ -0,0 +1,388 @@
+"""Small asyncio HTTP service for reading saved currency rates. Usage:
+
+    python rates_server.py [--db=currency.db] [--host=127.0.0.1] [--port=8000]
+
+Endpoints (dates are in DD.MM.YYYY format, codes are numeric codes separated by comma, all currencies if omitted):
+
+    GET /rates?date=11.05.2021&codes=840,978
+    GET /rates/range?from=01.05.2021&to=31.05.2021&codes=840
+
+Responses are kept in prebuilt in-memory response cache while database is not changed (PRAGMA data_version), so
+currency data added or replaced later by other processes is served at once. Responses of saved historical dates are
+served with ETag and longer-lived Cache-Control headers, clients revalidate them by If-None-Match requests. Database
+is read through a pool of read-only connections.
+
+.. moduleauthor:: Max Dubrovin <mihadxdx@gmail.com>
+
+"""
+
+import asyncio
+import datetime as dt
+import hashlib
+import json
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from db_controller import SCHEMA_VERSION, db_date, human_date
+
+
+# saved currency set of historical date is changed by rewrite runs only
+STABLE_CACHE_CONTROL = 'public, max-age=3600, must-revalidate'
+MUTABLE_CACHE_CONTROL = 'public, max-age=60'
+MUTABLE_TTL = 60  # seconds to keep responses of today and later dates in response cache
+
+RATES_COLUMNS = ['numeric_code', 'alphabetic_code', 'name', 'scale', 'rate', 'rate_value']
+
+# currency set which is valid at the date: the last saved order on or before it
+RATES_ON_DATE_STMT = (
+    'SELECT o.ondate, r.numeric_code, r.alphabetic_code, r.name, r.scale, r.rate, r.rate_value '
+    'FROM CURRENCY_ORDER o JOIN CURRENCY_RATES r ON r.order_id = o.id '
+    'WHERE o.ondate = (SELECT MAX(ondate) FROM CURRENCY_ORDER WHERE ondate <= ?)'
+)
+RATES_RANGE_STMT = (
+    'SELECT o.ondate, r.numeric_code, r.alphabetic_code, r.name, r.scale, r.rate, r.rate_value '
+    'FROM CURRENCY_ORDER o JOIN CURRENCY_RATES r ON r.order_id = o.id '
+    'WHERE o.ondate BETWEEN ? AND ?'
+)
+# dates of range which currency set is known for: saved orders and aliases of weekends and holidays
+COVERED_DATES_STMT = (
+    'SELECT ondate FROM CURRENCY_ORDER WHERE ondate BETWEEN ?1 AND ?2 '
+    'UNION SELECT date FROM CURRENCY_ALIAS WHERE date BETWEEN ?1 AND ?2;'
+)
+
+
+class BadRequest(Exception):
+    """Request parameters are invalid"""
+
+
+class SchemaError(Exception):
+    """Database is not migrated to current schema version"""
+
+
+class ReadPool:
+    """Pool of read-only database connections which are used by executor threads"""
+    def __init__(self, db_file, size):
+        self.connections = queue.Queue()
+        for _ in range(size):
+            con = sqlite3.connect(f'file:{db_file}?mode=ro', uri=True, check_same_thread=False)
+            self.connections.put(con)
+
+    def query(self, stmt, params):
+        """Execute statement by an idle connection and fetch all rows"""
+        con = self.connections.get()
+        try:
+            return con.execute(stmt, params).fetchall()
+        finally:
+            self.connections.put(con)
+
+    def close(self):
+        while not self.connections.empty():
+            self.connections.get().close()
+
+
+def parse_date(params, name):
+    """Extract DD.MM.YYYY date parameter and convert it to YYYYMMDD format"""
+    value = params.get(name, [''])[0]
+    try:
+        dt.datetime.strptime(value, '%d.%m.%Y')
+    except ValueError:
+        raise BadRequest(f'Parameter {name} must be a date in dd.mm.yyyy format')
+    return db_date(value)
+
+
+def parse_codes(params):
+    """Extract sorted tuple of numeric codes (empty tuple for all currencies)"""
+    value = params.get('codes', ['*'])[0].replace(' ', '')
+    if value in ('', '*'):
+        return ()
+    codes = value.split(',')
+    if not all(code.isdigit() for code in codes):
+        raise BadRequest('Parameter codes must be a list of numeric codes separated by comma')
+    return tuple(sorted(set(codes)))
+
+
+def http_response(status, reason, body=b'', headers=None, keep_alive=True):
+    """Build whole HTTP/1.1 response
+
+    :return: Response bytes
+    """
+    lines = [f'HTTP/1.1 {status} {reason}', f'Content-Length: {len(body)}']
+    lines.extend(f'{name}: {value}' for name, value in (headers or {}).items())
+    if not keep_alive:
+        lines.append('Connection: close')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+class CachedResponse:
+    """Prebuilt response: whole 200 response, 304 response for matched ETag, database version which the response is
+    built at and expiration time"""
+    __slots__ = ('etag', 'full', 'not_modified', 'version', 'expires')
+
+    def __init__(self, body, stable, version):
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        headers = {
+            'ETag': self.etag,
+            'Cache-Control': STABLE_CACHE_CONTROL if stable else MUTABLE_CACHE_CONTROL,
+        }
+        self.not_modified = http_response(304, 'Not Modified', headers=headers)
+        headers['Content-Type'] = 'application/json; charset=utf-8'
+        self.full = http_response(200, 'OK', body, headers)
+        self.version = version
+        self.expires = None if stable else time.monotonic() + MUTABLE_TTL
+
+    def valid(self, version):
+        """Check if response is built at current database version and is not expired"""
+        return self.version == version and (self.expires is None or self.expires >= time.monotonic())
+
+
+class RatesServer:
+    """Asyncio HTTP server of saved currency rates
+
+    :param db_file: Path of SQLite database
+    :param host: Listening host
+    :param port: Listening port (0 - any free port)
+    :param pool_size: Count of read-only database connections (and executor threads)
+    :param cache_size: Count of prebuilt responses in memory
+    """
+    def __init__(self, db_file, host='127.0.0.1', port=8000, pool_size=4, cache_size=4096):
+        self.db_file = db_file
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # request key -> CachedResponse, the last item is most recently used
+        self.pool = None
+        self.version_con = None  # connection of event loop thread which database version is read by
+        self.executor = None
+        self.server = None
+        self.loop = None
+        self.started = threading.Event()
+        self.failure = None  # exception which stopped server in another thread before it is started
+
+    async def serve(self):
+        """Serve requests until the server is stopped
+
+        :raises SchemaError: if database is not migrated to current schema version
+        """
+        self.check_schema()
+        self.pool = ReadPool(self.db_file, self.pool_size)
+        self.version_con = sqlite3.connect(f'file:{self.db_file}?mode=ro', uri=True)
+        self.executor = ThreadPoolExecutor(max_workers=self.pool_size)
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.started.set()
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.executor.shutdown()
+            self.pool.close()
+            self.version_con.close()
+
+    def serve_in_thread(self):
+        """Start serving in daemon thread
+
+        :return: self
+        """
+        def run():
+            try:
+                asyncio.run(self.serve())
+            except Exception as error:
+                self.failure = error
+                self.started.set()
+
+        threading.Thread(target=run, daemon=True).start()
+        self.started.wait()
+        if self.failure is not None:
+            raise self.failure
+        return self
+
+    def check_schema(self):
+        """Check schema version of database. Database is opened in read-only mode, so it can not be migrated here.
+
+        :raises SchemaError: if database is not migrated to current schema version
+        """
+        con = sqlite3.connect(f'file:{self.db_file}?mode=ro', uri=True)
+        try:
+            version = con.execute('PRAGMA user_version;').fetchone()[0]
+        finally:
+            con.close()
+        if version != SCHEMA_VERSION:
+            raise SchemaError(f'Schema version of database {self.db_file} is {version}, version {SCHEMA_VERSION} is '
+                              f'expected. Run python migrate.py --db={self.db_file}')
+
+    def stop(self):
+        """Stop server which is served in another thread"""
+        self.loop.call_soon_threadsafe(self.server.close)
+
+    async def handle(self, reader, writer):
+        """Handle keep-alive connection"""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                method, _, rest = lines[0].partition(' ')
+                target, _, version = rest.partition(' ')
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+
+                try:
+                    response = await self.respond(method, target, headers, keep_alive)
+                except sqlite3.Error as error:
+                    response = self.error(500, 'Internal Server Error', f'Database error: {error}', keep_alive)
+                writer.write(response)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def respond(self, method, target, headers, keep_alive):
+        """Build response bytes of one request"""
+        if method != 'GET':
+            return http_response(405, 'Method Not Allowed', b'', {'Allow': 'GET'}, keep_alive)
+
+        version = self.data_version()
+        cached = self.cache.get(target)
+        if cached is not None and not cached.valid(version):
+            cached = None
+        if cached is None:
+            url = urlsplit(target)
+            try:
+                key, query = self.route(url.path, parse_qs(url.query))
+            except BadRequest as error:
+                return self.error(400, 'Bad Request', str(error), keep_alive)
+            except LookupError:
+                return self.error(404, 'Not Found', 'Unknown path', keep_alive)
+
+            cached = self.cache.get(key)
+            if cached is None or not cached.valid(version):
+                body, stable = await self.loop.run_in_executor(self.executor, query)
+                cached = CachedResponse(body, stable, version)
+                self.remember(key, cached)
+            self.remember(target, cached)
+        else:
+            self.cache.move_to_end(target)
+
+        if headers.get('if-none-match') == cached.etag:
+            response = cached.not_modified
+        else:
+            response = cached.full
+        if not keep_alive:
+            head, _, body = response.partition(b'\r\n\r\n')
+            response = head + b'\r\nConnection: close\r\n\r\n' + body
+        return response
+
+    def data_version(self):
+        """Version of database which is changed by every commit of other connections (it is read from file header
+        without reading database pages)"""
+        return self.version_con.execute('PRAGMA data_version;').fetchone()[0]
+
+    def remember(self, key, cached):
+        """Put response into cache and drop least recently used ones if cache is full"""
+        self.cache[key] = cached
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def error(self, status, reason, message, keep_alive):
+        body = json.dumps({'error': message}).encode('utf-8')
+        return http_response(status, reason, body, {'Content-Type': 'application/json; charset=utf-8'}, keep_alive)
+
+    def route(self, path, params):
+        """Find handler of request
+
+        :return: tuple of normalized request key and function which builds response body (it is called in executor)
+        :raises LookupError: if path is unknown
+        :raises BadRequest: if parameters are invalid
+        """
+        codes = parse_codes(params)
+        if path == '/rates':
+            date = parse_date(params, 'date')
+            return ('rates', date, codes), lambda: self.rates_on_date(date, codes)
+        if path == '/rates/range':
+            date_from, date_to = parse_date(params, 'from'), parse_date(params, 'to')
+            if date_from > date_to:
+                raise BadRequest('Parameter from is later than to')
+            return ('range', date_from, date_to, codes), lambda: self.rates_range(date_from, date_to, codes)
+        raise LookupError(path)
+
+    def select(self, stmt, params, codes):
+        if codes:
+            stmt += f' AND r.numeric_code IN ({", ".join("?" * len(codes))})'
+            params = params + list(codes)
+        return self.pool.query(stmt + ' ORDER BY o.ondate, r.numeric_code;', params)
+
+    def rates_on_date(self, date, codes):
+        """Body of /rates response
+
+        :return: tuple of JSON body and stability flag
+        """
+        rows = self.select(RATES_ON_DATE_STMT, [date], codes)
+        body = {
+            'date': human_date(date),
+            'ondate': human_date(rows[0][0]) if rows else None,
+            'rates': [dict(zip(RATES_COLUMNS, row[1:])) for row in rows],
+        }
+        found = {row[1] for row in rows}
+        complete = bool(rows) and all(code in found for code in codes)
+        # set of earlier date is served till the date itself is saved, unless the date is known to have no set
+        stable = complete and is_historical(date) and self.covered(date, date)
+        return json.dumps(body, ensure_ascii=False).encode('utf-8'), stable
+
+    def rates_range(self, date_from, date_to, codes):
+        """Body of /rates/range response: rows of every saved date of range
+
+        :return: tuple of JSON body and stability flag
+        """
+        rows = self.select(RATES_RANGE_STMT, [date_from, date_to], codes)
+        body = {
+            'from': human_date(date_from),
+            'to': human_date(date_to),
+            'columns': ['date'] + RATES_COLUMNS,
+            'rows': [[human_date(row[0])] + list(row[1:]) for row in rows],
+        }
+        stable = bool(rows) and is_historical(date_to) and self.covered(date_from, date_to)
+        return json.dumps(body, ensure_ascii=False).encode('utf-8'), stable
+
+    def covered(self, date_from, date_to):
+        """Check if every date of range is saved or known as alias (so its response is changed by rewrite only)"""
+        days = (dt.datetime.strptime(date_to, '%Y%m%d') - dt.datetime.strptime(date_from, '%Y%m%d')).days + 1
+        return len(self.pool.query(COVERED_DATES_STMT, [date_from, date_to])) == days
+
+
+def is_historical(date):
+    """Check if YYYYMMDD date is earlier than today (its currency set is not published again)"""
+    return date < dt.date.today().strftime('%Y%m%d')
+
+
+if __name__ == '__main__':
+    opts = dict(arg[2:].partition('=')[::2] for arg in sys.argv[1:] if arg.startswith('--'))
+    rates_server = RatesServer(
+        opts.get('db', 'currency.db'),
+        host=opts.get('host', '127.0.0.1'),
+        port=int(opts.get('port', 8000)),
+    )
+    try:
+        rates_server.check_schema()
+    except (SchemaError, sqlite3.Error) as error:
+        sys.exit(f'ERROR: {error}')
+    print(f'Rates server is listening on http://{rates_server.host}:{rates_server.port}')
+    asyncio.run(rates_server.serve())
@@ -0,0 +1,54 @@
+"""On-disk cache of raw web service responses. Every response is kept compressed in a separate file named by requested
+date, so the database can be rebuilt from the cache without requests to web service.
+
+.. moduleauthor:: Max Dubrovin <mihadxdx@gmail.com>
+
+"""
+
+import gzip
+import os
+import threading
+
+
+class ResponseCache:
+    """Directory of gzip compressed responses: <directory>/<YYYYMMDD>.xml.gz (YYYYMMDD is requested date)"""
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, date):
+        """Path of cache file
+
+        :param date: Requested date in DD.MM.YYYY format
+        """
+        return os.path.join(self.directory, f'{date[6:]}{date[3:5]}{date[:2]}.xml.gz')
+
+    def get(self, date):
+        """Read cached response
+
+        :param date: Requested date in DD.MM.YYYY format
+        :return: Response body or None if there is no cached response of the date
+        :rtype: bytes
+        """
+        try:
+            with gzip.open(self.path(date), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, date, data: bytes):
+        """Save response into cache. File is replaced atomically, so concurrent readers never see a partial file.
+
+        :param date: Requested date in DD.MM.YYYY format
+        :param data: Response body
+        """
+        path = self.path(date)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with gzip.open(temp_path, 'wb', compresslevel=6) as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def dates(self):
+        """List of cached dates in DD.MM.YYYY format (sorted from oldest)"""
+        names = sorted(name[:8] for name in os.listdir(self.directory) if name.endswith('.xml.gz'))
+        return [f'{name[6:]}.{name[4:6]}.{name[:4]}' for name in names]
@@ -0,0 +1,167 @@
+"""A reusable SOAP transport for Central Bank of Russia web service. It keeps a pool of keep-alive HTTP connections,
+so many requests made in one process share one TLS handshake. It was also possible to use ready to use modules
+(requests for example), but it is built on standard <http.client> to decrease count of third-party modules.
+
+.. moduleauthor:: Max Dubrovin <mihadxdx@gmail.com>
+
+"""
+
+import gzip
+import http.client
+import queue
+import re
+import time
+import zlib
+from collections import deque
+from urllib.parse import urlsplit
+
+from metrics import Metrics
+
+
+TIMINGS_WINDOW = 1000  # count of recent requests which timings are kept
+
+
+class SoapError(Exception):
+    """Request to web service is failed (connection error, timeout or bad HTTP status)"""
+    def __init__(self, reason, status=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+
+
+class SoapTemplate:
+    """SOAP request template. File is read and split by placeholders (like '{ date }') only once, so building of a
+    request body is a plain join of prepared byte strings.
+    """
+    placeholder = re.compile(r'{ (\w+) }')
+
+    def __init__(self, template_file):
+        with open(template_file, 'r', encoding='utf-8') as f:
+            text = f.read()
+        # even items are literal parts of template, odd items are placeholder names
+        parts = self.placeholder.split(text)
+        self.parts = [part if index % 2 else part.encode('utf-8') for index, part in enumerate(parts)]
+
+    def render(self, **values):
+        """Build request body
+
+        :param values: Values of template placeholders, for example date='2021-05-11'
+        :return: Request body
+        :rtype: bytes
+        """
+        return b''.join(
+            values[part].encode('utf-8') if index % 2 else part
+            for index, part in enumerate(self.parts)
+        )
+
+
+class SoapClient:
+    """Keep-alive HTTP(S) client for posting SOAP requests to one web service URL. It is safe to use one client
+    from several threads: each request takes an idle connection from the pool or opens a new one. Bytes of response
+    bodies are counted as they are received (before gzip decompression) by 'bytes_received' counter of metrics.
+    """
+    def __init__(self, url, logger, timeout=10, pool_size=8, accept_gzip=True, metrics=None):
+        parts = urlsplit(url)
+        self.url = url
+        self.logger = logger
+        self.timeout = timeout
+        self.accept_gzip = accept_gzip
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/'
+        self.secure = parts.scheme == 'https'
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+        self.metrics = metrics or Metrics()
+        self.timings = deque(maxlen=TIMINGS_WINDOW)  # (seconds, connection_reused) of recent finished requests
+
+    def connect(self, timeout=None):
+        """Open a new connection to web service host"""
+        if self.secure:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=timeout or self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout or self.timeout)
+
+    def release(self, connection):
+        """Return connection to the pool or close it if the pool is full"""
+        if connection.sock is None:  # closed by server at the end of response
+            return
+        try:
+            self.pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def post(self, body: bytes, headers=None, timeout=None):
+        """Post request body to web service
+
+        :param body: Request body
+        :param headers: Additional request headers
+        :param timeout: Socket timeout of this request in seconds (defaults to timeout of client)
+        :return: Response body (decompressed if it is gzip encoded)
+        :rtype: bytes
+        :raises SoapError: if connection is failed or response status is not 200
+        """
+        request_headers = {'Content-Type': 'application/soap+xml; charset=utf-8'}
+        if self.accept_gzip:
+            request_headers['Accept-Encoding'] = 'gzip'
+        if headers:
+            request_headers.update(headers)
+
+        start = time.perf_counter()
+        try:
+            connection = self.pool.get_nowait()
+            reused = True
+            connection.sock.settimeout(timeout or self.timeout)
+        except queue.Empty:
+            connection = self.connect(timeout)
+            reused = False
+
+        try:
+            try:
+                response = self.exchange(connection, body, request_headers)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                if not reused:
+                    raise
+                # idle connection has been closed by server, repeat request once by a new one
+                connection.close()
+                connection = self.connect(timeout)
+                reused = False
+                response = self.exchange(connection, body, request_headers)
+            status, reason, encoding, data = response
+        except (OSError, http.client.HTTPException) as error:
+            connection.close()
+            raise SoapError(str(error) or type(error).__name__) from error
+
+        self.release(connection)
+        elapsed = time.perf_counter() - start
+        self.timings.append((elapsed, reused))
+        self.metrics.count('bytes_received', len(data))
+        connection_info = 'connection reused' if reused else 'new connection'
+        self.logger.log(f'Response is got, code - {status}, {len(data)} bytes in {elapsed:.3f} s ({connection_info})')
+
+        if status != 200:
+            raise SoapError(reason, status)
+        if encoding == 'gzip':
+            try:
+                data = gzip.decompress(data)
+            except (OSError, EOFError, zlib.error) as error:  # truncated or corrupt body (BadGzipFile is OSError)
+                raise SoapError(f'Response body is not valid gzip data ({error})') from error
+        return data
+
+    def exchange(self, connection, body, headers):
+        """Make one request by connection and read whole response
+
+        :return: tuple of response status, reason, content encoding and body
+        """
+        connection.request('POST', self.path, body=body, headers=headers)
+        response = connection.getresponse()
+        data = response.read()
+        if response.will_close:
+            connection.close()
+        return response.status, response.reason, response.getheader('Content-Encoding'), data
+
+    def close(self):
+        """Close all idle connections of the pool"""
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
@@ -1,9 +1,27 @@
 """Module included SQLite table structures. It is used in DbController class of db_controller.py module.
+CurrencyRow is a compact in-memory record of CURRENCY_RATES row which is passed from response parser to database.
 
 .. moduleauthor:: Max Dubrovin <mihadxdx@gmail.com>
 
 """
 
+from typing import NamedTuple
+
+
+class CurrencyRow(NamedTuple):
+    """Currency data of one currency in currency set (CURRENCY_RATES row without order_id and rate_value columns).
+    It is a tuple, so it takes several times less memory than a dict with the same values."""
+    name: str
+    numeric_code: str
+    alphabetic_code: str
+    scale: str
+    rate: str
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Build record from dict with 'name', 'numeric_code', 'alphabetic_code', 'scale' and 'rate' keys"""
+        return cls(data['name'], data['numeric_code'], data['alphabetic_code'], data['scale'], data['rate'])
+
 
 currency_order_structure = {
     'human_name': 'Распоряжения о загрузке курсов',
@@ -19,9 +37,14 @@ currency_order_structure = {
             'human_name': 'Дата установки курсов ЦБ РФ',
             'name': 'ondate',
             'type': 'TEXT',
-            'unique': 'IGNORE',
+            'unique': 'IGNORE',  # unique constraint is also an index of the column
             'not_null': '',
         },
+        {
+            'human_name': 'Хеш содержимого курсов',
+            'name': 'content_hash',
+            'type': 'TEXT',
+        },
     ]
 }
 
@@ -65,5 +88,139 @@ currency_rates_structure = {
             'human_name': 'Значение курса',
             'not_null': '',
         },
+        {
+            'name': 'rate_value',
+            'type': 'INTEGER',
+            'human_name': 'Значение курса в десятитысячных долях',
+        },
+    ],
+    'indexes': [
+        {
+            'name': 'CURRENCY_RATES_ORDER_CODE',
+            'human_name': 'Одна валюта в распоряжении',
+            'columns': ['order_id', 'numeric_code'],
+            'unique': True,
+        },
+        {
+            'name': 'CURRENCY_RATES_CODE',
+            'human_name': 'История курса валюты',
+            'columns': ['numeric_code', 'order_id'],
+        },
+    ],
+}
+
+currency_alias_structure = {
+    'human_name': 'Даты без установки курсов',
+    'name': 'CURRENCY_ALIAS',
+    'columns': [
+        {
+            'human_name': 'Запрошенная дата (выходной или праздник)',
+            'name': 'date',
+            'type': 'TEXT',
+            'primary_key': True,
+        },
+        {
+            'human_name': 'Дата действующих курсов ЦБ РФ',
+            'name': 'ondate',
+            'type': 'TEXT',
+            'not_null': '',
+        },
+    ]
+}
+
+currency_directory_structure = {
+    'human_name': 'Справочник валют',
+    'name': 'CURRENCY_DIRECTORY',
+    'columns': [
+        {
+            'human_name': 'Цифровой код валюты',
+            'name': 'numeric_code',
+            'type': 'TEXT',
+            'primary_key': True,
+        },
+        {
+            'human_name': 'Буквенный код валюты',
+            'name': 'alphabetic_code',
+            'type': 'TEXT',
+        },
+        {
+            'human_name': 'Внутренний код валюты ЦБ РФ',
+            'name': 'internal_code',
+            'type': 'TEXT',
+        },
+        {
+            'human_name': 'Наименование валюты',
+            'name': 'name',
+            'type': 'TEXT',
+        },
+        {
+            'human_name': 'Номинал курса',
+            'name': 'scale',
+            'type': 'TEXT',
+        },
+        {
+            'human_name': 'Дата загрузки справочника',
+            'name': 'updated',
+            'type': 'TEXT',
+            'not_null': '',
+        },
     ]
 }
+
+currency_stats_structure = {
+    'human_name': 'Статистика курсов за месяц и год',
+    'name': 'CURRENCY_STATS',
+    'columns': [
+        {
+            'human_name': 'Период (YYYYMM - месяц, YYYY - год)',
+            'name': 'period',
+            'type': 'TEXT',
+            'not_null': '',
+        },
+        {
+            'human_name': 'Цифровой код валюты',
+            'name': 'numeric_code',
+            'type': 'TEXT',
+            'not_null': '',
+        },
+        {
+            'human_name': 'Количество дат установки курса',
+            'name': 'count',
+            'type': 'INTEGER',
+            'not_null': '',
+        },
+        {
+            'human_name': 'Сумма курсов за единицу валюты',
+            'name': 'total',
+            'type': 'REAL',
+        },
+        {
+            'human_name': 'Минимальный курс за единицу валюты',
+            'name': 'minimum',
+            'type': 'REAL',
+        },
+        {
+            'human_name': 'Максимальный курс за единицу валюты',
+            'name': 'maximum',
+            'type': 'REAL',
+        },
+        {
+            'human_name': 'Последняя дата установки курса',
+            'name': 'last_date',
+            'type': 'TEXT',
+        },
+        {
+            'human_name': 'Последний курс за единицу валюты',
+            'name': 'last_value',
+            'type': 'REAL',
+        },
+    ],
+    'indexes': [
+        {
+            'name': 'CURRENCY_STATS_PERIOD_CODE',
+            'human_name': 'Одна валюта в периоде',
+            'columns': ['period', 'numeric_code'],
+            'unique': True,
+        },
+    ],
+}
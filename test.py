@@ -1,10 +1,86 @@
+import contextlib
+import http.client
+import io
+import json
 import os
+import shutil
+import sqlite3
+import struct
+import threading
+import time
 import unittest
+from array import array
+from decimal import Decimal
 
-from currency_service import OnDateCurs
+from analytics import RateHistory, rolling_max, rolling_mean, rolling_min
+from cbr_stub import StubServer
+from converter import Converter
+from currency_service import CurrencyService, OnDateCurs, date_range, gaps, plan_strategy
+from db_controller import SCHEMA_VERSION, DbController
+from export import export
+from fetch_policy import CircuitBreaker, FetchPolicy
+from logger import DEBUG, WARNING, Logger
+from pretty_table import render_table
+from rate_store import RateStore
+from rates_server import RatesServer, SchemaError
+from response_cache import ResponseCache
+from soap_client import SoapClient, SoapError, SoapTemplate
+from tables import CurrencyRow
+from xml_parser import parse_curs_on_date, parse_curs_on_date_regex
 from os.path import exists
 
 
+RESPONSE_TEMPLATE = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">'
+    '<soap:Body><GetCursOnDateXMLResponse xmlns="http://web.cbr.ru/"><GetCursOnDateXMLResult>'
+    '<ValuteData OnDate="{ondate}" xmlns="">'
+    '<ValuteCursOnDate><Vname>Доллар США   </Vname><Vnom>1</Vnom><Vcurs>74.0448</Vcurs>'
+    '<Vcode>840</Vcode><VchCode>USD</VchCode></ValuteCursOnDate>'
+    '<ValuteCursOnDate><Vname>Евро   </Vname><Vnom>1</Vnom><Vcurs>89.9828</Vcurs>'
+    '<Vcode>978</Vcode><VchCode>EUR</VchCode></ValuteCursOnDate>'
+    '<ValuteCursOnDate><Vname>Китайский юань   </Vname><Vnom>10</Vnom><Vcurs>115.2052</Vcurs>'
+    '<Vcode>156</Vcode><VchCode>CNY</VchCode></ValuteCursOnDate>'
+    '</ValuteData></GetCursOnDateXMLResult></GetCursOnDateXMLResponse></soap:Body></soap:Envelope>'
+)
+
+
+def sample_response(date):
+    """Build response of web service for DD.MM.YYYY date like real one"""
+    return RESPONSE_TEMPLATE.replace('{ondate}', f'{date[6:]}{date[3:5]}{date[:2]}')
+
+
+class OfflineService(CurrencyService):
+    """Service which gets sample responses instead of web service ones"""
+    def request(self, date):
+        return sample_response(date).encode('utf-8')
+
+
+class ChangedService(CurrencyService):
+    """Service which gets sample responses with changed rate of US dollar at 12.05.2021"""
+    def request(self, date):
+        response = sample_response(date)
+        if date == '12.05.2021':
+            response = response.replace('74.0448', '75.0000')
+        return response.encode('utf-8')
+
+
+class OfflineRateStore(RateStore):
+    """Rate store which gets sample responses instead of web service ones"""
+    requests = 0
+
+    def request(self, date):
+        self.requests += 1
+        time.sleep(0.05)
+        return sample_response(date).encode('utf-8')
+
+
+def remove_file(path):
+    if exists(path):
+        os.remove(path)
+
+
 class TestCur(unittest.TestCase):
     def test_create_db_file(self):
         """
@@ -21,8 +97,868 @@ class TestCur(unittest.TestCase):
 
         self.assertTrue(existence)
 
-    # TODO more test methods
+    def test_date_range(self):
+        """
+        Test for building list of dates of range mode
+        """
+        self.assertEqual(date_range('30.12.2020', '02.01.2021'), ['30.12.2020', '31.12.2020', '01.01.2021', '02.01.2021'])
+        self.assertEqual(date_range('11.05.2021', '11.05.2021'), ['11.05.2021'])
+
+    def test_range_mode(self):
+        """
+        Test for saving currency data of all dates of range
+        """
+        remove_file('test.db')
+        service = OfflineService('test.db', Logger('test.log', enable=False), workers=3, strategy='daily')
+        report, failed_dates = service.run_range('01.05.2021', '10.05.2021', ['840', '978'])
+        rows = service.iter_range('11.05.2021', '20.05.2021', ['840'])  # report rows are yielded as they are saved
+        first = next(rows)
+        streamed = service.database().cur.execute('SELECT COUNT(*) FROM CURRENCY_ORDER').fetchone()[0]
+        rows.close()
+        service.close()
+
+        con = sqlite3.connect('test.db')
+        orders = con.execute('SELECT COUNT(*) FROM CURRENCY_ORDER').fetchone()[0]
+        rates = con.execute('SELECT COUNT(*) FROM CURRENCY_RATES').fetchone()[0]
+        con.close()
+        remove_file('test.db')
+
+        self.assertEqual(orders, 10)
+        self.assertEqual(rates, 20)
+        self.assertEqual(len(report), 20)
+        self.assertEqual(first[1], '11.05.2021')
+        self.assertEqual(streamed, 11)  # later dates of the generator are not saved yet
+        self.assertEqual(failed_dates, [])
+
+    def test_range_args_check(self):
+        """
+        Test for rejecting incorrect range arguments
+        """
+        with self.assertRaises(SystemExit):
+            OnDateCurs('test.db', options=['--from=10.05.2021', '--to=01.05.2021', '--codes=*'], log_enable=False)
+        with self.assertRaises(SystemExit):
+            OnDateCurs('test.db', options=['--from=01.05.2021', '--codes=*'], log_enable=False)
+        with self.assertRaises(SystemExit):  # options are checked in daemon mode too
+            OnDateCurs('test.db', options=['--daemon', '--workers=0', '--codes=*'], log_enable=False)
+        self.assertFalse(exists('test.db'))
+
+    def test_soap_template(self):
+        """
+        Test for building request body by prepared template
+        """
+        template = SoapTemplate('soap-template.xml')
+        with open('soap-template.xml', 'r', encoding='utf-8') as f:
+            expected = f.read().replace('{ date }', '2021-05-11').encode('utf-8')
+        self.assertEqual(template.render(date='2021-05-11'), expected)
+
+    def test_streaming_parser(self):
+        """
+        Test for parsing response by streaming parser and by regex fallback
+        """
+        data = sample_response('11.05.2021').encode('utf-8')
+        ondate, currencies = parse_curs_on_date(data)
+
+        self.assertEqual(ondate, '20210511')
+        self.assertIsInstance(currencies[2], CurrencyRow)
+        self.assertEqual(currencies[2]._asdict(), {'name': 'Китайский юань', 'numeric_code': '156',
+                                                   'alphabetic_code': 'CNY', 'scale': '10', 'rate': '115.2052'})
+        self.assertEqual(parse_curs_on_date(io.BytesIO(data), chunk_size=7), (ondate, currencies))
+        self.assertEqual(parse_curs_on_date_regex(data.decode('utf-8')), (ondate, currencies))
+
+    def test_insert_ignores_duplicates(self):
+        """
+        Test for inserting currency data with quotes and ignoring already existing rows
+        """
+        remove_file('test.db')
+        db = DbController('test.db', Logger('test.log', enable=False))
+        usd = {'name': "Доллар 'США'", 'numeric_code': '840', 'alphabetic_code': 'USD', 'scale': '1', 'rate': '74.0448'}
+        eur = {'name': 'Евро', 'numeric_code': '978', 'alphabetic_code': 'EUR', 'scale': '1', 'rate': '89.9828'}
+
+        first = db.write_data({'date': '20210511', 'rows': [usd]})
+        second = db.write_data({'date': '20210511', 'rows': [usd, eur, eur]})
+        rows = db.cur.execute('SELECT name, numeric_code FROM CURRENCY_RATES ORDER BY numeric_code').fetchall()
+        db.close_db()
+        remove_file('test.db')
+
+        self.assertEqual(first, [('1', '11.05.2021', "Доллар 'США' (840)", '1', '74.0448')])
+        self.assertEqual(second, [('1', '11.05.2021', 'Евро (978)', '1', '89.9828')])
+        self.assertEqual(rows, [("Доллар 'США'", '840'), ('Евро', '978')])
+
+    def test_schema_migration(self):
+        """
+        Test for upgrading database of first schema version in place
+        """
+        remove_file('test.db')
+        con = sqlite3.connect('test.db')
+        con.execute('CREATE TABLE CURRENCY_ORDER (id INTEGER PRIMARY KEY, ondate TEXT UNIQUE ON CONFLICT IGNORE NOT NULL)')
+        con.execute('CREATE TABLE CURRENCY_RATES (order_id INT REFERENCES CURRENCY_ORDER(id), name TEXT NOT NULL, '
+                    'numeric_code TEXT NOT NULL, alphabetic_code TEXT NOT NULL, scale INT NOT NULL, rate TEXT NOT NULL)')
+        con.execute("INSERT INTO CURRENCY_ORDER VALUES (1, '20210511')")
+        con.executemany("INSERT INTO CURRENCY_RATES VALUES (1, 'Евро', '978', 'EUR', 1, ?)", [('89,9828',), ('89,9828',)])
+        con.commit()
+        con.close()
+
+        db = DbController('test.db', Logger('test.log', enable=False))
+        version = db.cur.execute('PRAGMA user_version').fetchone()[0]
+        rows = db.cur.execute('SELECT numeric_code, rate, rate_value FROM CURRENCY_RATES').fetchall()
+        plan = db.cur.execute("EXPLAIN QUERY PLAN SELECT * FROM CURRENCY_RATES WHERE numeric_code='978'").fetchall()
+        db.close_db()
+        remove_file('test.db')
+
+        self.assertEqual(version, SCHEMA_VERSION)
+        self.assertEqual(rows, [('978', '89,9828', 899828)])
+        self.assertIn('USING INDEX', plan[0][-1])
+
+    def test_rate_store(self):
+        """
+        Test for read-through rates lookup with one request for concurrent misses of the same date
+        """
+        remove_file('test.db')
+        store = OfflineRateStore('test.db', Logger('test.log', enable=False))
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(store.get('11.05.2021', '840'))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        many = store.get_many('11.05.2021', ['978', '156', '999'])
+        store.get('11.05.2021', '999')
+        store.remember('01.01.2999', {'840': None})  # rates of future dates are cached for a short time
+        store.close()
+
+        # new store finds rates in database without any request
+        saved_store = OfflineRateStore('test.db', Logger('test.log', enable=False))
+        saved = saved_store.get('11.05.2021', '156')
+        saved_store.close()
+        remove_file('test.db')
+
+        self.assertEqual(store.requests, 2)  # first lookup of 840 and first lookup of unknown 999 code
+        self.assertEqual(len(results), 8)
+        self.assertEqual(results[0]['rate_value'], 740448)
+        self.assertEqual(many['156']['scale'], 10)
+        self.assertIsNone(many['999'])
+        self.assertIsNotNone(store.cache[('01.01.2999', '840')][1])
+        self.assertEqual(saved, many['156'])
+        self.assertEqual(saved_store.requests, 0)
+
+    def test_rate_store_aliases(self):
+        """
+        Test for rate store lookups of weekends and today without repeated requests
+        """
+        remove_file('test.db')
+        server = StubServer(currencies=5).serve_in_thread()
+        store = RateStore('test.db', Logger('test.log', enable=False), url=server.url)
+        today = time.strftime('%d.%m.%Y')
+        for _ in range(5):
+            store.get(today, '1')  # rates of today are cached for a short time
+        today_requests = server.requests
+        sunday = store.get('09.05.2021', '2')
+        store.close()
+
+        restarted = RateStore('test.db', Logger('test.log', enable=False), url=server.url)
+        requests = server.requests
+        saved = restarted.get('09.05.2021', '2')  # alias of Sunday is saved
+        restarted.close()
+        server.stop()
+        remove_file('test.db')
+
+        self.assertEqual(today_requests, 1)
+        self.assertEqual(server.requests, requests)
+        self.assertEqual(saved['rate_value'], sunday['rate_value'])
+
+    def test_offline_mode(self):
+        """
+        Test for rebuilding database from cached responses without requests
+        """
+        remove_file('test.db')
+        shutil.rmtree('test-cache', ignore_errors=True)
+        cache = ResponseCache('test-cache')
+        for date in ('11.05.2021', '12.05.2021'):
+            cache.put(date, sample_response(date).encode('utf-8'))
+
+        OnDateCurs('test.db', options=['--from=11.05.2021', '--to=12.05.2021', '--codes=*', '--offline',
+                                       '--cache=test-cache'], log_enable=False)
+        con = sqlite3.connect('test.db')
+        rates = con.execute('SELECT COUNT(*) FROM CURRENCY_RATES').fetchone()[0]
+        con.close()
+
+        # there is no cached response of the date, it is failed without stop of the process
+        service = OnDateCurs('test.db', options=['--date=13.05.2021', '--codes=*', '--offline', '--cache=test-cache'],
+                             log_enable=False)
+        self.assertEqual(service.service.metrics.snapshot()['counters'].get('rows_inserted', 0), 0)
+        cached_dates = cache.dates()
+        remove_file('test.db')
+        shutil.rmtree('test-cache')
+
+        self.assertEqual(rates, 6)
+        self.assertEqual(cached_dates, ['11.05.2021', '12.05.2021'])
+
+    def test_stub_web_service(self):
+        """
+        Test for requesting local stub web service by keep-alive connections
+        """
+        remove_file('test.db')
+        server = StubServer(currencies=5).serve_in_thread()
+        service = OnDateCurs('test.db', options=['--from=01.05.2021', '--to=10.05.2021', '--codes=1, 3', '--workers=2',
+                                              '--strategy=daily'], log_enable=False, url=server.url)
+        server.stop()
+
+        con = sqlite3.connect('test.db')
+        dates = [row[0] for row in con.execute('SELECT ondate FROM CURRENCY_ORDER ORDER BY ondate')]
+        rates = con.execute('SELECT COUNT(*) FROM CURRENCY_RATES').fetchone()[0]
+        con.close()
+        remove_file('test.db')
+
+        self.assertEqual(server.requests, 1 + 10)  # currency directory and one request per date
+        timings = service.service.client.timings
+        self.assertEqual(len(timings), 1 + 10)
+        self.assertLessEqual(sum(1 for _, reused in timings if not reused), 2)
+        # Sunday 02.05 and Monday 03.05, Sunday 09.05 and Monday 10.05 have currency sets of previous Saturday
+        self.assertEqual(dates, ['20210501', '20210504', '20210505', '20210506', '20210507', '20210508'])
+        self.assertEqual(rates, 12)
+
+    def test_buffered_logger(self):
+        """
+        Test for buffered and background log writers, log levels and rotation
+        """
+        for name in ('test.log', 'test.log.1', 'test.log.2'):
+            remove_file(name)
+
+        for background in (False, True):
+            logger = Logger('test.log', show_time=False, background=background)
+            logger.to_console = lambda message: None
+            logger.log('first')
+            logger.log('WARNING: second')
+            logger.close()
+        with open('test.log', encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'first\nWARNING: second\n' * 2)
+        remove_file('test.log')
+
+        logger = Logger('test.log', show_time=False, level=WARNING, buffer_size=0, max_bytes=25, backup_count=1)
+        logger.to_console = lambda message: None
+        self.assertFalse(logger.is_enabled(DEBUG))
+        for number in range(5):
+            logger.log(f'skipped {number}')
+            logger.log(f'WARNING: {number}')
+        logger.close()
+        with open('test.log', encoding='utf-8') as f:
+            current = f.read()
+        with open('test.log.1', encoding='utf-8') as f:
+            rotated = f.read()
+        for name in ('test.log', 'test.log.1', 'test.log.2'):
+            remove_file(name)
+
+        writes = []
+        logger = Logger('test.log', show_time=False, console=io.StringIO())
+        logger.console.write = writes.append
+        threads = [threading.Thread(target=lambda: [logger.log(f'message {n}') for n in range(50)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        logger.close()
+        remove_file('test.log')
+
+        self.assertEqual(current, 'WARNING: 4\n')
+        self.assertEqual(rotated, 'WARNING: 2\nWARNING: 3\n')
+        self.assertEqual(len(writes), 4 * 50)
+        self.assertTrue(all(text.startswith('message') and text.endswith('\n') for text in writes))  # one call per line
+
+    def test_reusable_service(self):
+        """
+        Test for several runs and daemon polls by one service object
+        """
+        remove_file('test.db')
+        server = StubServer(currencies=3, weekends=False).serve_in_thread()
+        service = CurrencyService('test.db', Logger('test.log', enable=False), url=server.url)
+        self.assertFalse(exists('test.db'))  # constructor has no side effects
+
+        first = service.run('11.05.2021', ['1', '2'])
+        second = service.run('11.05.2021')
+        stop_event = threading.Event()
+        stop_event.set()
+        service.daemon(interval=1, stop_event=stop_event)  # nothing is done, the loop is already stopped
+        polled = service.poll()
+        again = service.poll()
+        service.close()
+        server.stop()
+        remove_file('test.db')
+
+        self.assertEqual([row[2] for row in first], ['Валюта 1 (  1)', 'Валюта 2 (  2)'])
+        self.assertEqual([row[2] for row in second], ['Валюта 3 (  3)'])
+        self.assertEqual(len(polled), 6)  # today and tomorrow
+        self.assertEqual(again, [])
+        self.assertEqual(server.requests, 4)
+
+    def test_bulk_load(self):
+        """
+        Test for bulk-load mode with several dates per transaction
+        """
+        remove_file('test.db')
+        db = DbController('test.db', Logger('test.log', enable=False))
+        db.begin_bulk_load(commit_interval=2)
+        journal_mode = db.cur.execute('PRAGMA journal_mode').fetchone()[0]
+        for day in range(1, 4):
+            db.write_data({'date': f'202105{day:02}', 'rows': parse_curs_on_date(sample_response(f'{day:02}.05.2021'))[1]})
+        pending = db.con.in_transaction  # third date is not committed yet
+        db.end_bulk_load()
+        committed = not db.con.in_transaction
+        db.begin_bulk_load(commit_interval=2)
+        db.write_data({'date': '20210504', 'rows': parse_curs_on_date(sample_response('04.05.2021'))[1]})
+        db.abort_bulk_load()  # failed bulk load is rolled back
+        synchronous = db.cur.execute('PRAGMA synchronous').fetchone()[0]
+        db.close_db()
+
+        con = sqlite3.connect('test.db')
+        rates = con.execute('SELECT COUNT(*) FROM CURRENCY_RATES').fetchone()[0]
+        con.close()
+        for name in ('test.db', 'test.db-wal', 'test.db-shm'):
+            remove_file(name)
+
+        self.assertEqual(journal_mode, 'wal')
+        self.assertTrue(pending)
+        self.assertTrue(committed)
+        self.assertEqual(synchronous, 2)  # FULL
+        self.assertEqual(rates, 9)
+
+    def test_rates_server(self):
+        """
+        Test for HTTP read server: rates on date, range, conditional requests and errors
+        """
+        remove_file('test.db')
+        db = DbController('test.db', Logger('test.log', enable=False))
+        for day in ('08', '11'):
+            db.write_data({'date': f'202105{day}', 'rows': parse_curs_on_date(sample_response(f'{day}.05.2021'))[1]})
+        db.insert_alias('20210510', '20210508')
+        db.close_db()
+        server = RatesServer('test.db', port=0, pool_size=2).serve_in_thread()
+        client = http.client.HTTPConnection('127.0.0.1', server.port)
+
+        def get(target, headers=None):
+            client.request('GET', target, headers=headers or {})
+            response = client.getresponse()
+            return response, response.read()
+
+        response, body = get('/rates?date=10.05.2021&codes=978,840')  # Saturday's set is valid till Monday
+        etag = response.getheader('ETag')
+        cache_control = response.getheader('Cache-Control')
+        rates = json.loads(body)
+        not_modified, empty = get('/rates?date=10.05.2021&codes=840,978', {'If-None-Match': etag})
+        not_saved, _ = get('/rates?date=09.05.2021&codes=840')  # Sunday is neither saved nor known as alias
+        range_response, range_body = get('/rates/range?from=01.05.2021&to=31.05.2021&codes=156')
+        bad, _ = get('/rates?date=2021-05-10')
+        unknown, _ = get('/currencies')
+        db = DbController('test.db', Logger('test.log', enable=False))  # saved date is replaced by another process
+        changed = sample_response('08.05.2021').replace('74.0448', '75.0000')
+        db.write_data({'date': '20210508', 'rows': parse_curs_on_date(changed)[1]}, replace=True)
+        db.close_db()
+        replaced, replaced_body = get('/rates?date=10.05.2021&codes=840,978', {'If-None-Match': etag})
+        con = sqlite3.connect('test.db')
+        con.execute('DROP TABLE CURRENCY_ALIAS')
+        con.commit()
+        con.close()
+        broken, broken_body = get('/rates?date=12.05.2021')  # database errors are answered, connection is kept
+        client.close()
+        server.stop()
+        remove_file('test.db')
+        con = sqlite3.connect('test.db')  # database which is not migrated is not served
+        con.execute('CREATE TABLE CURRENCY_ORDER (id INTEGER PRIMARY KEY, ondate TEXT)')
+        con.close()
+        with self.assertRaises(SchemaError):
+            RatesServer('test.db', port=0).serve_in_thread()
+        remove_file('test.db')
+
+        self.assertEqual(response.status, 200)
+        self.assertIn('must-revalidate', cache_control)
+        self.assertEqual(rates['ondate'], '08.05.2021')
+        self.assertEqual([rate['alphabetic_code'] for rate in rates['rates']], ['USD', 'EUR'])
+        self.assertEqual(rates['rates'][0]['rate_value'], 740448)
+        self.assertEqual((not_modified.status, empty), (304, b''))
+        self.assertEqual(not_saved.getheader('Cache-Control'), 'public, max-age=60')
+        self.assertEqual(range_response.getheader('Cache-Control'), 'public, max-age=60')
+        self.assertEqual(replaced.status, 200)
+        self.assertEqual(json.loads(replaced_body)['rates'][0]['rate_value'], 750000)
+        self.assertEqual(broken.status, 500)
+        self.assertIn('CURRENCY_ALIAS', json.loads(broken_body)['error'])
+        self.assertEqual([row[0] for row in json.loads(range_body)['rows']], ['08.05.2021', '11.05.2021'])
+        self.assertEqual(bad.status, 400)
+        self.assertEqual(unknown.status, 404)
+
+    def test_export(self):
+        """
+        Test for streaming export of date x currency matrix to CSV, JSON Lines and npy files
+        """
+        remove_file('test.db')
+        db = DbController('test.db', Logger('test.log', enable=False))
+        db.write_data({'date': '20210508', 'rows': parse_curs_on_date(sample_response('08.05.2021'))[1]})
+        db.write_data({'date': '20210511', 'rows': parse_curs_on_date(sample_response('11.05.2021'))[1][:2]})
+        usd = parse_curs_on_date(sample_response('12.05.2021'))[1][0]
+        db.write_data({'date': '20210512', 'rows': [usd._replace(rate='-')]})  # rate value is NULL
+        db.close_db()
+
+        csv_count = export('test.db', 'test.csv', 'csv')
+        jsonl_count = export('test.db', 'test.jsonl', 'jsonl', codes=['840'])
+        npy_count = export('test.db', 'test.npy', 'npy', date_from='09.05.2021', date_to='11.05.2021')
+        with open('test.csv', encoding='utf-8') as f:
+            csv_lines = f.read().splitlines()
+        with open('test.jsonl', encoding='utf-8') as f:
+            jsonl_lines = [json.loads(line) for line in f]
+        with open('test.npy', 'rb') as f:
+            npy = f.read()
+        with open('test-dates.npy', 'rb') as f:
+            dates = f.read()
+        header_size = 10 + struct.unpack('<H', npy[8:10])[0]
+        matrix = array('d', npy[header_size:]).tolist()
+        for name in ('test.db', 'test.csv', 'test.jsonl', 'test.npy', 'test-dates.npy', 'test.json'):
+            remove_file(name)
+
+        self.assertEqual((csv_count, jsonl_count, npy_count), (3, 3, 1))
+        self.assertEqual(csv_lines, ['date,CNY,USD,EUR', '2021-05-08,11.52052,74.0448,89.9828',
+                                     '2021-05-11,,74.0448,89.9828', '2021-05-12,,,'])
+        self.assertEqual(jsonl_lines[2], {'date': '2021-05-12', 'rates': {'840': None}})
+        self.assertEqual(jsonl_lines[1], {'date': '2021-05-11', 'rates': {'840': 74.0448}})
+        self.assertEqual(header_size % 64, 0)
+        self.assertIn(b"'shape': (1, 2)", npy[:header_size])
+        self.assertEqual(matrix, [74.0448, 89.9828])
+        self.assertEqual(array('i', dates[128:]).tolist(), [20210511])
+
+    def test_analytics(self):
+        """
+        Test for cross rates, returns and window statistics of rate history
+        """
+        remove_file('test.db')
+        db = DbController('test.db', Logger('test.log', enable=False))
+        for day, usd in (('08', '70.0000'), ('11', '77.0000'), ('12', '73.5000')):
+            rows = parse_curs_on_date(sample_response(f'{day}.05.2021').replace('74.0448', usd))[1]
+            db.write_data({'date': f'202105{day}', 'rows': rows})
+        db.close_db()
+        history = RateHistory.load('test.db', codes=['840', '978', '156'])
+        remove_file('test.db')
+
+        nan = float('nan')
+        self.assertEqual(history.codes, ['156', '840', '978', '643'])
+        self.assertAlmostEqual(history.rate('156', '10.05.2021'), 11.52052)  # scale is 10
+        self.assertAlmostEqual(history.cross_rate('978', '840')[0], 89.9828 / 70)
+        matrix = history.cross_matrix('12.05.2021', ['840', '643'])
+        self.assertEqual(matrix, [[1.0, 73.5], [1 / 73.5, 1.0]])
+        self.assertEqual([round(value, 4) for value in history.returns('840')], [0.1, -0.0455])
+        self.assertEqual(len(history.volatility('840', 2)), 1)
+        self.assertEqual(history.rolling('840', 2)['max'].tolist(), [77.0, 77.0])
+        self.assertEqual(history.stats('840', '09.05.2021'), {'count': 2, 'min': 73.5, 'max': 77.0, 'mean': 75.25})
+        self.assertEqual(rolling_min([3.0, 1.0, 2.0, 5.0, 4.0], 3).tolist(), [1.0, 1.0, 2.0])
+        self.assertEqual(rolling_max([3.0, nan, 2.0, 5.0, 4.0], 2).tolist()[2:], [5.0, 5.0])
+        self.assertEqual(rolling_mean([1.0, 2.0, 3.0, 6.0], 2).tolist(), [1.5, 2.5, 4.5])
+
+    def test_sync(self):
+        """
+        Test for incremental sync: only missing dates are requested, weekends are remembered as aliases
+        """
+        remove_file('test.db')
+        server = StubServer(currencies=3).serve_in_thread()  # 09.05.2021 and 10.05.2021 are answered by 08.05.2021
+        service = CurrencyService('test.db', Logger('test.log', enable=False), url=server.url, commit_interval=1)
+        service.run('11.05.2021')
+        report, failed = service.sync('07.05.2021', '12.05.2021')
+        requests = server.requests
+        aliases = service.database().cur.execute('SELECT date, ondate FROM CURRENCY_ALIAS ORDER BY date').fetchall()
+        missing = service.database().missing_dates(['20210509', '20210511', '20210513'])
+        second, _ = service.sync('07.05.2021', '12.05.2021')
+        service.close()
+        server.stop()
+        remove_file('test.db')
+
+        self.assertEqual(requests, 1 + 5)  # 11.05.2021 is already saved
+        self.assertEqual(failed, [])
+        self.assertEqual(len(report), 3 * 3)  # 07, 08 and 12 of May
+        self.assertEqual(aliases, [('20210509', '20210508'), ('20210510', '20210508')])
+        self.assertEqual(missing, ['20210513'])
+        self.assertEqual((second, server.requests), ([], requests))
+        self.assertEqual(gaps(['20210101', '20210102', '20210105']), [('20210101', '20210102'), ('20210105', '20210105')])
+
+    def test_dynamic_strategy(self):
+        """
+        Test for fetching range of few currencies by one GetCursDynamicXML request per currency
+        """
+        remove_file('test.db')
+        server = StubServer(currencies=5).serve_in_thread()
+        service = CurrencyService('test.db', Logger('test.log', enable=False), url=server.url)
+        report, failed = service.run_range('03.05.2021', '16.05.2021', ['2', '4'])
+        dynamic_requests = server.requests
+        daily = service.run('11.05.2021')  # rows of other currencies are added to the same order
+        rows = service.database().rates_on_date('20210511', ['2'])
+        orders = service.database().cur.execute('SELECT COUNT(*) FROM CURRENCY_ORDER').fetchone()[0]
+        aliases = service.database().cur.execute('SELECT date, ondate FROM CURRENCY_ALIAS ORDER BY date').fetchall()
+        service.directory.get('4')['internal_code'] = None  # currency can not be requested by GetCursDynamicXML
+        requests = server.requests
+        fallback, _ = service.run_range('17.05.2021', '30.05.2021', ['2', '4'])
+        fallback_requests = server.requests - requests
+        service.close()
+        server.stop()
+        remove_file('test.db')
+
+        self.assertEqual(plan_strategy(14, ['2', '4']), 'dynamic')
+        self.assertEqual(plan_strategy(2, ['2', '4']), 'daily')
+        self.assertEqual(plan_strategy(365, None), 'daily')
+        self.assertEqual(dynamic_requests, 1 + 2)  # currency directory and one request per currency
+        self.assertEqual(failed, [])
+        self.assertEqual(orders, 10)  # rates are not set on Sundays and Mondays
+        self.assertEqual(aliases, [('20210509', '20210508'), ('20210510', '20210508'), ('20210516', '20210515')])
+        self.assertEqual(fallback_requests, 14)  # daily requests
+        self.assertEqual(len(fallback), 2 * 10)
+        self.assertEqual(len(report), 2 * 10)
+        self.assertEqual(len(daily), 3)
+        self.assertEqual(rows[0]['name'], 'Валюта 2')
+        self.assertEqual((rows[0]['alphabetic_code'], rows[0]['scale']), ('AAC', 100))
+
+    def test_metrics(self):
+        """
+        Test for stage metrics export and profile stats of a run
+        """
+        remove_file('test.db')
+        server = StubServer(currencies=3, weekends=False).serve_in_thread()
+        service = OnDateCurs('test.db', options=['--from=10.05.2021', '--to=11.05.2021', '--codes=*', '--profile',
+                                                 '--metrics=test-metrics.json'], log_enable=False, url=server.url)
+        OnDateCurs('test.db', options=['--date=11.05.2021', '--codes=*', '--metrics=test-metrics.prom'],
+                   log_enable=False, url=server.url)
+        client = SoapClient(server.url, Logger('test.log', enable=False))
+        data = client.post(SoapTemplate('soap-template.xml').render(date='2021-05-11'))
+        client.close()
+        server.stop()
+        with open('test-metrics.json', encoding='utf-8') as f:
+            metrics = json.load(f)
+        with open('test-metrics.prom', encoding='utf-8') as f:
+            prometheus = f.read()
+        profiled = exists('ondatecurs.prof')
+        for name in ('test.db', 'test-metrics.json', 'test-metrics.prom', 'ondatecurs.prof'):
+            remove_file(name)
+
+        self.assertEqual(set(metrics['timers']), {'fetch', 'parse', 'dedupe', 'insert', 'stats', 'write', 'commit'})
+        self.assertEqual(metrics['timers']['fetch']['count'], 2)
+        self.assertEqual(metrics['counters']['rows_inserted'], 6)
+        self.assertGreater(metrics['counters']['bytes_received'], 0)
+        self.assertLess(client.metrics.snapshot()['counters']['bytes_received'], len(data))  # gzip body is counted
+        self.assertEqual(service.service.metrics.snapshot()['counters']['orders_inserted'], 2)
+        self.assertIn('currency_service_rows_ignored_total 3', prometheus)
+        self.assertIn('currency_service_stage_seconds_count{stage="fetch"} 1', prometheus)
+        self.assertTrue(profiled)
+
+    def test_compact_rows(self):
+        """
+        Test for passing parsed records to database without copies
+        """
+        remove_file('test.db')
+        rows = parse_curs_on_date(sample_response('11.05.2021'))[1]
+        db = DbController('test.db', Logger('test.log', enable=False))
+        db.cur.execute("INSERT INTO CURRENCY_ORDER (id, ondate) VALUES (1, '20210511')")
+        inserted = db.insert_order_cur_data('1', rows + [rows[0]])
+        saved = db.rates_on_date('20210511', ['156'])
+        db.close_db()
+        remove_file('test.db')
+
+        self.assertEqual(len(inserted), 3)
+        self.assertTrue(all(new is old for new, old in zip(inserted, rows)))
+        self.assertEqual((saved[0]['scale'], saved[0]['rate_value']), (10, 1152052))
+
+    def test_fetch_policy(self):
+        """
+        Test for retries, circuit breaker, hedged requests and deadline of web service requests
+        """
+        remove_file('test.db')
+        logger = Logger('test.log', enable=False)
+        server = StubServer(currencies=3, weekends=False, failures=[0]).serve_in_thread()
+        service = CurrencyService('test.db', logger, url=server.url)
+        retried = service.run('11.05.2021')
+        retries = service.metrics.snapshot()['counters']['retries']
+        service.close()
+        server.stop()
+        remove_file('test.db')
+
+        # upstream keeps failing: circuit is opened after 5 failures, other dates are failed without requests
+        server = StubServer(currencies=3, failures=range(100)).serve_in_thread()
+        service = CurrencyService('test.db', logger, url=server.url, workers=1, retries=0)
+        report, failed = service.run_range('01.05.2021', '08.05.2021')
+        rejections = service.metrics.snapshot()['counters']['circuit_rejections']
+        service.close()
+        failing_requests = server.arrived
+        # failed date of single date run is a result, the process is not stopped
+        OnDateCurs('test.db', options=['--date=11.05.2021', '--codes=*', '--retries=0'], log_enable=False,
+                   url=server.url)
+        server.stop()
+        remove_file('test.db')
+
+        # request which is slower than median latency is hedged by the second one
+        server = StubServer(currencies=3, stalls=[5], stall=2.0).serve_in_thread()
+        body = SoapTemplate('soap-template.xml').render(date='2021-05-11')
+        client = SoapClient(server.url, logger, pool_size=2)
+        policy = FetchPolicy(client, logger, hedge_percentile=50, hedge_min_samples=5)
+        for _ in range(5):
+            policy.post(body)
+        start = time.perf_counter()
+        hedged = policy.post(body)
+        hedged_seconds = time.perf_counter() - start
+        counters = policy.metrics.snapshot()['counters']
+        policy.close()
+        client.close()
+        server.stop()
+
+        server = StubServer(currencies=3, stalls=[0], stall=2.0).serve_in_thread()
+        client = SoapClient(server.url, logger)
+        policy = FetchPolicy(client, logger, deadline=0.3, retries=0, breaker=CircuitBreaker())
+        start = time.perf_counter()
+        with self.assertRaises(SoapError):
+            policy.post(body)
+        deadline_seconds = time.perf_counter() - start
+        client.close()
+        server.stop()
+
+        class CorruptClient(SoapClient):
+            def exchange(self, connection, body, headers):
+                return 200, 'OK', 'gzip', b'\x1f\x8b\x08\x00truncated'
+
+        with self.assertRaises(SoapError):  # corrupt gzip body is a failed request
+            CorruptClient('http://127.0.0.1:1/', logger).post(body)
+
+        class BadRequestClient:
+            def post(self, body, timeout=None):
+                raise SoapError('Bad Request', 400)
+
+        # answers to bad requests are not failures of web service, they do not open the circuit
+        rejected = FetchPolicy(BadRequestClient(), logger, breaker=CircuitBreaker(failure_threshold=2))
+        for _ in range(3):
+            with self.assertRaises(SoapError) as raised:
+                rejected.post(body)
+            self.assertEqual(raised.exception.status, 400)
+
+        self.assertEqual(len(retried), 3)
+        self.assertEqual(retries, 1)
+        self.assertEqual((report, len(failed)), ([], 8))
+        self.assertEqual(failing_requests, 5)
+        self.assertEqual(rejections, 3)
+        self.assertIn(b'<ValuteData', hedged)
+        self.assertLess(hedged_seconds, 1.5)
+        self.assertEqual((counters['hedges'], counters['hedge_wins']), (1, 1))
+        self.assertLess(deadline_seconds, 1.5)
+        self.assertEqual(policy.breaker.failures, 1)
+        self.assertEqual(rejected.breaker.state, 'closed')
+
+    def test_in_memory_database(self):
+        """
+        Test for in-memory database loaded from file and saved back by snapshots
+        """
+        remove_file('test.db')
+        logger = Logger('test.log', enable=False)
+        db = DbController('test.db', logger)
+        db.write_data({'date': '20210511', 'rows': parse_curs_on_date(sample_response('11.05.2021'))[1]})
+        db.close_db()
+
+        db = DbController('test.db', logger, memory='file:test-rates?mode=memory&cache=shared')
+        loaded = db.rates_on_date('20210511', ['840'])
+        db.write_data({'date': '20210512', 'rows': parse_curs_on_date(sample_response('12.05.2021'))[1]})
+        reader = sqlite3.connect('file:test-rates?mode=memory&cache=shared', uri=True)
+        shared_orders = reader.execute('SELECT COUNT(*) FROM CURRENCY_ORDER').fetchone()[0]
+        reader.close()
+        con = sqlite3.connect('test.db')
+        orders_before_close = con.execute('SELECT COUNT(*) FROM CURRENCY_ORDER').fetchone()[0]
+        con.close()
+        db.close_db()
+        con = sqlite3.connect('test.db')
+        orders_after_close = con.execute('SELECT COUNT(*) FROM CURRENCY_ORDER').fetchone()[0]
+        con.close()
+
+        cache = ResponseCache('test-cache')
+        for date in ('13.05.2021', '14.05.2021'):
+            cache.put(date, sample_response(date).encode('utf-8'))
+        service = OnDateCurs('test.db', options=['--from=13.05.2021', '--to=14.05.2021', '--codes=*', '--in-memory',
+                                                 '--snapshot-interval=0.001', '--strategy=daily', '--offline',
+                                                 '--cache=test-cache'], log_enable=False)
+        snapshots = service.service.metrics.snapshot()['timers']['snapshot']['count']
+        con = sqlite3.connect('test.db')
+        orders_after_run = con.execute('SELECT COUNT(*) FROM CURRENCY_ORDER').fetchone()[0]
+        con.close()
+        remove_file('test.db')
+        shutil.rmtree('test-cache', ignore_errors=True)
+
+        self.assertEqual(loaded[0]['rate_value'], 740448)
+        self.assertEqual(shared_orders, 2)
+        self.assertEqual((orders_before_close, orders_after_close), (1, 2))
+        self.assertEqual(orders_after_run, 4)
+        self.assertGreaterEqual(snapshots, 2)  # at commit of range and at close
+
+    def test_report_renderer(self):
+        """
+        Test for streaming report renderer in table, CSV and JSON Lines formats
+        """
+        rows = (('1', '11.05.2021', f'Валюта {n}', n, 74.0448) for n in range(5000))
+        table = io.StringIO()
+        count = render_table(rows, stream=table, header=['id', 'date', 'name', 'scale', 'rate'], sample_size=10)
+        lines = table.getvalue().splitlines()
+        small = io.StringIO()
+        render_table([('a', 1), ('bb', 22)], stream=small)
+        csv_text = io.StringIO()
+        render_table([('Евро', '1', '89,9828')], stream=csv_text, header=['name', 'scale', 'rate'], fmt='csv')
+
+        remove_file('test.db')
+        shutil.rmtree('test-cache', ignore_errors=True)
+        ResponseCache('test-cache').put('11.05.2021', sample_response('11.05.2021').encode('utf-8'))
+        OnDateCurs('test.db', options=['--date=11.05.2021', '--codes=840,978', '--offline', '--cache=test-cache',
+                                       '--report=jsonl', '--report-file=test-report.jsonl'], log_enable=False)
+        with open('test-report.jsonl', encoding='utf-8') as f:
+            report = [json.loads(line) for line in f]
+        remove_file('test.db')
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):  # machine-readable report is printed even if logging is disabled
+            OnDateCurs('test.db', options=['--date=11.05.2021', '--codes=840', '--offline', '--cache=test-cache',
+                                           '--report=csv'], log_enable=False)
+        console = io.StringIO()
+        logger = Logger('test-console.log', console=console)
+        logger.log('Service have been started')
+        logger.close()
+        remove_file('test-console.log')
+        remove_file('test-report.jsonl')
+        remove_file('test.db')
+        shutil.rmtree('test-cache')
+
+        self.assertEqual(count, 5000)
+        self.assertEqual(len(lines), 5000 + 4)
+        self.assertEqual(lines[1], '|  id |       date |     name | scale |    rate |')
+        self.assertEqual(lines[3], '|   1 | 11.05.2021 | Валюта 0 |     0 | 74.0448 |')
+        self.assertEqual(lines[1003], '|   1 | 11.05.2021 |Валюта 1000 |  1000 | 74.0448 |')  # wider than sample
+        self.assertEqual(small.getvalue(), '------------\n|   a |  1 |\n|  bb | 22 |\n------------\n')
+        self.assertEqual(csv_text.getvalue(), 'name,scale,rate\nЕвро,1,"89,9828"\n')
+        self.assertEqual(report[0], {'order_id': '1', 'date': '11.05.2021', 'currency': 'Доллар США (840)',
+                                     'scale': '1', 'rate': '74.0448'})
+        self.assertEqual(len(report), 2)
+        self.assertEqual(stdout.getvalue().splitlines(),
+                         ['order_id,date,currency,scale,rate', '1,11.05.2021,Доллар США (840),1,74.0448'])
+        self.assertTrue(console.getvalue().endswith('Service have been started\n'))
+
+    def test_currency_directory(self):
+        """
+        Test for resolving numeric and alphabetic currency codes by cached currency directory
+        """
+        remove_file('test.db')
+        logger = Logger('test.log', enable=False)
+        server = StubServer(currencies=5, weekends=False).serve_in_thread()
+        service = CurrencyService('test.db', logger, url=server.url)
+        resolved = service.resolve_codes(['aab', '003', 'AAD', '999', 'XYZ'])
+        service.close()
+        directory_requests = server.requests
+
+        # directory saved in database is used by other runs, unknown alphabetic code is rejected before currency data
+        # requests, unknown numeric code is requested as is (historical currency)
+        with self.assertRaises(SystemExit):
+            OnDateCurs('test.db', options=['--date=11.05.2021', '--codes=AAB,XYZ'], log_enable=False, url=server.url)
+        rejected_requests = server.requests
+        OnDateCurs('test.db', options=['--date=11.05.2021', '--codes=AAB,4,999'], log_enable=False, url=server.url)
+        server.stop()
+        service = CurrencyService('test.db', logger, offline=True)
+        rows = service.database().rates_on_date('20210511')
+        service.database().cur.execute('DELETE FROM CURRENCY_DIRECTORY')
+        offline = service.resolve_codes(['AAB', '5', 'AAC'])  # directory of saved rows
+        service.close()
+        remove_file('test.db')
+
+        self.assertEqual(resolved, (['1', '3', '999'], ['XYZ']))
+        self.assertEqual(directory_requests, 1)
+        self.assertEqual(rejected_requests, 2)  # saved directory is refreshed once because of unknown code
+        self.assertEqual(server.requests, 4)  # directory is refreshed because of unknown 999, one currency data request
+        self.assertEqual(sorted(row['alphabetic_code'] for row in rows), ['AAB', 'AAE'])
+        self.assertEqual(offline, (['1', '5'], ['AAC']))
+
+    def test_rewrite_replace(self):
+        """
+        Test for replacing currency data of requested dates only with skipping of unchanged dates
+        """
+        remove_file('test.db')
+        logger = Logger('test.log', enable=False)
+        service = OfflineService('test.db', logger, strategy='daily')
+        service.run_range('11.05.2021', '12.05.2021')
+        service.database().cur.execute("UPDATE CURRENCY_ORDER SET content_hash = NULL WHERE ondate = '20210511'")
+        service.close()
+
+        service = ChangedService('test.db', logger, rewrite=True, strategy='daily')
+        report, _ = service.run_range('11.05.2021', '13.05.2021')
+        counters = service.metrics.snapshot()['counters']
+        rerun, _ = service.run_range('11.05.2021', '13.05.2021')
+        rerun_counters = service.metrics.snapshot()['counters']
+        usd = service.database().rates_on_date('20210512', ['840'])
+        rates = service.database().cur.execute('SELECT COUNT(*) FROM CURRENCY_RATES').fetchone()[0]
+        hashes = service.database().cur.execute('SELECT COUNT(content_hash) FROM CURRENCY_ORDER').fetchone()[0]
+        service.close()
+        remove_file('test.db')
+
+        self.assertEqual(len(report), 1 + 3)  # changed rate of 12.05 and new currency set of 13.05
+        self.assertEqual(report[0][1:], ('12.05.2021', 'Доллар США (840)', '1', '75.0000'))
+        self.assertEqual(counters['rows_replaced'], 1)
+        self.assertEqual(counters.get('dates_unchanged', 0), 0)  # hash of 11.05 is unknown, rows are compared
+        self.assertEqual(rerun, [])
+        self.assertEqual(rerun_counters['dates_unchanged'], 3)
+        self.assertEqual((usd[0]['rate'], usd[0]['rate_value']), ('75.0000', 750000))
+        self.assertEqual((rates, hashes), (9, 3))
+
+    def test_rate_stats(self):
+        """
+        Test for incrementally maintained monthly and yearly statistics of rates
+        """
+        remove_file('test.db')
+        logger = Logger('test.log', enable=False)
+        service = OfflineService('test.db', logger, strategy='daily')
+        service.run_range('30.04.2021', '12.05.2021', ['840', '156'])
+        service.close()
+        service = ChangedService('test.db', logger, rewrite=True, strategy='daily')
+        service.run_range('12.05.2021', '12.05.2021', ['840', '156'])
+        db = service.database()
+        month = db.stats('202105')
+        year = db.stats('2021', ['840'])
+        query = 'SELECT period, numeric_code, count, round(total, 6), minimum, maximum, last_date, last_value ' \
+                'FROM CURRENCY_STATS ORDER BY period, numeric_code'
+        incremental = db.cur.execute(query).fetchall()
+        db.rebuild_stats()
+        rebuilt = db.cur.execute(query).fetchall()
+        service.close()
+        remove_file('test.db')
+
+        self.assertEqual([row['numeric_code'] for row in month], ['156', '840'])
+        self.assertEqual((month[0]['count'], month[0]['last']), (12, 11.52052))  # rate of 10 yuans is 115.2052
+        self.assertEqual((month[1]['minimum'], month[1]['maximum'], month[1]['last']), (74.0448, 75.0, 75.0))
+        self.assertEqual(month[1]['last_date'], '20210512')
+        self.assertAlmostEqual(month[1]['average'], (74.0448 * 11 + 75.0) / 12)
+        self.assertEqual(year[0]['count'], 13)
+        self.assertEqual(incremental, rebuilt)
+        self.assertEqual(len(rebuilt), 2 * 3)  # months 04.2021 and 05.2021 and year 2021 of 2 currencies
+
+    def test_converter(self):
+        """
+        Test for exact conversion of amounts by the last rates published on or before the date
+        """
+        remove_file('test.db')
+        service = ChangedService('test.db', Logger('test.log', enable=False), strategy='daily')
+        service.run_range('11.05.2021', '12.05.2021')
+        cny = parse_curs_on_date(sample_response('13.05.2021'))[1][2]
+        service.database().write_data({'date': '20210513', 'rows': [cny]})  # partial order
+        service.close()
+        converter = Converter.load('test.db')
+        partial = Converter.load('test.db', codes=['usd'], date_from='12.05.2021')
+        seeded = Converter.load('test.db', date_from='14.05.2021')  # the last rate of every currency is loaded
+        remove_file('test.db')
+
+        self.assertEqual(converter.convert(100, '840', 'RUB', '11.05.2021'), Decimal('7404.48'))
+        self.assertEqual(converter.convert('100', 'USD', '643', '15.05.2021'), Decimal('7500.00'))  # Saturday
+        self.assertEqual(converter.convert(1000, 'CNY', 'RUB', '12.05.2021'), Decimal('11520.52'))  # scale is 10
+        self.assertEqual(converter.convert(0.1, 'RUB', 'CNY', '12.05.2021', places=6), Decimal('0.008680'))
+        self.assertEqual(converter.convert(100, 'usd', 'eur', '12.05.2021', places=2), Decimal('83.35'))
+        self.assertEqual(converter.rate('156', '11.05.2021'), Decimal('11.52052'))
+        items = [(Decimal('10.50'), '11.05.2021'), (1, '12.05.2021'), (2, '11.05.2021')]
+        self.assertEqual(converter.convert_many(items, 'USD', 'RUB', places=2),
+                         [Decimal('777.47'), Decimal('75.00'), Decimal('148.09')])
+        self.assertEqual(partial.convert(1, 'USD', 'RUB', '13.05.2021'), Decimal('75.0000'))
+        self.assertEqual(seeded.convert(1, 'USD', 'RUB', '14.05.2021'), Decimal('75.0000'))
+        self.assertEqual(seeded.lookup('CNY', '20210514')[2], '20210513')
+        with self.assertRaises(KeyError):  # rates start later than the date
+            converter.convert(1, 'USD', 'RUB', '10.05.2021')
+        with self.assertRaises(KeyError):
+            partial.convert(1, 'EUR', 'RUB', '12.05.2021')
 
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
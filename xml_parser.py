@@ -1,12 +1,50 @@
 """A primitive xml/html parser for extracting contents of tags.
 It was also possible to use ready to use modules (xml for example), but I have built this one from scratch to decrease
     count of third-party modules.
+Web service responses are parsed by single-pass streaming parser based on standard <xml.parsers.expat> module.
+Regex based functions are kept as a fallback for malformed responses.
 
 .. moduleauthor:: Max Dubrovin <mihadxdx@gmail.com>
 
 """
 
 import re
+import sys
+from xml.parsers.expat import ExpatError, ParserCreate
+
+from tables import CurrencyRow
+
+
+# tags of <ValuteCursOnDate> item and related fields of CurrencyRow (in order of CurrencyRow fields)
+CURRENCY_FIELDS = {
+    'Vname': 'name',
+    'Vcode': 'numeric_code',
+    'VchCode': 'alphabetic_code',
+    'Vnom': 'scale',
+    'Vcurs': 'rate',
+}
+
+
+# tags of <ValuteCursOnDate> item and related positions of CurrencyRow fields
+CURRENCY_FIELD_INDEX = {tag: CurrencyRow._fields.index(key) for tag, key in CURRENCY_FIELDS.items()}
+RATE_INDEX = CurrencyRow._fields.index('rate')  # other fields are repeated in every currency set, so they are interned
+
+# tags of <EnumValutes> item of EnumValutesXML response and related keys of currency directory dict
+ENUM_FIELDS = {
+    'Vcode': 'internal_code',
+    'Vname': 'name',
+    'VnumCode': 'numeric_code',
+    'VcharCode': 'alphabetic_code',
+    'Vnom': 'scale',
+}
+
+# tags of <ValuteCursDynamic> item of GetCursDynamicXML response and related keys of rate dict
+DYNAMIC_FIELDS = {
+    'CursDate': 'date',
+    'Vcode': 'internal_code',
+    'Vnom': 'scale',
+    'Vcurs': 'rate',
+}
 
 
 def tag_attribute(text: str, tag_name: str, attr_name: str):
@@ -17,7 +55,7 @@ def tag_attribute(text: str, tag_name: str, attr_name: str):
     :param attr_name: Attribute name of searched tag
     :return: Value of extracted attribute
     """
-    regex = f'<{tag_name}.*{attr_name}="(.*?)"'
+    regex = f'<{tag_name}[^>]*?{attr_name}="(.*?)"'
     match = re.search(regex, text)
     if match:
         return match.group(1)
@@ -45,3 +83,140 @@ def tag_content(text, tag_name, find_all=False):
 def xml_date(date: str):
     """Convert DD.MM.YYYY date to YYYY-MM-DD format"""
     return f'{date[6:]}-{date[3:5]}-{date[:2]}'
+
+
+def parse_curs_on_date(data, chunk_size=1 << 16):
+    """Parse GetCursOnDateXML response of web service in one pass without decoding of whole response into str.
+
+    :param data: Response body (bytes) or binary file-like object. Large archived responses should be given as
+        file-like objects, they are read by chunks.
+    :param chunk_size: Size of chunk to read from file-like object
+    :return: tuple of 'OnDate' attribute value ('YYYYMMDD' string or False if there is no such attribute) and list
+        of CurrencyRow records
+    :raises ExpatError: if response is not well-formed xml
+    """
+    ondate = False
+    currencies = []
+    item = None  # field values of currently parsed <ValuteCursOnDate> tag
+    field = None  # position of currently parsed item field
+    text = []
+
+    def start_element(name, attrs):
+        nonlocal ondate, item, field
+        if item is not None:
+            field = CURRENCY_FIELD_INDEX.get(name)
+            text.clear()
+        elif name == 'ValuteCursOnDate':
+            item = [''] * len(CurrencyRow._fields)
+        elif name == 'ValuteData':
+            ondate = attrs.get('OnDate', False)
+
+    def end_element(name):
+        nonlocal item, field
+        if field is not None:
+            value = ''.join(text).rstrip()
+            item[field] = value if field == RATE_INDEX else sys.intern(value)
+            field = None
+        elif name == 'ValuteCursOnDate':
+            currencies.append(CurrencyRow._make(item))
+            item = None
+
+    def character_data(data):
+        if field is not None:
+            text.append(data)
+
+    parser = ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+
+    if hasattr(data, 'read'):
+        while True:
+            chunk = data.read(chunk_size)
+            if not chunk:
+                break
+            parser.Parse(chunk, False)
+        parser.Parse(b'', True)
+    else:
+        parser.Parse(data, True)
+    return ondate, currencies
+
+
+def parse_curs_on_date_regex(text: str):
+    """Regex based fallback of parse_curs_on_date function (for responses which are not well-formed xml)
+
+    :param text: Xml formatted text
+    :return: the same tuple as parse_curs_on_date returns
+    """
+    ondate = tag_attribute(text, 'ValuteData', 'OnDate')
+    currencies = [
+        CurrencyRow(*(tag_content(item, tag) for tag in CURRENCY_FIELDS))
+        for item in tag_content(text, 'ValuteCursOnDate', find_all=True)
+    ]
+    return ondate, currencies
+
+
+def parse_items(data, item_tag, fields):
+    """Parse flat items of web service response in one pass
+
+    :param data: Response body (bytes or str)
+    :param item_tag: Tag name of item (for example 'EnumValutes')
+    :param fields: Dict of item child tags and related keys of result dicts
+    :return: list of dicts with all keys of fields (missing values are empty strings)
+    :raises ExpatError: if response is not well-formed xml
+    """
+    items = []
+    item = None
+    field = None
+    text = []
+
+    def start_element(name, attrs):
+        nonlocal item, field
+        if item is not None:
+            field = fields.get(name)
+            text.clear()
+        elif name == item_tag:
+            item = {}
+
+    def end_element(name):
+        nonlocal item, field
+        if field is not None:
+            item[field] = ''.join(text).strip()
+            field = None
+        elif name == item_tag:
+            items.append({key: item.get(key, '') for key in fields.values()})
+            item = None
+
+    def character_data(data):
+        if field is not None:
+            text.append(data)
+
+    parser = ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    parser.Parse(data, True)
+    return items
+
+
+def parse_enum_valutes(data):
+    """Parse EnumValutesXML response: directory of currencies with internal codes of web service
+
+    :return: list of dicts with following keys: 'internal_code', 'name', 'numeric_code', 'alphabetic_code' and 'scale'
+    :raises ExpatError: if response is not well-formed xml
+    """
+    return parse_items(data, 'EnumValutes', ENUM_FIELDS)
+
+
+def parse_curs_dynamic(data):
+    """Parse GetCursDynamicXML response: rates of one currency at every date of range when they were set
+
+    :return: list of dicts with following keys: 'date' (YYYYMMDD), 'internal_code', 'scale' and 'rate'
+    :raises ExpatError: if response is not well-formed xml
+    """
+    items = parse_items(data, 'ValuteCursDynamic', DYNAMIC_FIELDS)
+    for item in items:
+        item['date'] = item['date'][:10].replace('-', '')  # 2021-05-11T00:00:00+03:00
+    return items